@@ -21,6 +21,10 @@ from mrcnn import visualize
 sys.path.append(os.path.join(ROOT_DIR, "samples/coco/"))  # To find local version
 import coco
 
+# Import detection store
+sys.path.append(os.path.abspath("../../deep_sort"))
+from application_util import detection_store
+
 # %matplotlib inline
 
 # Directory to save logs and trained model
@@ -35,6 +39,9 @@ if not os.path.exists(COCO_MODEL_PATH):
 # Directory of images to run detection on
 IMAGE_DIR = os.path.abspath("../../source/images")
 
+# Detection store to write results to
+DETECTION_DIR = os.path.abspath("../../source/det")
+
 
 class InferenceConfig(coco.CocoConfig):
     # Set batch size to 1 since we'll be running inference on
@@ -71,10 +78,12 @@ class_names = ['BG', 'person', 'bicycle', 'car', 'motorcycle', 'airplane',
                'sink', 'refrigerator', 'book', 'clock', 'vase', 'scissors',
                'teddy bear', 'hair drier', 'toothbrush']
 
-r = []
-file_names = next(os.walk(IMAGE_DIR))[2]
+file_names = sorted(next(os.walk(IMAGE_DIR))[2])
 start = time.time()
-for fileIdx in file_names:
+# Store the result of frame id, bounding box, scores, and class ids in a
+# detection store, one frame at a time
+writer = detection_store.DetectionStoreWriter(DETECTION_DIR)
+for frameIdx, fileIdx in enumerate(file_names):
     print("================ Processing %s ================ (Working time: %.2f sec)" % (fileIdx, time.time() - start))
     # Load a image from the images folder
     image = skimage.io.imread(os.path.join(IMAGE_DIR, fileIdx))
@@ -83,21 +92,14 @@ for fileIdx in file_names:
     results = model.detect([image], verbose=1)
 
     # Visualize results
-    r.append(results[0])
+    r = results[0]
     # visualize.display_instances(image, r['rois'], r['masks'], r['class_ids'],
     #                             class_names, r['scores'])
 
-# Store the result of frame id, bounding box, scores as .txt
-f = open("../../source/det/det.txt", 'w')
-frameIdx = 0
-while frameIdx < len(r):
-
-    for rowRois, rowScores in zip(r[frameIdx]['rois'], r[frameIdx]['scores']):
-        # Convert {(x1,y1), (x2,y2)} coord. to {(x,y), w, h} coord. and write the coord. and scores
-        print('%d,-1,%.2f,%.2f,%.2f,%.2f,%.2f,-1,-1,-1' % (frameIdx,
-                                                           rowRois[1], rowRois[0],
-                                                           rowRois[3] - rowRois[1], rowRois[2] - rowRois[0],
-                                                           rowScores), file=f)
-    frameIdx += 1
-f.close()
+    # Convert {(y1,x1), (y2,x2)} coord. to {(x,y), w, h} coord. and write the coord. and scores
+    rois = r['rois']
+    boxes = np.c_[rois[:, 1], rois[:, 0],
+                  rois[:, 3] - rois[:, 1], rois[:, 2] - rois[:, 0]]
+    writer.write(frameIdx, boxes, r['scores'], r['class_ids'])
+writer.close()
 # np.save('Mask_RCNN_bbox_result', r['rois'])
@@ -0,0 +1,92 @@
+# vim: expandtab:ts=4:sw=4
+"""Smoke test of the parallel detection stage of `video_pipeline`.
+
+Runs `detect_frames` in a `pipeline.PipelineRunner` worker thread with a stub
+model that checks that it is called in the graph it was created in, without
+loading Mask R-CNN weights or reading a video.
+
+"""
+from __future__ import division, print_function, absolute_import
+
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+import video_pipeline
+from deep_sort.application_util import pipeline
+
+
+class StubConfig(object):
+    IMAGE_MIN_DIM = 800
+    IMAGE_MAX_DIM = 1024
+
+
+class StubModel(object):
+    """Returns one detection per image and records whether `detect` ran in
+    the expected graph."""
+
+    def __init__(self, graph):
+        self.config = StubConfig()
+        self.graph = graph
+        self.num_calls = 0
+        self.num_wrong_graph = 0
+
+    def detect(self, images, verbose=0):
+        self.num_calls += 1
+        if tf.get_default_graph() is not self.graph:
+            self.num_wrong_graph += 1
+        return [{
+            "rois": np.array([[10, 20, 110, 70]]),
+            "scores": np.array([0.99]),
+            "class_ids": np.array([1])} for _ in images]
+
+
+def run_parallel(model, graph, num_frames):
+    """Run the detection stage like `video_pipeline.run` in parallel mode,
+    entering `graph` in the worker thread if it is not None."""
+    frames = [
+        (i, np.zeros((120, 160, 3), dtype=np.uint8))
+        for i in range(1, num_frames + 1)]
+
+    def detect_stage(x):
+        return video_pipeline.detect_frames(model, x)
+
+    if graph is not None:
+        detect_stage = video_pipeline.in_graph(graph, detect_stage)
+    runner = pipeline.PipelineRunner(queue_size=2)
+    runner.add_source("decode", frames)
+    runner.add_stage("detect", detect_stage)
+    return list(runner.run(sink_name="sink"))
+
+
+def main():
+    num_frames = 5
+    graph = tf.Graph()  # Not the default graph of the worker threads.
+    failed = False
+
+    model = StubModel(graph)
+    outputs = run_parallel(model, graph, num_frames)
+    ok = model.num_calls == num_frames and model.num_wrong_graph == 0 and \
+        [frame_idx for frame_idx, _, _ in outputs] == list(
+            range(1, num_frames + 1))
+    failed = failed or not ok
+    print("%-24s %d of %d calls in the model graph %s" % (
+        "detect stage in graph", model.num_calls - model.num_wrong_graph,
+        model.num_calls, "ok" if ok else "FAILED"))
+
+    # Without entering the graph, the stub must notice, otherwise the check
+    # above proves nothing.
+    model = StubModel(graph)
+    run_parallel(model, None, num_frames)
+    ok = model.num_wrong_graph == num_frames
+    failed = failed or not ok
+    print("%-24s %d of %d calls outside the model graph %s" % (
+        "detect stage unwrapped", model.num_wrong_graph, model.num_calls,
+        "ok" if ok else "FAILED"))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
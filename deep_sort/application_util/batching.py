@@ -0,0 +1,217 @@
+# vim: expandtab:ts=4:sw=4
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+
+_POLL_INTERVAL = 0.1
+
+
+class BatchResult(object):
+    """
+    The pending result of an item submitted to a `DynamicBatcher`.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def set(self, value=None, error=None):
+        self._value, self._error = value, error
+        self._event.set()
+
+    def done(self):
+        return self._event.is_set()
+
+    def get(self, timeout=None):
+        """Wait for the result.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            Maximum time to wait in seconds. If None, waits indefinitely.
+
+        Returns
+        -------
+        object
+            The result of the item. If processing of its batch failed, the
+            exception is re-raised here.
+
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError("Timeout while waiting for a batch result")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class DynamicBatcher(object):
+    """
+    Collects items that are submitted concurrently, e.g., frames of multiple
+    camera streams, into batches and processes each batch with a single call
+    in a worker thread, such that an expensive model (detector or encoder)
+    is shared by all submitters and runs on full batches under load.
+
+    A batch is processed as soon as it holds `max_batch_size` items, or
+    `timeout` seconds after its first item has been submitted, whichever
+    happens first. Hence, `timeout` bounds the additional latency that
+    batching adds under low load.
+
+    Examples
+    --------
+
+        >>> batcher = DynamicBatcher(lambda images: model.detect(images), 4)
+        >>> batcher.start()
+        >>> result = batcher(image)  # Blocks until the batch is processed.
+        >>> batcher.stop()
+
+    Parameters
+    ----------
+    process_batch : Callable[List] -> List
+        A function that takes a list of items and returns a list with one
+        result per item.
+    max_batch_size : int
+        Maximum number of items per batch.
+    timeout : float
+        Maximum time in seconds that the first item of a batch waits for
+        more items.
+    name : Optional[str]
+        The batcher name, used for statistics.
+
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, timeout=0.01,
+                 name="batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.timeout = timeout
+        self.name = name
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._num_batches = 0
+        self._num_items = 0
+        self._wait_time = 0.
+        self._busy_time = 0.
+
+    def start(self):
+        """Start the worker thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread. Items that have not been processed fail
+        with a RuntimeError."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while True:
+            try:
+                _, result, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            result.set(error=RuntimeError("Batcher '%s' stopped" % self.name))
+
+    def submit(self, item):
+        """Submit an item for processing.
+
+        Parameters
+        ----------
+        item : object
+            An item to be passed to `process_batch`.
+
+        Returns
+        -------
+        BatchResult
+            The pending result.
+
+        """
+        result = BatchResult()
+        if self._stop_event.is_set():
+            result.set(error=RuntimeError("Batcher '%s' stopped" % self.name))
+        else:
+            self._queue.put((item, result, time.time()))
+        return result
+
+    def __call__(self, item):
+        """Submit an item and wait for its result."""
+        return self.submit(item).get()
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=_POLL_INTERVAL)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.timeout
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._next_batch()
+            if len(batch) == 0:
+                continue
+            items, results, submit_times = zip(*batch)
+            t0 = time.time()
+            try:
+                values = self.process_batch(list(items))
+                if len(values) != len(items):
+                    raise ValueError(
+                        "Batcher '%s' returned %d results for %d items" % (
+                            self.name, len(values), len(items)))
+                for result, value in zip(results, values):
+                    result.set(value)
+            except Exception:
+                error = sys.exc_info()[1]
+                for result in results:
+                    result.set(error=error)
+            t1 = time.time()
+            with self._lock:
+                self._num_batches += 1
+                self._num_items += len(items)
+                self._wait_time += sum(t0 - t for t in submit_times)
+                self._busy_time += t1 - t0
+
+    def statistics(self):
+        """Returns runtime statistics as a dictionary: the number of batches
+        and items, the mean batch size, the mean time in seconds an item
+        waited for its batch, and the total processing time."""
+        with self._lock:
+            return {
+                "name": self.name,
+                "num_batches": self._num_batches,
+                "num_items": self._num_items,
+                "mean_batch_size": (
+                    float(self._num_items) / self._num_batches
+                    if self._num_batches > 0 else 0.),
+                "mean_wait_time": (
+                    self._wait_time / self._num_items
+                    if self._num_items > 0 else 0.),
+                "busy_time": self._busy_time}
+
+    def format_statistics(self):
+        """Returns a human readable summary of the statistics."""
+        s = self.statistics()
+        return "%-10s %8d batches %8d items, mean batch size %.2f, " \
+            "mean wait %.1f ms, busy %.2f s" % (
+                s["name"], s["num_batches"], s["num_items"],
+                s["mean_batch_size"], 1e3 * s["mean_wait_time"],
+                s["busy_time"])
@@ -0,0 +1,348 @@
+# vim: expandtab:ts=4:sw=4
+import json
+import os
+
+import numpy as np
+
+from .frame_index import FrameIndex
+try:
+    from ..deep_sort import quantization
+except (ImportError, ValueError):
+    # Imported as top-level package, with the deep_sort project directory
+    # (or its parent) on the module search path.
+    try:
+        from deep_sort import quantization
+    except ImportError:
+        from deep_sort.deep_sort import quantization
+
+
+"""
+Filename of the store header, which contains the column data types and the
+feature dimensionality. Each column is stored in a separate raw binary file
+next to the header.
+"""
+HEADER_FILENAME = "store.json"
+
+_FRAME_DTYPE = np.int32
+_BOX_DTYPE = np.float32
+_SCORE_DTYPE = np.float32
+_CLASS_DTYPE = np.int32
+_SCALE_DTYPE = np.float32
+
+"""
+Supported data types of stored features (see `quantization.quantize`). int8
+features are quantized per vector, with one scale factor per detection
+stored in a separate column.
+"""
+FEATURE_DTYPES = quantization.FEATURE_DTYPES
+
+
+def is_detection_store(path):
+    """Returns True if `path` is a detection store directory."""
+    return os.path.isfile(os.path.join(path, HEADER_FILENAME))
+
+
+def _column_filename(path, column):
+    return os.path.join(path, "%s.bin" % column)
+
+
+class DetectionStoreWriter(object):
+    """
+    Appends detections to a columnar detection store, one frame at a time.
+
+    A detection store is a directory with one raw binary file per column
+    (frame index, bounding box, detector score, class ID, and an optional
+    feature vector). Writing does not keep any detections in memory, and an
+    existing store can be extended by opening it again.
+
+    Examples
+    --------
+
+        >>> with DetectionStoreWriter("detections", feature_dim=128) as writer:
+        ...     writer.write(frame_idx, boxes, scores, class_ids, features)
+
+    Without features (e.g., raw detector output):
+
+        >>> with DetectionStoreWriter("detections") as writer:
+        ...     writer.write(frame_idx, boxes, scores, class_ids)
+
+    Parameters
+    ----------
+    path : str
+        Path to the store directory. Will be created if it does not exist.
+    feature_dim : int
+        Dimensionality of the feature vector. If 0, no features are stored.
+    feature_dtype : Optional[str | dtype]
+        Data type of stored features, one of `FEATURE_DTYPES`: float16 halves
+        and int8 quarters the storage requirements. Defaults to float32.
+    append : Optional[bool]
+        If True, and the store exists, new detections are appended to it.
+        Otherwise, an existing store is overwritten.
+
+    """
+
+    def __init__(self, path, feature_dim=0, feature_dtype=np.float32,
+                 append=False):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.feature_dim = int(feature_dim)
+        self.feature_dtype = np.dtype(feature_dtype)
+        if self.feature_dtype.name not in FEATURE_DTYPES:
+            raise ValueError(
+                "Invalid feature data type; must be one of %s" % (
+                    ", ".join(FEATURE_DTYPES)))
+        self._last_frame_idx = None
+        num_rows = None
+        if append and is_detection_store(path):
+            store = DetectionStore(path)
+            if store.feature_dim != self.feature_dim:
+                raise ValueError(
+                    "Feature dimensionality mismatch: store has %d, got %d" % (
+                        store.feature_dim, self.feature_dim))
+            self.feature_dtype = store.feature_dtype
+            num_rows = len(store)
+            if num_rows > 0:
+                self._last_frame_idx = int(store.frame[-1])
+            del store
+            mode = "ab"
+        else:
+            mode = "wb"
+
+        with open(os.path.join(path, HEADER_FILENAME), "w") as f:
+            json.dump({
+                "feature_dim": self.feature_dim,
+                "feature_dtype": self.feature_dtype.name}, f)
+
+        row_sizes = {
+            "frame": np.dtype(_FRAME_DTYPE).itemsize,
+            "box": 4 * np.dtype(_BOX_DTYPE).itemsize,
+            "score": np.dtype(_SCORE_DTYPE).itemsize,
+            "class_id": np.dtype(_CLASS_DTYPE).itemsize}
+        if self.feature_dim > 0:
+            row_sizes["feature"] = \
+                self.feature_dim * self.feature_dtype.itemsize
+            if self.feature_dtype == np.int8:
+                row_sizes["feature_scale"] = np.dtype(_SCALE_DTYPE).itemsize
+        columns = sorted(row_sizes.keys())
+        if num_rows is not None:
+            # Drop partial rows of an interrupted writer, such that appended
+            # rows start at the same row index in every column.
+            for c in columns:
+                with open(_column_filename(path, c), "r+b") as f:
+                    f.truncate(num_rows * row_sizes[c])
+        self._files = {
+            c: open(_column_filename(path, c), mode) for c in columns}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, frame_idx, boxes, scores, class_ids=None, features=None):
+        """Append the detections of a single frame.
+
+        Frames must be written in non-decreasing order of their frame index.
+
+        Parameters
+        ----------
+        frame_idx : int
+            The frame index.
+        boxes : array_like
+            An Nx4 matrix of bounding boxes in format `(x, y, w, h)`.
+        scores : array_like
+            A vector of N detector confidence scores.
+        class_ids : Optional[array_like]
+            A vector of N class IDs. Defaults to -1.
+        features : Optional[array_like]
+            An NxL matrix of feature vectors, where L is the `feature_dim`
+            of the store. Required if the store contains features.
+
+        """
+        if self._last_frame_idx is not None and \
+                frame_idx < self._last_frame_idx:
+            raise ValueError(
+                "Frames must be written in order: got %d after %d" % (
+                    frame_idx, self._last_frame_idx))
+        boxes = np.asarray(boxes, dtype=_BOX_DTYPE).reshape(-1, 4)
+        n = len(boxes)
+        scores = np.asarray(scores, dtype=_SCORE_DTYPE).reshape(n)
+        if class_ids is None:
+            class_ids = np.full(n, -1, dtype=_CLASS_DTYPE)
+        class_ids = np.asarray(class_ids, dtype=_CLASS_DTYPE).reshape(n)
+        feature_scales = None
+        if self.feature_dim > 0:
+            if features is None:
+                raise ValueError("Store requires features")
+            features = np.asarray(features, dtype=np.float32).reshape(
+                n, self.feature_dim)
+            features, feature_scales = quantization.quantize(
+                features, self.feature_dtype)
+
+        self._files["frame"].write(
+            np.full(n, frame_idx, dtype=_FRAME_DTYPE).tobytes())
+        self._files["box"].write(boxes.tobytes())
+        self._files["score"].write(scores.tobytes())
+        self._files["class_id"].write(class_ids.tobytes())
+        if self.feature_dim > 0:
+            self._files["feature"].write(features.tobytes())
+        if feature_scales is not None:
+            self._files["feature_scale"].write(feature_scales.tobytes())
+        self._last_frame_idx = frame_idx
+
+    def flush(self):
+        """Flush all column files to disk."""
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        """Close all column files."""
+        for f in self._files.values():
+            f.close()
+
+
+def _memmap(filename, dtype, shape):
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r", shape=shape)
+
+
+class DetectionStore(object):
+    """
+    Read-only, memory-mapped access to a columnar detection store (see
+    `DetectionStoreWriter`). Opening a store does not parse or load the
+    detections; pages are read from disk as frames are accessed.
+
+    Parameters
+    ----------
+    path : str
+        Path to the store directory.
+
+    Attributes
+    ----------
+    frame : ndarray
+        Frame index of each detection.
+    box : ndarray
+        An Nx4 matrix of bounding boxes in format `(x, y, w, h)`.
+    score : ndarray
+        Detector confidence scores.
+    class_id : ndarray
+        Detector class IDs (-1 if not available).
+    feature : ndarray
+        An NxL matrix of feature vectors (L = 0 if the store has no features),
+        in the stored data type. int8 features must be multiplied by
+        `feature_scale`; `read_frame` and `to_matrix` do so.
+    feature_scale : ndarray | NoneType
+        The scale factor of each int8 feature vector, or None if features
+        are not quantized.
+    feature_dim : int
+        Dimensionality of the feature vector.
+    feature_dtype : dtype
+        Data type of stored features.
+    index : FrameIndex
+        The frame index of all columns.
+
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, HEADER_FILENAME), "r") as f:
+            header = json.load(f)
+        self.path = path
+        self.feature_dim = int(header["feature_dim"])
+        self.feature_dtype = np.dtype(header["feature_dtype"])
+
+        # Take the shortest column in case a writer was interrupted.
+        num_rows = min(
+            os.path.getsize(_column_filename(path, "frame")) //
+            np.dtype(_FRAME_DTYPE).itemsize,
+            os.path.getsize(_column_filename(path, "box")) //
+            (4 * np.dtype(_BOX_DTYPE).itemsize),
+            os.path.getsize(_column_filename(path, "score")) //
+            np.dtype(_SCORE_DTYPE).itemsize,
+            os.path.getsize(_column_filename(path, "class_id")) //
+            np.dtype(_CLASS_DTYPE).itemsize)
+        if self.feature_dim > 0:
+            num_rows = min(num_rows, os.path.getsize(
+                _column_filename(path, "feature")) //
+                (self.feature_dim * self.feature_dtype.itemsize))
+        is_quantized = self.feature_dim > 0 and self.feature_dtype == np.int8
+        if is_quantized:
+            num_rows = min(num_rows, os.path.getsize(
+                _column_filename(path, "feature_scale")) //
+                np.dtype(_SCALE_DTYPE).itemsize)
+
+        self.frame = _memmap(
+            _column_filename(path, "frame"), _FRAME_DTYPE, (num_rows, ))
+        self.box = _memmap(
+            _column_filename(path, "box"), _BOX_DTYPE, (num_rows, 4))
+        self.score = _memmap(
+            _column_filename(path, "score"), _SCORE_DTYPE, (num_rows, ))
+        self.class_id = _memmap(
+            _column_filename(path, "class_id"), _CLASS_DTYPE, (num_rows, ))
+        if self.feature_dim > 0:
+            self.feature = _memmap(
+                _column_filename(path, "feature"), self.feature_dtype,
+                (num_rows, self.feature_dim))
+        else:
+            self.feature = np.zeros((num_rows, 0), dtype=self.feature_dtype)
+        self.feature_scale = None
+        if is_quantized:
+            self.feature_scale = _memmap(
+                _column_filename(path, "feature_scale"), _SCALE_DTYPE,
+                (num_rows, ))
+        self.index = FrameIndex(self.frame)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def read_frame(self, frame_idx):
+        """Read the detections of a single frame.
+
+        Parameters
+        ----------
+        frame_idx : int
+            The frame index.
+
+        Returns
+        -------
+        (ndarray, ndarray, ndarray, ndarray)
+            Returns bounding boxes in format `(x, y, w, h)`, detector scores,
+            class IDs, and feature vectors of all detections in the frame.
+            int8 features are converted to float32.
+
+        """
+        s = self.index.slice(frame_idx)
+        return self.box[s], self.score[s], self.class_id[s], self._features(s)
+
+    def _features(self, s):
+        if self.feature_scale is None:
+            return self.feature[s]
+        return quantization.dequantize(
+            self.feature[s], self.feature_scale[s])
+
+    def to_matrix(self, frame_idx=None):
+        """Convert detections to the MOTChallenge detection matrix format of
+        `generate_detections`, where feature vectors are appended to each row.
+
+        Parameters
+        ----------
+        frame_idx : Optional[int]
+            If not None, only detections of this frame are converted.
+            Otherwise, the entire store is loaded into memory.
+
+        Returns
+        -------
+        ndarray
+            The detection matrix.
+
+        """
+        s = slice(None) if frame_idx is None else self.index.slice(frame_idx)
+        box = self.box[s]
+        matrix = np.full((len(box), 10 + self.feature_dim), -1.)
+        matrix[:, 0] = self.frame[s]
+        matrix[:, 2:6] = box
+        matrix[:, 6] = self.score[s]
+        matrix[:, 10:] = self._features(s)
+        return matrix
@@ -0,0 +1,104 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+
+
+class FrameIndex(object):
+    """
+    An index from frame numbers to contiguous row ranges of a matrix that is
+    sorted by frame number. The index stores one offset per frame (similar to
+    the row pointer of a CSR sparse matrix), such that the rows of a frame are
+    obtained as a slice in O(1).
+
+    Parameters
+    ----------
+    frame_indices : array_like
+        The frame number of each row, sorted in non-decreasing order.
+
+    Attributes
+    ----------
+    min_frame_idx : int
+        Smallest frame number in the index.
+    max_frame_idx : int
+        Largest frame number in the index.
+    offsets : ndarray
+        An array of length `max_frame_idx - min_frame_idx + 2`, such that the
+        rows of frame `f` are in range
+        `offsets[f - min_frame_idx]:offsets[f - min_frame_idx + 1]`.
+
+    """
+
+    def __init__(self, frame_indices):
+        frame_indices = np.asarray(frame_indices)
+        if len(frame_indices) == 0:
+            self.min_frame_idx, self.max_frame_idx = 0, -1
+            self.offsets = np.zeros(1, dtype=np.int64)
+            return
+        if np.any(frame_indices[1:] < frame_indices[:-1]):
+            raise ValueError("Frame indices must be sorted")
+
+        self.min_frame_idx = int(frame_indices[0])
+        self.max_frame_idx = int(frame_indices[-1])
+        self.offsets = np.searchsorted(
+            frame_indices,
+            np.arange(self.min_frame_idx, self.max_frame_idx + 2),
+            side="left").astype(np.int64)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def slice(self, frame_idx):
+        """Get the row range of a frame.
+
+        Parameters
+        ----------
+        frame_idx : int
+            The frame number.
+
+        Returns
+        -------
+        slice
+            The slice of rows that belong to the given frame. The slice is
+            empty if the frame is not contained in the index.
+
+        """
+        if frame_idx < self.min_frame_idx or frame_idx > self.max_frame_idx:
+            return slice(0, 0)
+        i = int(frame_idx) - self.min_frame_idx
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def count(self, frame_idx):
+        """Returns the number of rows of the given frame."""
+        s = self.slice(frame_idx)
+        return s.stop - s.start
+
+
+def index_by_frame(matrix, frame_column=0):
+    """Sort a matrix by frame number and build its frame index.
+
+    Examples
+    --------
+
+        >>> detections, index = index_by_frame(np.load(detection_file))
+        >>> rows = detections[index.slice(frame_idx)]
+
+    Parameters
+    ----------
+    matrix : ndarray
+        A matrix in MOTChallenge format, where each row contains the frame
+        number in column `frame_column`.
+    frame_column : Optional[int]
+        The column that contains the frame number.
+
+    Returns
+    -------
+    (ndarray, FrameIndex)
+        Returns the matrix with rows sorted by frame number (stable, the
+        matrix is returned as is if it is sorted already) and the frame index
+        of the sorted matrix.
+
+    """
+    frame_indices = matrix[:, frame_column].astype(np.int64)
+    if np.any(frame_indices[1:] < frame_indices[:-1]):
+        order = np.argsort(frame_indices, kind="mergesort")
+        matrix, frame_indices = matrix[order], frame_indices[order]
+    return matrix, FrameIndex(frame_indices)
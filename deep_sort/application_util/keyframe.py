@@ -0,0 +1,215 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+import cv2
+
+
+class KeyframeScheduler(object):
+    """
+    Decides on which frames to run the detector (keyframes). On all other
+    frames, tracks are advanced by Kalman filter prediction alone (see
+    `Tracker.predict`), optionally refined by a `TemplateRefiner`.
+
+    A frame is a keyframe if `max_interval` frames have passed since the last
+    keyframe. If `max_uncertainty` is not None, a keyframe is scheduled
+    earlier when the predicted position of any confirmed track that was
+    observed since the last keyframe becomes uncertain: when the standard
+    deviation of its projected position (the larger of x and y, from
+    `KalmanFilter.project_many`) relative to its height exceeds
+    `max_uncertainty`. Hence, the interval adapts to the motion in the
+    scene.
+
+    Parameters
+    ----------
+    max_interval : int
+        Maximum number of frames between two keyframes. 1 makes every frame
+        a keyframe.
+    max_uncertainty : Optional[float]
+        Maximum relative position uncertainty of a track before a keyframe is
+        scheduled. If None, keyframes are scheduled every `max_interval`
+        frames.
+    min_interval : Optional[int]
+        Minimum number of frames between two keyframes.
+
+    Attributes
+    ----------
+    frames_since_keyframe : int
+        Number of frames since the last keyframe (0 on a keyframe).
+    num_frames : int
+        Number of frames processed so far.
+    num_keyframes : int
+        Number of keyframes so far.
+
+    """
+
+    def __init__(self, max_interval, max_uncertainty=None, min_interval=1):
+        self.max_interval = max(1, max_interval)
+        self.max_uncertainty = max_uncertainty
+        self.min_interval = max(1, min_interval)
+        self.frames_since_keyframe = self.max_interval - 1
+        self.num_frames = 0
+        self.num_keyframes = 0
+
+    def uncertainty(self, tracker):
+        """Compute the largest relative position uncertainty of all confirmed
+        tracks that have been observed since the last keyframe.
+
+        Parameters
+        ----------
+        tracker : deep_sort.tracker.Tracker
+            The multi-target tracker.
+
+        Returns
+        -------
+        float
+            The standard deviation of the projected position relative to the
+            box height (0 if there is no such track).
+
+        """
+        tracks = [
+            t for t in tracker.tracks if t.is_confirmed() and
+            t.time_since_update <= self.frames_since_keyframe]
+        if len(tracks) == 0:
+            return 0.
+        mean, covariance = tracker.kf.project_many(
+            np.asarray([t.mean for t in tracks]),
+            np.asarray([t.covariance for t in tracks]))
+        std = np.sqrt(np.maximum(covariance[:, 0, 0], covariance[:, 1, 1]))
+        return float(np.max(std / np.maximum(mean[:, 3], 1.)))
+
+    def is_keyframe(self, tracker):
+        """Decide whether the current frame is a keyframe. Must be called
+        once per frame, after `tracker.predict`.
+
+        Parameters
+        ----------
+        tracker : deep_sort.tracker.Tracker
+            The multi-target tracker.
+
+        Returns
+        -------
+        bool
+            True if the detector should run on the current frame.
+
+        """
+        self.num_frames += 1
+        self.frames_since_keyframe += 1
+        is_keyframe = self.frames_since_keyframe >= self.max_interval
+        if not is_keyframe and self.max_uncertainty is not None and \
+                self.frames_since_keyframe >= self.min_interval:
+            is_keyframe = self.uncertainty(tracker) > self.max_uncertainty
+        if is_keyframe:
+            self.frames_since_keyframe = 0
+            self.num_keyframes += 1
+        return is_keyframe
+
+
+class TemplateRefiner(object):
+    """
+    Refines the predicted position of tracks between keyframes by searching
+    the image patch of each track, taken on the last frame the track was
+    observed, in a window around its predicted position (normalized
+    cross-correlation, `cv2.matchTemplate`).
+
+    Templates are downscaled such that their larger side is at most
+    `max_template_size` pixels, which bounds the cost per track.
+
+    Parameters
+    ----------
+    search_scale : float
+        The search window extends the predicted bounding box by this
+        fraction of its width and height on each side.
+    min_score : float
+        Minimum correlation score in [-1, 1] of a valid match.
+    max_template_size : int
+        Maximum template side length in pixels.
+
+    """
+
+    def __init__(self, search_scale=0.5, min_score=0.7, max_template_size=32):
+        self.search_scale = search_scale
+        self.min_score = min_score
+        self.max_template_size = max_template_size
+        self._templates = {}
+
+    @staticmethod
+    def _gray(image):
+        if image.ndim == 3:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    def set_templates(self, image, tracks):
+        """Take templates of all confirmed tracks that have been observed on
+        the current frame. All other templates are discarded, such that
+        tracks that have been missed are not refined (and age out).
+
+        Parameters
+        ----------
+        image : ndarray
+            The current BGR color (or grayscale) image.
+        tracks : List[deep_sort.track.Track]
+            The tracks after `Tracker.update`.
+
+        """
+        image = self._gray(image)
+        templates = {}
+        for track in tracks:
+            if not track.is_confirmed() or track.time_since_update > 0:
+                continue
+            x, y, w, h = track.to_tlwh()
+            x0, y0 = int(round(max(x, 0))), int(round(max(y, 0)))
+            x1 = int(round(min(x + w, image.shape[1])))
+            y1 = int(round(min(y + h, image.shape[0])))
+            if x1 - x0 < 4 or y1 - y0 < 4:
+                continue
+            scale = min(1., float(self.max_template_size) / max(w, h))
+            patch = cv2.resize(image[y0:y1, x0:x1], None, fx=scale, fy=scale)
+            if min(patch.shape) >= 2:
+                templates[track.track_id] = (patch, scale)
+        self._templates = templates
+
+    def refine(self, image, tracks):
+        """Search the templates of confirmed tracks around their predicted
+        positions.
+
+        Parameters
+        ----------
+        image : ndarray
+            The current BGR color (or grayscale) image.
+        tracks : List[deep_sort.track.Track]
+            The tracks after `Tracker.predict`.
+
+        Returns
+        -------
+        (List[int], ndarray)
+            Returns the indices of tracks with a valid match and their
+            measured bounding boxes in format `(x, y, w, h)`, e.g., to be
+            passed to `Tracker.correct`.
+
+        """
+        image = self._gray(image)
+        track_indices, boxes = [], []
+        for i, track in enumerate(tracks):
+            if not track.is_confirmed() or track.track_id not in self._templates:
+                continue
+            template, scale = self._templates[track.track_id]
+            x, y, w, h = track.to_tlwh()
+            x0 = int(max(x - self.search_scale * w, 0))
+            y0 = int(max(y - self.search_scale * h, 0))
+            x1 = int(min(x + (1. + self.search_scale) * w, image.shape[1]))
+            y1 = int(min(y + (1. + self.search_scale) * h, image.shape[0]))
+            if x1 <= x0 or y1 <= y0:
+                continue
+            window = cv2.resize(image[y0:y1, x0:x1], None, fx=scale, fy=scale)
+            if window.shape[0] < template.shape[0] or \
+                    window.shape[1] < template.shape[1]:
+                continue
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, max_score, _, max_loc = cv2.minMaxLoc(scores)
+            if max_score < self.min_score:
+                continue
+            height, width = template.shape[:2]
+            track_indices.append(i)
+            boxes.append([
+                x0 + max_loc[0] / scale, y0 + max_loc[1] / scale,
+                width / scale, height / scale])
+        return track_indices, np.asarray(boxes).reshape(-1, 4)
@@ -0,0 +1,368 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+import cv2
+
+
+def merge_regions(regions):
+    """Merge overlapping regions into their bounding boxes until no two
+    regions overlap.
+
+    Parameters
+    ----------
+    regions : List[(int, int, int, int)]
+        Regions in format `(x, y, w, h)`.
+
+    Returns
+    -------
+    List[(int, int, int, int)]
+        The disjoint merged regions.
+
+    """
+    boxes = [[x, y, x + w, y + h] for x, y, w, h in regions]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]),
+                                max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in boxes]
+
+
+class RoiMosaic(object):
+    """
+    Packs the regions of a frame that matter between full-frame detections,
+    the surroundings of tracks and the entry zones at the frame borders, into
+    a small square canvas, such that the detector runs on far fewer pixels
+    than on the full frame. The detector still runs on the full frame every
+    `full_frame_interval` frames, and whenever the regions do not fit the
+    canvas.
+
+    Overlapping track regions are merged and scaled by the same factor that
+    the detector would apply to the full frame. Entry zones only need to
+    catch objects that enter the frame until the next full-frame detection,
+    and are scaled down further by `entry_scale`. Regions that do not fit
+    the canvas are split into tiles, and all tiles are placed with a skyline
+    bottom-left packer. Entry zones may overlap track regions; an object in
+    the overlap is reported from the track region only.
+
+    Parameters
+    ----------
+    canvas_size : int
+        Side length of the canvas in pixels (a multiple of 64).
+    padding : float
+        The region around a track extends its predicted bounding box by this
+        fraction of the larger box side on each side. The larger side keeps
+        the region wide enough for objects that are only partially visible,
+        e.g., while they enter the frame.
+    entry_margin : float
+        Width of the entry zones along the four frame borders, as fraction
+        of the frame width (left and right border) and height (top and
+        bottom border). 0 disables entry zones.
+    entry_scale : float
+        Scale factor of the entry zones relative to the track regions.
+    spacing : int
+        Number of empty canvas pixels between two regions.
+    full_frame_interval : int
+        Maximum number of frames between two full-frame detections.
+
+    Attributes
+    ----------
+    num_frames : int
+        Number of frames planned so far.
+    num_full_frames : int
+        Number of frames that have been planned for full-frame detection.
+    num_fallbacks : int
+        Number of full-frame detections (included in `num_full_frames`) that
+        were not due, but happened because the regions did not fit the
+        canvas.
+
+    """
+
+    def __init__(self, canvas_size=512, padding=0.2, entry_margin=0.05,
+                 entry_scale=0.5, spacing=4, full_frame_interval=10):
+        self.canvas_size = canvas_size
+        self.padding = padding
+        self.entry_margin = entry_margin
+        self.entry_scale = entry_scale
+        self.spacing = spacing
+        self.full_frame_interval = max(1, full_frame_interval)
+        self.num_frames = 0
+        self.num_full_frames = 0
+        self.num_fallbacks = 0
+        self._frames_since_full_frame = self.full_frame_interval - 1
+
+    def plan(self, tracks, image_shape, scale):
+        """Decide how to run the detector on the current frame. Must be
+        called once per frame, after `Tracker.predict`.
+
+        Parameters
+        ----------
+        tracks : List[deep_sort.track.Track]
+            The tracks after `Tracker.predict`.
+        image_shape : (int, int)
+            The frame height and width.
+        scale : float
+            The scale factor from frame to canvas.
+
+        Returns
+        -------
+        Optional[(List[(int, int, int, int)], List[...])]
+            Returns None if the detector should run on the full frame, and
+            otherwise the regions of interest (track regions followed by
+            entry zones, see `track_regions` and `entry_zones`) and their
+            placements on the canvas (see `pack`).
+
+        """
+        self.num_frames += 1
+        self._frames_since_full_frame += 1
+        result = None
+        if self._frames_since_full_frame < self.full_frame_interval:
+            track_regions = self.track_regions(tracks, image_shape)
+            entry_zones = self.entry_zones(image_shape)
+            regions = track_regions + entry_zones
+            scales = [scale] * len(track_regions) + \
+                [self.entry_scale * scale] * len(entry_zones)
+            placements = self.pack(regions, scales)
+            if placements is not None:
+                result = regions, placements
+            else:
+                self.num_fallbacks += 1
+        if result is None:
+            self._frames_since_full_frame = 0
+            self.num_full_frames += 1
+        return result
+
+    def track_regions(self, tracks, image_shape):
+        """Compute the regions around tracks.
+
+        Parameters
+        ----------
+        tracks : List[deep_sort.track.Track]
+            The tracks after `Tracker.predict`.
+        image_shape : (int, int)
+            The frame height and width.
+
+        Returns
+        -------
+        List[(int, int, int, int)]
+            The disjoint track regions in format `(x, y, w, h)`.
+
+        """
+        height, width = image_shape[:2]
+        regions = []
+        for track in tracks:
+            x, y, w, h = track.to_tlwh()
+            pad = self.padding * max(w, h)
+            x0 = int(max(x - pad, 0))
+            y0 = int(max(y - pad, 0))
+            x1 = int(np.ceil(min(x + w + pad, width)))
+            y1 = int(np.ceil(min(y + h + pad, height)))
+            if x1 > x0 and y1 > y0:
+                regions.append((x0, y0, x1 - x0, y1 - y0))
+        return merge_regions(regions)
+
+    def entry_zones(self, image_shape):
+        """Compute the entry zones along the frame borders.
+
+        Parameters
+        ----------
+        image_shape : (int, int)
+            The frame height and width.
+
+        Returns
+        -------
+        List[(int, int, int, int)]
+            The disjoint entry zones in format `(x, y, w, h)` (empty if
+            `entry_margin` is 0).
+
+        """
+        if self.entry_margin <= 0:
+            return []
+        height, width = image_shape[:2]
+        margin_x = max(1, int(self.entry_margin * width))
+        margin_y = max(1, int(self.entry_margin * height))
+        inner_width = width - 2 * margin_x
+        return [
+            (0, 0, margin_x, height),
+            (width - margin_x, 0, margin_x, height),
+            (margin_x, 0, inner_width, margin_y),
+            (margin_x, height - margin_y, inner_width, margin_y)]
+
+    def _tiles(self, region, scale):
+        # Split a region into equally sized tiles that fit the canvas.
+        x, y, w, h = region
+        num_x = int(np.ceil(w * scale / self.canvas_size))
+        num_y = int(np.ceil(h * scale / self.canvas_size))
+        xs = np.linspace(x, x + w, num_x + 1).astype(np.int64)
+        ys = np.linspace(y, y + h, num_y + 1).astype(np.int64)
+        return [(x0, y0, x1 - x0, y1 - y0)
+                for y0, y1 in zip(ys[:-1], ys[1:])
+                for x0, x1 in zip(xs[:-1], xs[1:])]
+
+    def pack(self, regions, scale):
+        """Place regions on the canvas.
+
+        Tiles are placed in order of decreasing height, each at the lowest
+        (and then leftmost) position on the skyline of the tiles placed so
+        far.
+
+        Parameters
+        ----------
+        regions : List[(int, int, int, int)]
+            Regions in format `(x, y, w, h)`.
+        scale : float | List[float]
+            The scale factor from frame to canvas, or one per region.
+
+        Returns
+        -------
+        Optional[List[((int, int, int, int), (int, int, int, int), int)]]
+            Returns the placement of each region (or tile) as a triple of the
+            frame region and the canvas region, both in format
+            `(x, y, w, h)`, and the index of the region in `regions`. Returns
+            None if the regions do not fit.
+
+        """
+        scales = np.broadcast_to(
+            np.asarray(scale, dtype=np.float64), (len(regions), ))
+        tiles, sizes, region_indices = [], [], []
+        for i, region in enumerate(regions):
+            for tile in self._tiles(region, scales[i]):
+                w, h = [
+                    min(self.canvas_size, max(1, int(round(d * scales[i]))))
+                    for d in tile[2:]]
+                tiles.append(tile)
+                sizes.append((w, h))
+                region_indices.append(i)
+        order = sorted(
+            range(len(tiles)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+
+        # The skyline is a list of segments [x, y, width] that covers the
+        # canvas width, where y is the lowest free row above the segment.
+        # Each tile occupies its size plus spacing, and the spacing may
+        # extend beyond the canvas.
+        extent = self.canvas_size + self.spacing
+        skyline = [[0, 0, extent]]
+        placements = []
+        for i in order:
+            w, h = sizes[i][0] + self.spacing, sizes[i][1] + self.spacing
+            best = None
+            for j in range(len(skyline)):
+                x = skyline[j][0]
+                if x + w > extent:
+                    break
+                y = max(sy for sx, sy, _ in skyline[j:] if sx < x + w)
+                if y + h <= extent and (best is None or (y, x) < best):
+                    best = y, x
+            if best is None:
+                return None
+            y, x = best
+            placements.append(
+                (tiles[i], (x, y, sizes[i][0], sizes[i][1]),
+                 region_indices[i]))
+
+            # Raise the skyline under the new tile to its top.
+            new_skyline = []
+            for sx, sy, sw in skyline:
+                if sx < x:
+                    new_skyline.append([sx, sy, min(sw, x - sx)])
+                if sx + sw > x + w:
+                    start = max(sx, x + w)
+                    new_skyline.append([start, sy, sx + sw - start])
+            new_skyline.append([x, y + h, w])
+            new_skyline.sort()
+            skyline = [new_skyline[0]]
+            for segment in new_skyline[1:]:
+                if segment[1] == skyline[-1][1]:
+                    skyline[-1][2] += segment[2]
+                else:
+                    skyline.append(segment)
+        return placements
+
+    def render(self, image, placements):
+        """Copy the placed regions of a frame to the canvas.
+
+        Parameters
+        ----------
+        image : ndarray
+            The frame.
+        placements : List[((int, int, int, int), (int, int, int, int), int)]
+            The output of `pack`.
+
+        Returns
+        -------
+        ndarray
+            The canvas, with the same data type and number of channels as
+            `image`. Unused pixels are zero.
+
+        """
+        canvas = np.zeros(
+            (self.canvas_size, self.canvas_size) + image.shape[2:],
+            dtype=image.dtype)
+        for (x, y, w, h), (cx, cy, cw, ch), _ in placements:
+            canvas[cy:cy + ch, cx:cx + cw] = cv2.resize(
+                image[y:y + h, x:x + w], (cw, ch),
+                interpolation=cv2.INTER_AREA)
+        return canvas
+
+    def to_frame(self, boxes, regions, placements):
+        """Map bounding boxes from canvas to frame coordinates.
+
+        Each box is assigned to the placement that contains its center.
+        Boxes with a center (in frame coordinates) that lies in a region
+        before their own in `regions` are discarded, since the object is
+        covered by that region.
+
+        Parameters
+        ----------
+        boxes : ndarray
+            An Nx4 matrix of bounding boxes in canvas coordinates, in format
+            `(x, y, w, h)`.
+        regions : List[(int, int, int, int)]
+            The regions that have been passed to `pack`.
+        placements : List[((int, int, int, int), (int, int, int, int), int)]
+            The output of `pack`.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the indices of the boxes that have been kept and their
+            bounding boxes in frame coordinates.
+
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        center = boxes[:, :2] + boxes[:, 2:] / 2.
+        regions = np.asarray(regions, dtype=np.float64).reshape(-1, 4)
+        indices, frame_boxes = [], []
+        for (x, y, w, h), (cx, cy, cw, ch), region_idx in placements:
+            inside = np.flatnonzero(np.logical_and.reduce((
+                center[:, 0] >= cx, center[:, 0] < cx + cw,
+                center[:, 1] >= cy, center[:, 1] < cy + ch)))
+            scale = np.array([float(w) / cw, float(h) / ch])
+            mapped = boxes[inside].copy()
+            mapped[:, :2] = (mapped[:, :2] - [cx, cy]) * scale + [x, y]
+            mapped[:, 2:] *= scale
+
+            # Discard objects that are covered by a preceding region.
+            mapped_center = mapped[:, :2] + mapped[:, 2:] / 2.
+            previous = regions[:region_idx]
+            is_covered = np.any(np.logical_and.reduce((
+                mapped_center[:, np.newaxis, 0] >= previous[:, 0],
+                mapped_center[:, np.newaxis, 0] < previous[:, 0] +
+                previous[:, 2],
+                mapped_center[:, np.newaxis, 1] >= previous[:, 1],
+                mapped_center[:, np.newaxis, 1] < previous[:, 1] +
+                previous[:, 3])), axis=1)
+            keep = np.logical_not(is_covered)
+            indices.append(inside[keep])
+            frame_boxes.append(mapped[keep])
+        if len(indices) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 4))
+        return np.concatenate(indices), np.concatenate(frame_boxes)
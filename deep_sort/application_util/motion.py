@@ -0,0 +1,129 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+import cv2
+
+
+class MotionGate(object):
+    """
+    Finds the changed region of frames from a static camera with background
+    subtraction (OpenCV MOG2) on a downscaled copy of each frame, such that
+    the detector can be skipped on frames without motion and restricted to
+    the changed region otherwise.
+
+    A pixel has changed if it is foreground on the current or on the previous
+    frame, such that the changed region also covers places that an object
+    has left (which reveals the known background).
+
+    The background model does not know objects that have been present since
+    the first frame (or that stopped moving long ago). Therefore, the full
+    frame is returned on the first `num_initial_frames` frames and,
+    optionally, periodically.
+
+    Parameters
+    ----------
+    scale : float
+        Downscaling factor of the frames passed to the background model.
+    history : int
+        Number of frames that the background model adapts to.
+    var_threshold : float
+        Threshold on the squared Mahalanobis distance between a pixel and
+        the background model to decide whether the pixel has changed.
+    min_area : float
+        Minimum fraction of changed pixels. Frames with fewer changed pixels
+        are considered static.
+    padding : float
+        The changed region is extended by this fraction of the frame width
+        and height on each side, since moving parts of an object do not
+        necessarily cover the entire object.
+    max_region : float
+        If the changed region covers more than this fraction of the frame,
+        the full frame is returned instead.
+    refresh_interval : Optional[int]
+        If not None, the full frame is returned at least once every this
+        many frames.
+    num_initial_frames : int
+        Number of initial frames on which the full frame is returned, e.g.,
+        such that tracks of objects that are present from the start can be
+        confirmed.
+
+    Attributes
+    ----------
+    num_frames : int
+        Number of frames processed so far.
+    num_static : int
+        Number of frames without motion.
+    num_partial : int
+        Number of frames where only a part of the frame has changed.
+
+    """
+
+    def __init__(self, scale=0.25, history=500, var_threshold=16.,
+                 min_area=1e-3, padding=0.05, max_region=0.5,
+                 refresh_interval=None, num_initial_frames=3):
+        self.scale = scale
+        self.min_area = min_area
+        self.padding = padding
+        self.max_region = max_region
+        self.refresh_interval = refresh_interval
+        self.num_initial_frames = num_initial_frames
+        self.num_frames = 0
+        self.num_static = 0
+        self.num_partial = 0
+        self._frames_since_refresh = 0
+        self._subtractor = cv2.createBackgroundSubtractorMOG2(
+            history, var_threshold, False)
+        self._kernel = np.ones((3, 3), dtype=np.uint8)
+        self._previous_mask = None
+
+    def apply(self, image):
+        """Update the background model with a frame and find the changed
+        region.
+
+        Parameters
+        ----------
+        image : ndarray
+            The BGR color image.
+
+        Returns
+        -------
+        Optional[(int, int, int, int)]
+            Returns None if the frame is static, and otherwise the changed
+            region in format `(x, y, w, h)`, which may be the full frame.
+
+        """
+        small_image = cv2.resize(
+            image, None, fx=self.scale, fy=self.scale,
+            interpolation=cv2.INTER_AREA)
+        mask = self._subtractor.apply(small_image)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
+        if self._previous_mask is not None:
+            mask, self._previous_mask = (
+                cv2.bitwise_or(mask, self._previous_mask), mask)
+        else:
+            self._previous_mask = mask
+        self.num_frames += 1
+        self._frames_since_refresh += 1
+
+        height, width = image.shape[:2]
+        full_frame = 0, 0, width, height
+        if self.num_frames <= self.num_initial_frames or (
+                self.refresh_interval is not None and
+                self._frames_since_refresh >= self.refresh_interval):
+            self._frames_since_refresh = 0
+            return full_frame
+
+        ys, xs = np.nonzero(mask)
+        if len(xs) < self.min_area * mask.size:
+            self.num_static += 1
+            return None
+
+        pad_x, pad_y = self.padding * width, self.padding * height
+        x0 = max(0, int(xs.min() / self.scale - pad_x))
+        y0 = max(0, int(ys.min() / self.scale - pad_y))
+        x1 = min(width, int(np.ceil((xs.max() + 1) / self.scale + pad_x)))
+        y1 = min(height, int(np.ceil((ys.max() + 1) / self.scale + pad_y)))
+        if (x1 - x0) * (y1 - y0) > self.max_region * width * height:
+            self._frames_since_refresh = 0
+            return full_frame
+        self.num_partial += 1
+        return x0, y0, x1 - x0, y1 - y0
@@ -0,0 +1,283 @@
+# vim: expandtab:ts=4:sw=4
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+
+_END = object()
+_POLL_INTERVAL = 0.1
+
+
+class StageStatistics(object):
+    """
+    Runtime statistics of a single pipeline stage.
+
+    Parameters
+    ----------
+    name : str
+        The stage name.
+
+    Attributes
+    ----------
+    name : str
+        The stage name.
+    num_items : int
+        Number of items this stage has produced.
+    starved_time : float
+        Total time in seconds the stage spent waiting for input.
+    blocked_time : float
+        Total time in seconds the stage spent waiting for space in its output
+        queue (backpressure from the downstream stage).
+    queue_fill : float
+        Accumulated fill ratio of the output queue, sampled whenever an item
+        is produced.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.num_items = 0
+        self.starved_time = 0.
+        self.blocked_time = 0.
+        self.queue_fill = 0.
+        self._start_time = None
+        self._stop_time = None
+
+    @property
+    def wall_time(self):
+        """Time in seconds since the stage has been started."""
+        if self._start_time is None:
+            return 0.
+        stop_time = self._stop_time
+        if stop_time is None:
+            stop_time = time.time()
+        return stop_time - self._start_time
+
+    @property
+    def busy_time(self):
+        """Time in seconds the stage spent doing actual work."""
+        return max(0., self.wall_time - self.starved_time - self.blocked_time)
+
+    @property
+    def occupancy(self):
+        """Fraction of the wall time the stage spent doing actual work. The
+        stage with the highest occupancy is the pipeline bottleneck.
+        """
+        wall_time = self.wall_time
+        return self.busy_time / wall_time if wall_time > 0 else 0.
+
+    def to_dict(self):
+        """Returns the statistics as a dictionary."""
+        return {
+            "name": self.name,
+            "num_items": self.num_items,
+            "wall_time": self.wall_time,
+            "busy_time": self.busy_time,
+            "starved_time": self.starved_time,
+            "blocked_time": self.blocked_time,
+            "occupancy": self.occupancy,
+            "mean_queue_fill": (
+                self.queue_fill / self.num_items if self.num_items > 0
+                else 0.)}
+
+
+class PipelineRunner(object):
+    """
+    Runs a chain of generator stages concurrently. Each stage runs in its own
+    worker thread and stages are linked by bounded queues, such that a slow
+    stage exerts backpressure on upstream stages instead of letting items
+    pile up in memory.
+
+    Threads (rather than processes) are used, because stages share large
+    models and images, and TensorFlow releases the GIL during `session.run`.
+
+    Examples
+    --------
+
+        >>> runner = PipelineRunner(queue_size=4)
+        >>> runner.add_source("decode", read_frames(video_filename))
+        >>> runner.add_stage("detect", lambda x: detect_frames(model, x))
+        >>> for item in runner.run():
+        ...     sink(item)
+        >>> print(runner.format_statistics())
+
+    Parameters
+    ----------
+    queue_size : int
+        Maximum number of items in each queue between two stages. Must be at
+        least 1.
+
+    """
+
+    def __init__(self, queue_size=2):
+        if queue_size < 1:
+            raise ValueError("Queue size must be at least 1")
+        self.queue_size = queue_size
+        self._source = None
+        self._stages = []
+        self._statistics = []
+        self._stop_event = threading.Event()
+        self._error = None
+
+    def add_source(self, name, iterable):
+        """Set the iterable that feeds the first stage.
+
+        Parameters
+        ----------
+        name : str
+            The stage name, used for statistics.
+        iterable : Iterable
+            The pipeline input. It is consumed in its own worker thread.
+
+        """
+        self._source = name, iterable
+
+    def add_stage(self, name, transform):
+        """Append a stage to the pipeline.
+
+        Parameters
+        ----------
+        name : str
+            The stage name, used for statistics.
+        transform : Callable[Iterator] -> Iterator
+            A function that takes an iterator over the items of the previous
+            stage and returns an iterator over the items of this stage, e.g.,
+            a generator function.
+
+        """
+        self._stages.append((name, transform))
+
+    def statistics(self):
+        """Returns runtime statistics, one dictionary per stage (in pipeline
+        order, the final entry is the consumer of `run`). See
+        `StageStatistics.to_dict`.
+        """
+        return [s.to_dict() for s in self._statistics]
+
+    def format_statistics(self):
+        """Returns a human readable table of the runtime statistics."""
+        lines = ["%-10s %8s %10s %10s %10s %10s" % (
+            "stage", "items", "busy [s]", "starved", "blocked", "occupancy")]
+        for s in self.statistics():
+            lines.append("%-10s %8d %10.2f %10.2f %10.2f %9.1f%%" % (
+                s["name"], s["num_items"], s["busy_time"], s["starved_time"],
+                s["blocked_time"], 100. * s["occupancy"]))
+        return "\n".join(lines)
+
+    def run(self, sink_name="sink"):
+        """Start all stages.
+
+        Parameters
+        ----------
+        sink_name : str
+            Name of the consumer of the returned iterator, used for
+            statistics.
+
+        Returns
+        -------
+        Iterator
+            Yields the output items of the final stage. If any stage raises an
+            exception, the pipeline is stopped and the exception is re-raised
+            here.
+
+        """
+        if self._source is None:
+            raise ValueError("Pipeline has no source")
+        self._stop_event.clear()
+        self._error = None
+
+        source_name, source = self._source
+        queues = [queue.Queue(self.queue_size)
+                  for _ in range(len(self._stages) + 1)]
+        self._statistics = [StageStatistics(source_name)] + [
+            StageStatistics(name) for name, _ in self._stages] + [
+            StageStatistics(sink_name)]
+
+        threads = [threading.Thread(
+            target=self._run_stage,
+            args=(lambda _: source, None, queues[0], self._statistics[0]))]
+        for i, (_, transform) in enumerate(self._stages):
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(transform, queues[i], queues[i + 1],
+                      self._statistics[i + 1])))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        statistics = self._statistics[-1]
+        statistics._start_time = time.time()
+        try:
+            for item in self._iter_queue(queues[-1], statistics):
+                statistics.num_items += 1
+                yield item
+        finally:
+            statistics._stop_time = time.time()
+            self._stop_event.set()
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _iter_queue(self, in_queue, statistics):
+        while True:
+            t0 = time.time()
+            item = self._get(in_queue)
+            statistics.starved_time += time.time() - t0
+            if item is _END:
+                return
+            yield item
+
+    def _get(self, in_queue):
+        while not self._stop_event.is_set():
+            try:
+                return in_queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _put(self, out_queue, item):
+        while not self._stop_event.is_set():
+            try:
+                out_queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run_stage(self, transform, in_queue, out_queue, statistics):
+        statistics._start_time = time.time()
+        inputs = None
+        if in_queue is not None:
+            inputs = self._iter_queue(in_queue, statistics)
+        iterator = None
+        try:
+            iterator = iter(transform(inputs))
+            while True:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                statistics.num_items += 1
+                statistics.queue_fill += (
+                    float(out_queue.qsize()) / self.queue_size)
+                t0 = time.time()
+                ok = self._put(out_queue, item)
+                statistics.blocked_time += time.time() - t0
+                if not ok:
+                    break
+            self._put(out_queue, _END)
+        except Exception:
+            self._error = sys.exc_info()[1]
+            self._stop_event.set()
+        finally:
+            statistics._stop_time = time.time()
+            close = getattr(iterator, "close", None)  # Generators
+            if close is not None:
+                close()
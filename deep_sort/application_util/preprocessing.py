@@ -14,10 +14,9 @@ def non_max_suppression(boxes, max_bbox_overlap, scores=None):
     Examples
     --------
 
-        >>> boxes = [d.roi for d in detections]
-        >>> scores = [d.confidence for d in detections]
-        >>> indices = non_max_suppression(boxes, max_bbox_overlap, scores)
-        >>> detections = [detections[i] for i in indices]
+        >>> indices = non_max_suppression(
+        ...     detections.tlwh, max_bbox_overlap, detections.confidence)
+        >>> detections = detections[indices]
 
     Parameters
     ----------
@@ -51,23 +50,18 @@ def non_max_suppression(boxes, max_bbox_overlap, scores=None):
     else:
         idxs = np.argsort(y2)
 
-    while len(idxs) > 0:
-        last = len(idxs) - 1
-        i = idxs[last]
+    # Overlap of each pair of boxes, relative to the area of the second box.
+    w = np.maximum(0, np.minimum(x2[:, np.newaxis], x2[np.newaxis, :]) -
+                   np.maximum(x1[:, np.newaxis], x1[np.newaxis, :]) + 1)
+    h = np.maximum(0, np.minimum(y2[:, np.newaxis], y2[np.newaxis, :]) -
+                   np.maximum(y1[:, np.newaxis], y1[np.newaxis, :]) + 1)
+    overlap = (w * h) / area[np.newaxis, :]
+
+    suppressed = np.zeros(len(boxes), dtype=np.bool_)
+    for i in idxs[::-1]:
+        if suppressed[i]:
+            continue
         pick.append(i)
-
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-
-        overlap = (w * h) / area[idxs[:last]]
-
-        idxs = np.delete(
-            idxs, np.concatenate(
-                ([last], np.where(overlap > max_bbox_overlap)[0])))
+        suppressed |= overlap[i] > max_bbox_overlap
 
     return pick
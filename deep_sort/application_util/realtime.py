@@ -0,0 +1,281 @@
+# vim: expandtab:ts=4:sw=4
+import collections
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+_POLL_INTERVAL = 0.1
+
+# Actions of the `LoadShedder`, from most to least expensive: run the detector
+# at full resolution, run the detector at reduced resolution, advance tracks
+# by Kalman filter prediction only, or skip the frame entirely.
+DETECT = "detect"
+DETECT_REDUCED = "reduced"
+PREDICT = "predict"
+DROP = "drop"
+ACTIONS = (DETECT, DETECT_REDUCED, PREDICT, DROP)
+
+
+class LiveFrameSource(object):
+    """
+    Captures frames in a background thread and keeps only the most recent
+    `max_queue` of them. When the consumer falls behind, the oldest frames
+    are dropped (and counted) instead of piling up, such that the consumer
+    always sees recent frames. Each frame is stamped with its capture time.
+
+    Parameters
+    ----------
+    frames : Iterable[(int, ndarray)]
+        Frame indices and BGR color images, e.g., from
+        `video_pipeline.read_frames` on a camera or stream URL.
+    max_queue : int
+        Maximum number of buffered frames.
+    frame_rate : Optional[float]
+        If not None, capture is paced to this frame rate, e.g., to replay a
+        video file as if it came from a live camera.
+
+    Attributes
+    ----------
+    num_captured : int
+        Number of captured frames.
+    num_dropped : int
+        Number of frames that have been dropped, because the buffer was full.
+
+    """
+
+    def __init__(self, frames, max_queue=1, frame_rate=None):
+        self.max_queue = max(1, max_queue)
+        self.frame_rate = frame_rate
+        self.num_captured = 0
+        self.num_dropped = 0
+        self._frames = frames
+        self._buffer = collections.deque()
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._done = False
+        self._error = None
+        self._thread = threading.Thread(target=self._capture)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _capture(self):
+        start_time = time.time()
+        try:
+            for i, (frame_idx, image) in enumerate(self._frames):
+                if self._stop_event.is_set():
+                    break
+                if self.frame_rate:
+                    delay = start_time + i / self.frame_rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                with self._condition:
+                    if len(self._buffer) >= self.max_queue:
+                        self._buffer.popleft()
+                        self.num_dropped += 1
+                    self._buffer.append((frame_idx, image, time.time()))
+                    self.num_captured += 1
+                    self._condition.notify()
+        except Exception:
+            self._error = sys.exc_info()[1]
+        finally:
+            with self._condition:
+                self._done = True
+                self._condition.notify()
+
+    def __iter__(self):
+        """Iterate over buffered frames.
+
+        Returns
+        -------
+        Iterator[(int, ndarray, float)]
+            Yields the frame index, the BGR color image, and the capture time
+            (as returned by `time.time`) of each frame that has not been
+            dropped. If capture fails, the exception is re-raised here.
+
+        """
+        while True:
+            with self._condition:
+                while len(self._buffer) == 0 and not self._done:
+                    self._condition.wait(_POLL_INTERVAL)
+                if len(self._buffer) > 0:
+                    item = self._buffer.popleft()
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            yield item
+
+    def close(self):
+        """Stop capturing and close the wrapped frame iterator, which
+        releases the capture of `read_frames`."""
+        self._stop_event.set()
+        self._thread.join()
+        if hasattr(self._frames, "close"):
+            self._frames.close()
+
+
+class LoadShedder(object):
+    """
+    Decides how much work to spend on each frame of a live stream, such that
+    results are available within `deadline` seconds after capture.
+
+    Each frame is assigned the most expensive action in `ACTIONS` that is
+    expected to finish before the frame's deadline, given the time that has
+    already passed since capture and the estimated cost of each action (an
+    exponential moving average of its measured processing times). Frames
+    that have already missed their deadline are dropped. Hence, latency stays
+    bounded when the detector falls behind, at the price of fewer (or
+    coarser) detections.
+
+    Parameters
+    ----------
+    deadline : float
+        The latency budget in seconds from capture to result.
+    reduced_resolution : bool
+        If True, `DETECT_REDUCED` is considered before falling back to
+        `PREDICT`.
+    max_detection_gap : Optional[int]
+        If not None, the detector runs (at the cheapest resolution) on the
+        first frame that is not dropped after this many frames without
+        detection, even if it misses the deadline, such that tracks are not
+        lost under sustained overload.
+    smoothing : float
+        Weight of a new measurement in the cost estimates.
+    history : int
+        Number of most recent latencies kept for percentile statistics.
+
+    Attributes
+    ----------
+    costs : Dict[str, float]
+        The estimated processing time in seconds of each action. Actions that
+        have not been measured yet are assumed to be free.
+    frames_since_detection : int
+        Number of frames (including dropped frames) since the detector last
+        ran.
+
+    """
+
+    def __init__(self, deadline, reduced_resolution=True,
+                 max_detection_gap=None, smoothing=0.2, history=1000):
+        self.deadline = deadline
+        self.reduced_resolution = reduced_resolution
+        self.max_detection_gap = max_detection_gap
+        self.smoothing = smoothing
+        self.costs = {action: 0. for action in ACTIONS}
+        self.frames_since_detection = 0
+        self._num_measurements = {action: 0 for action in ACTIONS}
+        self._counts = {action: 0 for action in ACTIONS}
+        self._latencies = collections.deque(maxlen=history)
+        self._num_results = 0
+        self._total_latency = 0.
+        self._max_latency = 0.
+        self._num_misses = 0
+
+    def decide(self, capture_time, now=None):
+        """Choose the action for a frame.
+
+        Parameters
+        ----------
+        capture_time : float
+            The time the frame has been captured.
+        now : Optional[float]
+            The current time. Defaults to `time.time()`.
+
+        Returns
+        -------
+        str
+            One of `ACTIONS`.
+
+        """
+        now = time.time() if now is None else now
+        remaining = self.deadline - (now - capture_time)
+        candidates = [DETECT, DETECT_REDUCED, PREDICT]
+        if not self.reduced_resolution:
+            candidates.remove(DETECT_REDUCED)
+
+        action = DROP
+        for candidate in candidates:
+            if self.costs[candidate] <= remaining:
+                action = candidate
+                break
+        if action in (PREDICT, DROP) and \
+                self.max_detection_gap is not None and \
+                self.frames_since_detection >= self.max_detection_gap:
+            action = candidates[-2]
+
+        self._counts[action] += 1
+        if action in (DETECT, DETECT_REDUCED):
+            self.frames_since_detection = 0
+        else:
+            self.frames_since_detection += 1
+        return action
+
+    def record(self, action, capture_time, start_time, now=None):
+        """Record the processing time and latency of a frame.
+
+        Parameters
+        ----------
+        action : str
+            The action returned by `decide`.
+        capture_time : float
+            The time the frame has been captured.
+        start_time : float
+            The time processing of the frame has started.
+        now : Optional[float]
+            The time the result is available. Defaults to `time.time()`.
+
+        """
+        now = time.time() if now is None else now
+        cost = now - start_time
+        if self._num_measurements[action] == 0:
+            self.costs[action] = cost
+        else:
+            self.costs[action] += self.smoothing * (cost - self.costs[action])
+        self._num_measurements[action] += 1
+
+        latency = now - capture_time
+        self._latencies.append(latency)
+        self._num_results += 1
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+        if latency > self.deadline:
+            self._num_misses += 1
+
+    def statistics(self):
+        """Returns the number of frames per action and latency statistics
+        (in seconds; percentiles are computed over the most recent `history`
+        results) as a dictionary."""
+        latencies = np.asarray(self._latencies)
+        statistics = dict(self._counts)
+        statistics.update({
+            "num_frames": sum(self._counts.values()),
+            "num_results": self._num_results,
+            "deadline_misses": self._num_misses,
+            "mean_latency": (
+                self._total_latency / self._num_results if self._num_results
+                else 0.),
+            "max_latency": self._max_latency,
+            "p50_latency": (
+                np.percentile(latencies, 50) if len(latencies) else 0.),
+            "p95_latency": (
+                np.percentile(latencies, 95) if len(latencies) else 0.)})
+        return statistics
+
+    def format_statistics(self):
+        """Returns a human readable summary of the statistics."""
+        s = self.statistics()
+        num_frames = max(s["num_frames"], 1)
+        lines = ["%-10s %8s %8s" % ("action", "frames", "share")]
+        for action in ACTIONS:
+            lines.append("%-10s %8d %7.1f%%" % (
+                action, s[action], 100. * s[action] / num_frames))
+        lines.append(
+            "latency [ms]: mean %.1f, p50 %.1f, p95 %.1f, max %.1f; "
+            "%d of %d results missed the deadline of %.1f" % (
+                1e3 * s["mean_latency"], 1e3 * s["p50_latency"],
+                1e3 * s["p95_latency"], 1e3 * s["max_latency"],
+                s["deadline_misses"], s["num_results"], 1e3 * self.deadline))
+        return "\n".join(lines)
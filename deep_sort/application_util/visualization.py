@@ -57,6 +57,8 @@ class NoVisualization(object):
     """
     A dummy visualization object that loops through all frames in a given
     sequence to update the tracker without performing any visualization.
+
+    The loop terminates early if the frame callback returns False.
     """
 
     def __init__(self, seq_info):
@@ -77,13 +79,16 @@ class NoVisualization(object):
 
     def run(self, frame_callback):
         while self.frame_idx <= self.last_idx:
-            frame_callback(self, self.frame_idx)
+            if frame_callback(self, self.frame_idx) is False:
+                break
             self.frame_idx += 1
 
 
 class Visualization(object):
     """
     This class shows tracking output in an OpenCV image viewer.
+
+    The viewer terminates early if the frame callback returns False.
     """
 
     def __init__(self, seq_info, update_ms):
@@ -102,7 +107,8 @@ class Visualization(object):
     def _update_fun(self, frame_callback):
         if self.frame_idx > self.last_idx:
             return False  # Terminate
-        frame_callback(self, self.frame_idx)
+        if frame_callback(self, self.frame_idx) is False:
+            return False  # Terminate
         self.frame_idx += 1
         return True
 
@@ -0,0 +1,259 @@
+# vim: expandtab:ts=4:sw=4
+from __future__ import absolute_import
+import numpy as np
+
+
+def _squared_distances(a, b, a_squared_norms=None):
+    """Compute pair-wise squared Euclidean distances between the rows of
+    `a` and `b`."""
+    if a_squared_norms is None:
+        a_squared_norms = np.square(a).sum(axis=1)
+    distances = -2. * np.dot(a, b.T)
+    distances += a_squared_norms[:, np.newaxis]
+    distances += np.square(b).sum(axis=1)[np.newaxis, :]
+    return np.maximum(0., distances)
+
+
+def kmeans(vectors, num_clusters, num_iterations=10, seed=0):
+    """Cluster vectors with Lloyd's algorithm.
+
+    Parameters
+    ----------
+    vectors : ndarray
+        An NxM matrix of N vectors of dimensionality M.
+    num_clusters : int
+        The number of clusters. Must not exceed N.
+    num_iterations : int
+        The number of iterations.
+    seed : int
+        Seed of the random number generator that chooses the initial
+        centroids (and replacements of empty clusters).
+
+    Returns
+    -------
+    ndarray
+        The num_clusters x M matrix of cluster centroids.
+
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)]
+    for _ in range(num_iterations):
+        labels = np.argmin(_squared_distances(vectors, centroids), axis=1)
+        counts = np.bincount(labels, minlength=num_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = counts == 0
+        nonempty = np.logical_not(empty)
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+        centroids[empty] = vectors[rng.choice(len(vectors), np.sum(empty))]
+    return centroids
+
+
+class IVFIndex(object):
+    """
+    An inverted file index for approximate nearest neighbor search.
+
+    Vectors are partitioned by the nearest of `num_lists` coarse centroids
+    (computed with `kmeans`). A query only visits the vectors in the lists
+    of its `num_probes` nearest centroids, such that the work per query is
+    about `num_probes / num_lists` of a brute-force scan. Increasing
+    `num_probes` trades speed for recall; `num_probes == num_lists` is an
+    exact search.
+
+    Vectors are identified by non-negative integer keys, which are not
+    required to be contiguous (e.g., positions in a gallery array). Inserting
+    and removing vectors takes constant time per vector; removed entries are
+    replaced by the last entry of their list.
+
+    Parameters
+    ----------
+    num_lists : int
+        The number of coarse centroids (inverted lists).
+    num_probes : int
+        The number of lists visited by each query.
+    train_size : Optional[int]
+        The number of vectors that the coarse centroids are computed from.
+        Defaults to 16 vectors per list.
+
+    Attributes
+    ----------
+    num_lists : int
+        The number of coarse centroids (inverted lists).
+    num_probes : int
+        The number of lists visited by each query. Can be changed at any
+        time.
+    train_size : int
+        The number of vectors that the coarse centroids are computed from.
+    centroids : ndarray | NoneType
+        The coarse centroids, or None if the index has not been trained.
+
+    """
+
+    def __init__(self, num_lists=64, num_probes=8, train_size=None):
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.train_size = (
+            train_size if train_size is not None else 16 * num_lists)
+        self.centroids = None
+        self.reset()
+
+    def __len__(self):
+        return int(self._sizes.sum())
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def reset(self):
+        """Remove all vectors, but keep the coarse centroids."""
+        self._vectors = [None] * self.num_lists
+        self._squared_norms = [None] * self.num_lists
+        self._keys = [None] * self.num_lists
+        self._sizes = np.zeros(self.num_lists, dtype=np.int64)
+        self._list_of = np.zeros(0, dtype=np.int64)  # Indexed by key.
+        self._position_of = np.zeros(0, dtype=np.int64)
+
+    def train(self, vectors):
+        """Compute the coarse centroids.
+
+        Parameters
+        ----------
+        vectors : ndarray
+            An NxM matrix of training vectors, N >= `num_lists`.
+
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > self.train_size:
+            rng = np.random.RandomState(0)
+            vectors = vectors[rng.choice(
+                len(vectors), self.train_size, replace=False)]
+        self.centroids = kmeans(vectors, self.num_lists)
+        self.reset()
+
+    def _assign(self, vectors):
+        return np.argmin(_squared_distances(vectors, self.centroids), axis=1)
+
+    def add(self, keys, vectors):
+        """Insert vectors. The index must be trained.
+
+        Parameters
+        ----------
+        keys : array_like
+            The N keys of the vectors. Keys must not be in the index.
+        vectors : ndarray
+            An NxM matrix of vectors.
+
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(keys) == 0:
+            return
+        if keys.max() >= len(self._list_of):
+            size = max(2 * len(self._list_of), keys.max() + 1)
+            self._list_of = np.r_[self._list_of, np.full(
+                size - len(self._list_of), -1, dtype=np.int64)]
+            self._position_of = np.r_[self._position_of, np.zeros(
+                size - len(self._position_of), dtype=np.int64)]
+
+        labels = self._assign(vectors)
+        for label in np.unique(labels):
+            indices = np.flatnonzero(labels == label)
+            start = self._sizes[label]
+            end = start + len(indices)
+            if self._keys[label] is None or end > len(self._keys[label]):
+                self._grow(label, max(end, 2 * start, 16), vectors.shape[1])
+            self._vectors[label][start:end] = vectors[indices]
+            self._squared_norms[label][start:end] = np.square(
+                vectors[indices]).sum(axis=1)
+            self._keys[label][start:end] = keys[indices]
+            self._list_of[keys[indices]] = label
+            self._position_of[keys[indices]] = np.arange(start, end)
+            self._sizes[label] = end
+
+    def _grow(self, label, capacity, feature_dim):
+        vectors = np.zeros((capacity, feature_dim), dtype=np.float32)
+        squared_norms = np.zeros(capacity, dtype=np.float32)
+        keys = np.zeros(capacity, dtype=np.int64)
+        size = self._sizes[label]
+        if self._keys[label] is not None:
+            vectors[:size] = self._vectors[label][:size]
+            squared_norms[:size] = self._squared_norms[label][:size]
+            keys[:size] = self._keys[label][:size]
+        self._vectors[label], self._squared_norms[label], self._keys[label] = (
+            vectors, squared_norms, keys)
+
+    def remove(self, keys):
+        """Remove vectors. Keys that are not in the index are ignored.
+
+        Parameters
+        ----------
+        keys : array_like
+            The keys of the vectors to remove.
+
+        """
+        for key in np.asarray(keys, dtype=np.int64).tolist():
+            if key >= len(self._list_of) or self._list_of[key] < 0:
+                continue
+            label, position = self._list_of[key], self._position_of[key]
+            last = self._sizes[label] - 1
+            if position != last:
+                moved_key = self._keys[label][last]
+                self._vectors[label][position] = self._vectors[label][last]
+                self._squared_norms[label][position] = (
+                    self._squared_norms[label][last])
+                self._keys[label][position] = moved_key
+                self._position_of[moved_key] = position
+            self._sizes[label] = last
+            self._list_of[key] = -1
+
+    def search(self, queries, max_distance=None):
+        """Find candidate neighbors of query vectors.
+
+        Parameters
+        ----------
+        queries : ndarray
+            An NxM matrix of N query vectors.
+        max_distance : Optional[float]
+            If not None, only candidates with a squared Euclidean distance of
+            at most this value are returned.
+
+        Returns
+        -------
+        (ndarray, ndarray, ndarray)
+            Returns the keys of all vectors in the lists probed by each query,
+            the associated query indices, and their squared Euclidean
+            distances.
+
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        coarse = _squared_distances(queries, self.centroids)
+        num_probes = min(self.num_probes, self.num_lists)
+        probes = np.argpartition(coarse, num_probes - 1, axis=1)[
+            :, :num_probes]
+        is_probed = np.zeros((len(queries), self.num_lists), dtype=np.bool_)
+        is_probed[np.arange(len(queries))[:, np.newaxis], probes] = True
+
+        keys, query_ids, distances = [], [], []
+        for label in np.flatnonzero(self._sizes > 0):
+            query_indices = np.flatnonzero(is_probed[:, label])
+            if len(query_indices) == 0:
+                continue
+            size = self._sizes[label]
+            d = _squared_distances(
+                self._vectors[label][:size], queries[query_indices],
+                self._squared_norms[label][:size])
+            if max_distance is None:
+                entries, columns = np.divmod(
+                    np.arange(d.size), len(query_indices))
+            else:
+                entries, columns = np.nonzero(d <= max_distance)
+            keys.append(self._keys[label][entries])
+            query_ids.append(query_indices[columns])
+            distances.append(d[entries, columns])
+        if len(keys) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.float32)
+        return (
+            np.concatenate(keys), np.concatenate(query_ids),
+            np.concatenate(distances))
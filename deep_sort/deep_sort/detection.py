@@ -12,8 +12,9 @@ class Detection(object):
         Bounding box in format `(x, y, w, h)`.
     confidence : float
         Detector confidence score.
-    feature : array_like
+    feature : Optional[array_like]
         A feature vector that describes the object contained in this image.
+        None if no feature vector has been computed.
 
     Attributes
     ----------
@@ -29,7 +30,9 @@ class Detection(object):
     def __init__(self, tlwh, confidence, feature):
         self.tlwh = np.asarray(tlwh, dtype=np.float)
         self.confidence = float(confidence)
-        self.feature = np.asarray(feature, dtype=np.float32)
+        self.feature = None
+        if feature is not None:
+            self.feature = np.asarray(feature, dtype=np.float32)
 
     def to_tlbr(self):
         """Convert bounding box to format `(min x, min y, max x, max y)`, i.e.,
@@ -47,3 +50,136 @@ class Detection(object):
         ret[:2] += ret[2:] / 2
         ret[2] /= ret[3]
         return ret
+
+
+class DetectionBatch(object):
+    """
+    This class represents all bounding box detections in a single image. In
+    contrast to a list of `Detection` objects, bounding boxes, confidence
+    scores, and features are stored in contiguous arrays (one row per
+    detection), such that conversions and distance computations can be
+    vectorized.
+
+    Indexing with an integer returns a `Detection` that references the
+    corresponding rows. Indexing with a slice, an integer array, or a boolean
+    mask returns a `DetectionBatch` with the selected detections.
+
+    Parameters
+    ----------
+    tlwh : array_like
+        An Nx4 matrix of bounding boxes in format `(x, y, w, h)`.
+    confidence : array_like
+        A vector of N detector confidence scores.
+    feature : Optional[array_like]
+        An NxL matrix of feature vectors that describe the objects contained
+        in this image. If None, an Nx0 matrix is created.
+
+    Attributes
+    ----------
+    tlwh : ndarray
+        An Nx4 matrix of bounding boxes in format
+        `(top left x, top left y, width, height)`.
+    confidence : ndarray
+        A vector of N detector confidence scores.
+    feature : ndarray
+        An NxL matrix of feature vectors.
+
+    """
+
+    def __init__(self, tlwh, confidence, feature=None):
+        self.tlwh = np.asarray(tlwh, dtype=np.float).reshape(-1, 4)
+        self.confidence = np.asarray(
+            confidence, dtype=np.float).reshape(len(self.tlwh))
+        if feature is None:
+            feature = np.zeros((len(self.tlwh), 0))
+        self.feature = np.asarray(feature, dtype=np.float32)
+        if self.feature.ndim != 2:
+            self.feature = self.feature.reshape(len(self.tlwh), -1)
+
+    @classmethod
+    def from_detections(cls, detections):
+        """Create a batch from a list of detections.
+
+        Parameters
+        ----------
+        detections : List[Detection]
+            A list of detections in a single image.
+
+        Returns
+        -------
+        DetectionBatch
+            A batch that contains a copy of the given detections.
+
+        """
+        if len(detections) == 0:
+            return cls(np.zeros((0, 4)), np.zeros((0, )))
+        features = None  # Detections without features.
+        if any(d.feature is not None for d in detections):
+            features = np.array([d.feature for d in detections])
+        return cls(
+            np.array([d.tlwh for d in detections]),
+            np.array([d.confidence for d in detections]),
+            features)
+
+    def __len__(self):
+        return len(self.tlwh)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return Detection(
+                self.tlwh[key], self.confidence[key], self.feature[key])
+        return DetectionBatch(
+            self.tlwh[key], self.confidence[key], self.feature[key])
+
+    def to_tlbr(self):
+        """Convert bounding boxes to format `(min x, min y, max x, max y)`,
+        i.e., `(top left, bottom right)`.
+
+        Returns
+        -------
+        ndarray
+            An Nx4 matrix of bounding boxes.
+
+        """
+        ret = self.tlwh.copy()
+        ret[:, 2:] += ret[:, :2]
+        return ret
+
+    def to_xyah(self):
+        """Convert bounding boxes to format `(center x, center y, aspect ratio,
+        height)`, where the aspect ratio is `width / height`.
+
+        Returns
+        -------
+        ndarray
+            An Nx4 matrix of bounding boxes.
+
+        """
+        ret = self.tlwh.copy()
+        ret[:, :2] += ret[:, 2:] / 2
+        ret[:, 2] /= ret[:, 3]
+        return ret
+
+
+def as_detection_batch(detections):
+    """Convert a list of detections to a `DetectionBatch`.
+
+    Parameters
+    ----------
+    detections : List[Detection] | DetectionBatch
+        The detections in a single image.
+
+    Returns
+    -------
+    DetectionBatch
+        Returns `detections` if it is a batch already, otherwise a batch that
+        contains a copy of the given detections.
+
+    """
+    if isinstance(detections, DetectionBatch):
+        return detections
+    return DetectionBatch.from_detections(detections)
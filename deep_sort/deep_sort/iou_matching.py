@@ -2,6 +2,86 @@
 from __future__ import absolute_import
 import numpy as np
 from . import linear_assignment
+from .detection import as_detection_batch
+
+
+def iou_matrix(boxes, candidates, dtype=np.float64, chunk_size=None):
+    """Compute pairwise intersection over union.
+
+    Parameters
+    ----------
+    boxes : array_like
+        A matrix of N bounding boxes (one per row) in format
+        `(top left x, top left y, width, height)`.
+    candidates : array_like
+        A matrix of M candidate bounding boxes (one per row) in the same
+        format as `boxes`.
+    dtype : Optional[dtype]
+        The data type of the computation and the result. Use np.float32 to
+        half memory traffic when full precision is not needed.
+    chunk_size : Optional[int]
+        If not None, at most this many rows of `boxes` are processed at once
+        to bound the size of intermediate arrays for very large N x M.
+
+    Returns
+    -------
+    ndarray
+        An NxM matrix, where entry (i, j) is the intersection over union in
+        [0, 1] between `boxes[i]` and `candidates[j]`.
+
+    """
+    boxes = np.asarray(boxes, dtype=dtype).reshape(-1, 4)
+    candidates = np.asarray(candidates, dtype=dtype).reshape(-1, 4)
+    if chunk_size is None:
+        chunk_size = max(1, len(boxes))
+
+    result = np.empty((len(boxes), len(candidates)), dtype=dtype)
+    for start in range(0, len(boxes), chunk_size):
+        chunk = boxes[start:start + chunk_size]
+        result[start:start + chunk_size] = _broadcast_iou(
+            chunk[:, np.newaxis, :], candidates[np.newaxis, :, :])
+    return result
+
+
+def iou_pairs(boxes, candidates, dtype=np.float64):
+    """Compute intersection over union of corresponding rows.
+
+    Parameters
+    ----------
+    boxes : array_like
+        A matrix of N bounding boxes (one per row) in format
+        `(top left x, top left y, width, height)`.
+    candidates : array_like
+        A matrix of N candidate bounding boxes in the same format.
+    dtype : Optional[dtype]
+        The data type of the computation and the result.
+
+    Returns
+    -------
+    ndarray
+        The intersection over union between `boxes[i]` and `candidates[i]`.
+
+    """
+    return _broadcast_iou(
+        np.asarray(boxes, dtype=dtype).reshape(-1, 4),
+        np.asarray(candidates, dtype=dtype).reshape(-1, 4))
+
+
+def _broadcast_iou(boxes, candidates):
+    boxes_tl = boxes[..., :2]
+    boxes_br = boxes_tl + boxes[..., 2:]
+    candidates_tl = candidates[..., :2]
+    candidates_br = candidates_tl + candidates[..., 2:]
+
+    tl = np.maximum(boxes_tl, candidates_tl)
+    br = np.minimum(boxes_br, candidates_br)
+    wh = np.maximum(0., br - tl)
+
+    area_intersection = wh.prod(axis=-1)
+    area_boxes = boxes[..., 2:].prod(axis=-1)
+    area_candidates = candidates[..., 2:].prod(axis=-1)
+    return area_intersection / (
+        area_boxes + area_candidates - area_intersection)
 
 
 def iou(bbox, candidates):
@@ -23,38 +103,34 @@ def iou(bbox, candidates):
         occluded by the candidate.
 
     """
-    bbox_tl, bbox_br = bbox[:2], bbox[:2] + bbox[2:]
-    candidates_tl = candidates[:, :2]
-    candidates_br = candidates[:, :2] + candidates[:, 2:]
-
-    tl = np.c_[np.maximum(bbox_tl[0], candidates_tl[:, 0])[:, np.newaxis],
-               np.maximum(bbox_tl[1], candidates_tl[:, 1])[:, np.newaxis]]
-    br = np.c_[np.minimum(bbox_br[0], candidates_br[:, 0])[:, np.newaxis],
-               np.minimum(bbox_br[1], candidates_br[:, 1])[:, np.newaxis]]
-    wh = np.maximum(0., br - tl)
-
-    area_intersection = wh.prod(axis=1)
-    area_bbox = bbox[2:].prod()
-    area_candidates = candidates[:, 2:].prod(axis=1)
-    return area_intersection / (area_bbox + area_candidates - area_intersection)
+    return iou_matrix(np.asarray(bbox)[np.newaxis, :], candidates)[0]
 
 
 def iou_cost(tracks, detections, track_indices=None,
-             detection_indices=None):
+             detection_indices=None, candidates=None, max_time_since_update=1):
     """An intersection over union distance metric.
 
     Parameters
     ----------
     tracks : List[deep_sort.track.Track]
         A list of tracks.
-    detections : List[deep_sort.detection.Detection]
-        A list of detections.
+    detections : deep_sort.detection.DetectionBatch | List[deep_sort.detection.Detection]
+        The detections.
     track_indices : Optional[List[int]]
         A list of indices to tracks that should be matched. Defaults to
         all `tracks`.
     detection_indices : Optional[List[int]]
         A list of indices to detections that should be matched. Defaults
         to all `detections`.
+    candidates : Optional[ndarray]
+        A boolean matrix of shape len(track_indices), len(detection_indices)
+        (e.g., from `spatial_index.GridIndex`). If not None, the IOU is only
+        computed for entries that are True, all other entries are set to
+        `linear_assignment.INFTY_COST`. Entries of non-overlapping boxes may
+        be False without changing the matching result.
+    max_time_since_update : int
+        Tracks that have not been updated for more time steps are set to
+        `linear_assignment.INFTY_COST`.
 
     Returns
     -------
@@ -69,13 +145,27 @@ def iou_cost(tracks, detections, track_indices=None,
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        if tracks[track_idx].time_since_update > 1:
-            cost_matrix[row, :] = linear_assignment.INFTY_COST
-            continue
+    detection_boxes = as_detection_batch(detections).tlwh[detection_indices]
+    cost_matrix = np.full(
+        (len(track_indices), len(detection_indices)),
+        linear_assignment.INFTY_COST)
+    time_since_update = np.array(
+        [tracks[i].time_since_update for i in track_indices], dtype=np.int64)
+    recent_rows = np.flatnonzero(time_since_update <= max_time_since_update)
+    if len(recent_rows) == 0 or len(detection_indices) == 0:
+        return cost_matrix
+
+    # Convert (x, y, a, h) to (top left x, top left y, width, height), see
+    # `Track.to_tlwh`.
+    bboxes = np.asarray(
+        [tracks[track_indices[row]].mean[:4] for row in recent_rows])
+    bboxes[:, 2] *= bboxes[:, 3]
+    bboxes[:, :2] -= bboxes[:, 2:] / 2
+    if candidates is None:
+        cost_matrix[recent_rows] = 1. - iou_matrix(bboxes, detection_boxes)
+        return cost_matrix
 
-        bbox = tracks[track_idx].to_tlwh()
-        candidates = np.asarray([detections[i].tlwh for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    rows, cols = np.nonzero(candidates[recent_rows])
+    cost_matrix[recent_rows[rows], cols] = 1. - iou_pairs(
+        bboxes[rows], detection_boxes[cols])
     return cost_matrix
@@ -85,7 +85,16 @@ class KalmanFilter(object):
         covariance = np.diag(np.square(std))
         return mean, covariance
 
-    def predict(self, mean, covariance):
+    def _motion_matrix(self, dt):
+        if dt == 1:
+            return self._motion_mat
+        ndim = len(self._update_mat)
+        motion_mat = np.eye(2 * ndim, 2 * ndim)
+        for i in range(ndim):
+            motion_mat[i, ndim + i] = dt
+        return motion_mat
+
+    def predict(self, mean, covariance, dt=1.):
         """Run Kalman filter prediction step.
 
         Parameters
@@ -96,6 +105,9 @@ class KalmanFilter(object):
         covariance : ndarray
             The 8x8 dimensional covariance matrix of the object state at the
             previous time step.
+        dt : Optional[float]
+            The elapsed time in frames, e.g., larger than 1 if frames have
+            been dropped. The process noise grows linearly with `dt`.
 
         Returns
         -------
@@ -114,12 +126,50 @@ class KalmanFilter(object):
             self._std_weight_velocity * mean[3],
             1e-5,
             self._std_weight_velocity * mean[3]]
-        motion_cov = np.diag(np.square(np.r_[std_pos, std_vel]))
+        motion_cov = np.diag(dt * np.square(np.r_[std_pos, std_vel]))
 
-        mean = np.dot(self._motion_mat, mean)
+        motion_mat = self._motion_matrix(dt)
+        mean = np.dot(motion_mat, mean)
         covariance = np.linalg.multi_dot((
-            self._motion_mat, covariance, self._motion_mat.T)) + motion_cov
+            motion_mat, covariance, motion_mat.T)) + motion_cov
+
+        return mean, covariance
+
+    def predict_many(self, mean, covariance, dt=1.):
+        """Run Kalman filter prediction step for multiple objects at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors of the object states at the
+            previous time step.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states at
+            the previous time step.
+        dt : Optional[float]
+            The elapsed time in frames, see `predict`.
 
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the mean vectors and covariance matrices of the predicted
+            states (same layout as the input). The result is equivalent to
+            calling `predict` on each object.
+
+        """
+        height = mean[:, 3]
+        std = np.empty_like(mean)
+        std[:, [0, 1, 3]] = self._std_weight_position * height[:, np.newaxis]
+        std[:, 2] = 1e-2
+        std[:, [4, 5, 7]] = self._std_weight_velocity * height[:, np.newaxis]
+        std[:, 6] = 1e-5
+
+        motion_mat = self._motion_matrix(dt)
+        mean = np.dot(mean, motion_mat.T)
+        covariance = np.matmul(
+            np.matmul(motion_mat, covariance), motion_mat.T)
+        diagonal = np.arange(mean.shape[1])
+        covariance[:, diagonal, diagonal] += dt * np.square(std)
         return mean, covariance
 
     def project(self, mean, covariance):
@@ -151,6 +201,36 @@ class KalmanFilter(object):
             self._update_mat, covariance, self._update_mat.T))
         return mean, covariance + innovation_cov
 
+    def project_many(self, mean, covariance):
+        """Project state distributions of multiple objects to measurement
+        space.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors of the object states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 dimensional projected mean vectors and the Nx4x4
+            dimensional projected covariance matrices.
+
+        """
+        height = mean[:, 3]
+        std = np.empty((len(mean), 4))
+        std[:, [0, 1, 3]] = self._std_weight_position * height[:, np.newaxis]
+        std[:, 2] = 1e-1
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(
+            np.matmul(self._update_mat, covariance), self._update_mat.T)
+        diagonal = np.arange(4)
+        covariance[:, diagonal, diagonal] += np.square(std)
+        return mean, covariance
+
     def update(self, mean, covariance, measurement):
         """Run Kalman filter correction step.
 
@@ -185,6 +265,42 @@ class KalmanFilter(object):
             kalman_gain, projected_cov, kalman_gain.T))
         return new_mean, new_covariance
 
+    def update_many(self, mean, covariance, measurements):
+        """Run Kalman filter correction step for multiple objects at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional predicted mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional predicted covariance matrices.
+        measurements : ndarray
+            The Nx4 dimensional measurement vectors (x, y, a, h), where
+            measurement i is associated with state i.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions (same layout
+            as the input). The result is equivalent to calling `update` on
+            each object.
+
+        """
+        projected_mean, projected_cov = self.project_many(mean, covariance)
+
+        # Solve projected_cov * kalman_gain^T = (covariance * H^T)^T.
+        kalman_gain = np.linalg.solve(
+            projected_cov,
+            np.matmul(self._update_mat, covariance.transpose(0, 2, 1)))
+        kalman_gain = kalman_gain.transpose(0, 2, 1)
+        innovation = measurements - projected_mean
+
+        new_mean = mean + np.einsum("nij,nj->ni", kalman_gain, innovation)
+        new_covariance = covariance - np.matmul(
+            np.matmul(kalman_gain, projected_cov),
+            kalman_gain.transpose(0, 2, 1))
+        return new_mean, new_covariance
+
     def gating_distance(self, mean, covariance, measurements,
                         only_position=False):
         """Compute gating distance between state distribution and measurements.
@@ -227,3 +343,184 @@ class KalmanFilter(object):
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
         return squared_maha
+
+    def gating_distance_many(self, mean, covariance, measurements,
+                             only_position=False, pairs=None):
+        """Compute gating distances between the state distributions of
+        multiple objects and measurements at once.
+
+        All state distributions are projected with `project_many`, and the
+        squared Mahalanobis distances are computed with stacked Cholesky
+        factors of the projected covariances.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors of the object states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements in format (x, y, a, h).
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        pairs : Optional[(ndarray, ndarray)]
+            If not None, distances are only computed for these pairs of object
+            and measurement indices.
+
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) contains the squared
+            Mahalanobis distance between the i-th state distribution and
+            `measurements[j]`. Row i is equivalent to calling
+            `gating_distance` on the i-th object. If `pairs` is not None,
+            returns a vector with the distance of each pair instead.
+
+        """
+        mean, covariance = self.project_many(mean, covariance)
+        measurements = np.asarray(measurements)
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        cholesky_factor = np.linalg.cholesky(covariance)
+        if pairs is not None:
+            rows, cols = pairs
+            d = measurements[cols] - mean[rows]
+            return _squared_mahalanobis(
+                cholesky_factor[rows], d[:, np.newaxis, :])[:, 0]
+        d = measurements[np.newaxis, :, :] - mean[:, np.newaxis, :]
+        return _squared_mahalanobis(cholesky_factor, d)
+
+
+def _squared_mahalanobis(cholesky_factor, d):
+    # Solve L z = d by forward substitution, vectorized over the Nxkxk
+    # Cholesky factors L and the NxMxk differences d.
+    z = np.empty_like(d)
+    for k in range(d.shape[2]):
+        residual = d[:, :, k] - np.einsum(
+            "nj,nmj->nm", cholesky_factor[:, k, :k], z[:, :, :k])
+        z[:, :, k] = residual / cholesky_factor[:, k, k][:, np.newaxis]
+    return np.sum(z * z, axis=2)
+
+
+_POS = np.arange(4)
+_VEL = _POS + 4
+
+
+class DecoupledKalmanFilter(KalmanFilter):
+    """
+    A Kalman filter with the same model as `KalmanFilter`, implemented in
+    closed form.
+
+    The constant velocity model with diagonal noise decomposes into four
+    independent filters, one per measured quantity (x, y, a, h), each with a
+    2-dimensional (position, velocity) state. Covariance matrices therefore
+    stay block diagonal, and all steps reduce to a few element-wise
+    operations on the 2x2 blocks, vectorized over objects, without generic
+    matrix products or matrix decompositions.
+
+    Mean vectors and covariance matrices have the same layout as in
+    `KalmanFilter`, such that both filters are interchangeable. Entries of
+    the covariance matrix outside of the 2x2 blocks are assumed to be zero
+    (which holds for all distributions created by `initiate`).
+
+    """
+
+    def _std_position(self, height, position_std_weight, aspect_std):
+        std = np.empty((len(height), 4))
+        std[:, [0, 1, 3]] = position_std_weight * height[:, np.newaxis]
+        std[:, 2] = aspect_std
+        return std
+
+    def predict(self, mean, covariance, dt=1.):
+        mean, covariance = self.predict_many(
+            mean[np.newaxis], covariance[np.newaxis], dt)
+        return mean[0], covariance[0]
+
+    def predict_many(self, mean, covariance, dt=1.):
+        height = mean[:, 3]
+        var_pos = np.square(self._std_position(
+            height, self._std_weight_position, 1e-2))
+        var_vel = np.square(self._std_position(
+            height, self._std_weight_velocity, 1e-5))
+        a, b, c = _blocks(covariance)
+
+        mean = mean.copy()
+        mean[:, _POS] += dt * mean[:, _VEL]
+        return mean, _block_covariance(
+            a + 2 * dt * b + dt * dt * c + dt * var_pos, b + dt * c,
+            c + dt * var_vel)
+
+    def project(self, mean, covariance):
+        mean, covariance = self.project_many(
+            mean[np.newaxis], covariance[np.newaxis])
+        return mean[0], covariance[0]
+
+    def project_many(self, mean, covariance):
+        innovation_var = self._innovation_variance(mean, covariance)
+        projected_cov = np.zeros((len(mean), 4, 4))
+        projected_cov[:, _POS, _POS] = innovation_var
+        return mean[:, _POS], projected_cov
+
+    def _innovation_variance(self, mean, covariance):
+        return covariance[:, _POS, _POS] + np.square(self._std_position(
+            mean[:, 3], self._std_weight_position, 1e-1))
+
+    def update(self, mean, covariance, measurement):
+        mean, covariance = self.update_many(
+            mean[np.newaxis], covariance[np.newaxis],
+            np.asarray(measurement)[np.newaxis])
+        return mean[0], covariance[0]
+
+    def update_many(self, mean, covariance, measurements):
+        innovation_var = self._innovation_variance(mean, covariance)
+        a, b, c = _blocks(covariance)
+        gain_pos, gain_vel = a / innovation_var, b / innovation_var
+        innovation = measurements - mean[:, _POS]
+
+        new_mean = np.empty_like(mean)
+        new_mean[:, _POS] = mean[:, _POS] + gain_pos * innovation
+        new_mean[:, _VEL] = mean[:, _VEL] + gain_vel * innovation
+        return new_mean, _block_covariance(
+            a - gain_pos * a, b - gain_pos * b, c - gain_vel * b)
+
+    def gating_distance(self, mean, covariance, measurements,
+                        only_position=False):
+        return self.gating_distance_many(
+            mean[np.newaxis], covariance[np.newaxis], measurements,
+            only_position)[0]
+
+    def gating_distance_many(self, mean, covariance, measurements,
+                             only_position=False, pairs=None):
+        innovation_var = self._innovation_variance(mean, covariance)
+        mean = mean[:, _POS]
+        measurements = np.asarray(measurements)
+        if only_position:
+            mean, innovation_var = mean[:, :2], innovation_var[:, :2]
+            measurements = measurements[:, :2]
+
+        if pairs is not None:
+            rows, cols = pairs
+            d = measurements[cols] - mean[rows]
+            return np.sum(np.square(d) / innovation_var[rows], axis=1)
+        d = measurements[np.newaxis, :, :] - mean[:, np.newaxis, :]
+        return np.sum(
+            np.square(d) / innovation_var[:, np.newaxis, :], axis=2)
+
+
+def _blocks(covariance):
+    # Position variance, position-velocity covariance, and velocity variance
+    # of each of the four independent filters.
+    return (covariance[:, _POS, _POS], covariance[:, _POS, _VEL],
+            covariance[:, _VEL, _VEL])
+
+
+def _block_covariance(a, b, c):
+    covariance = np.zeros((len(a), 8, 8))
+    covariance[:, _POS, _POS] = a
+    covariance[:, _POS, _VEL] = b
+    covariance[:, _VEL, _POS] = b
+    covariance[:, _VEL, _VEL] = c
+    return covariance
@@ -1,16 +1,85 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
 import numpy as np
-from sklearn.utils.linear_assignment_ import linear_assignment
+import scipy.sparse
+import scipy.sparse.csgraph
+from . import assignment_solvers
 from . import kalman_filter
+from .detection import as_detection_batch
 
 
 INFTY_COST = 1e+5
 
 
+def solve_components(cost_matrix, max_distance, solver, row_keys=None):
+    """Solve a gated linear assignment problem by decomposition into
+    independent subproblems.
+
+    Rows and columns are nodes of a bipartite graph, with an edge for every
+    entry of the cost matrix that is not larger than `max_distance`. Each
+    connected component of this graph is solved independently, components
+    with a single edge are matched without calling the solver, and rows and
+    columns without any edge stay unmatched. If entries larger than
+    `max_distance` are clipped to a common value (as in
+    `min_cost_matching`), the matches are the same as those of the full
+    problem (up to ties).
+
+    Parameters
+    ----------
+    cost_matrix : ndarray
+        The NxM dimensional cost matrix.
+    max_distance : float
+        Gating threshold.
+    solver : Callable[ndarray] -> (ndarray, ndarray)
+        The linear assignment solver of each component.
+    row_keys : Optional[ndarray]
+        If not None, the keys of the component's rows are passed on to the
+        solver (see `assignment_solvers.WarmStartSolver`).
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        Returns the row and column indices of all matches with cost not larger
+        than `max_distance`, sorted by row.
+
+    """
+    num_rows, num_cols = cost_matrix.shape
+    edge_rows, edge_cols = np.nonzero(cost_matrix <= max_distance)
+    if len(edge_rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(len(edge_rows)), (edge_rows, num_rows + edge_cols)),
+        shape=(num_rows + num_cols, num_rows + num_cols))
+    num_components, labels = scipy.sparse.csgraph.connected_components(
+        graph, directed=False)
+    row_labels, col_labels = labels[:num_rows], labels[num_rows:]
+
+    edge_labels = row_labels[edge_rows]
+    is_trivial = np.bincount(
+        edge_labels, minlength=num_components)[edge_labels] == 1
+    rows, cols = [edge_rows[is_trivial]], [edge_cols[is_trivial]]
+    for label in np.unique(edge_labels[np.logical_not(is_trivial)]):
+        component_rows = np.flatnonzero(row_labels == label)
+        component_cols = np.flatnonzero(col_labels == label)
+        kwargs = {}
+        if row_keys is not None:
+            kwargs["row_keys"] = row_keys[component_rows].tolist()
+        rows_c, cols_c = solver(
+            cost_matrix[np.ix_(component_rows, component_cols)], **kwargs)
+        rows.append(component_rows[rows_c])
+        cols.append(component_cols[cols_c])
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    order = np.argsort(rows)
+    rows, cols = rows[order], cols[order]
+    is_match = cost_matrix[rows, cols] <= max_distance
+    return rows[is_match], cols[is_match]
+
+
 def min_cost_matching(
         distance_metric, max_distance, tracks, detections, track_indices=None,
-        detection_indices=None):
+        detection_indices=None, solver="scipy", decompose=False):
     """Solve linear assignment problem.
 
     Parameters
@@ -26,14 +95,21 @@ def min_cost_matching(
         disregarded.
     tracks : List[track.Track]
         A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : List[int]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above).
     detection_indices : List[int]
         List of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above).
+    solver : Optional[str | Callable[ndarray] -> (ndarray, ndarray)]
+        The linear assignment solver, see `assignment_solvers.get_solver`.
+        Defaults to `scipy.optimize.linear_sum_assignment`.
+    decompose : Optional[bool]
+        If True, the problem is split into independent subproblems, see
+        `solve_components`. This is much faster in crowded scenes, where
+        most track and detection pairs are gated out.
 
     Returns
     -------
@@ -41,7 +117,7 @@ def min_cost_matching(
         Returns a tuple with the following three entries:
         * A list of matched track and detection indices.
         * A list of unmatched track indices.
-        * A list of unmatched detection indices.
+        * A list of unmatched detection indices, sorted.
 
     """
     if track_indices is None:
@@ -50,36 +126,60 @@ def min_cost_matching(
         detection_indices = np.arange(len(detections))
 
     if len(detection_indices) == 0 or len(track_indices) == 0:
-        return [], track_indices, detection_indices  # Nothing to match.
+        # Nothing to match.
+        return [], track_indices, sorted(detection_indices)
 
     cost_matrix = distance_metric(
         tracks, detections, track_indices, detection_indices)
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
-    indices = linear_assignment(cost_matrix)
-
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in indices[:, 1]:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in indices[:, 0]:
-            unmatched_tracks.append(track_idx)
-    for row, col in indices:
-        track_idx = track_indices[row]
-        detection_idx = detection_indices[col]
-        if cost_matrix[row, col] > max_distance:
-            unmatched_tracks.append(track_idx)
-            unmatched_detections.append(detection_idx)
-        else:
-            matches.append((track_idx, detection_idx))
+    solver = assignment_solvers.get_solver(solver)
+    row_keys = None
+    if getattr(solver, "uses_row_keys", False):
+        row_keys = np.array([tracks[i].track_id for i in track_indices])
+    if decompose:
+        rows, cols = solve_components(
+            cost_matrix, max_distance, solver, row_keys)
+    elif row_keys is not None:
+        rows, cols = solver(cost_matrix, row_keys=row_keys.tolist())
+    else:
+        rows, cols = solver(cost_matrix)
+
+    # Unassigned rows and columns come first, followed by assignments that
+    # exceed the gating threshold (in row order).
+    track_indices = np.asarray(track_indices)
+    detection_indices = np.asarray(detection_indices)
+    is_match = cost_matrix[rows, cols] <= max_distance
+    is_assigned_track = np.zeros(len(track_indices), dtype=np.bool_)
+    is_assigned_track[rows] = True
+    is_assigned_detection = np.zeros(len(detection_indices), dtype=np.bool_)
+    is_assigned_detection[cols] = True
+
+    is_rejected = np.logical_not(is_match)
+    matches = list(zip(
+        track_indices[rows[is_match]].tolist(),
+        detection_indices[cols[is_match]].tolist()))
+    unmatched_tracks = np.r_[
+        track_indices[np.logical_not(is_assigned_track)],
+        track_indices[rows[is_rejected]]].tolist()
+    # Unmatched detections start new tracks in this order, which must not
+    # depend on the solver or on the decomposition.
+    unmatched_detections = sorted(np.r_[
+        detection_indices[np.logical_not(is_assigned_detection)],
+        detection_indices[cols[is_rejected]]].tolist())
     return matches, unmatched_tracks, unmatched_detections
 
 
 def matching_cascade(
         distance_metric, max_distance, cascade_depth, tracks, detections,
-        track_indices=None, detection_indices=None):
+        track_indices=None, detection_indices=None, solver="scipy",
+        decompose=False):
     """Run matching cascade.
 
+    The distance metric is evaluated once for all tracks that take part in
+    the cascade, and each level is solved on rows and columns of this cost
+    matrix. Hence, the metric must compute each entry independent of the
+    other given tracks and detections.
+
     Parameters
     ----------
     distance_metric : Callable[List[Track], List[Detection], List[int], List[int]) -> ndarray
@@ -95,8 +195,8 @@ def matching_cascade(
         The cascade depth, should be se to the maximum track age.
     tracks : List[track.Track]
         A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : Optional[List[int]]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above). Defaults to all tracks.
@@ -104,6 +204,11 @@ def matching_cascade(
         List of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above). Defaults to all
         detections.
+    solver : Optional[str | Callable[ndarray] -> (ndarray, ndarray)]
+        The linear assignment solver, see `assignment_solvers.get_solver`.
+    decompose : Optional[bool]
+        If True, each level is split into independent subproblems, see
+        `min_cost_matching`.
 
     Returns
     -------
@@ -119,31 +224,51 @@ def matching_cascade(
     if detection_indices is None:
         detection_indices = list(range(len(detections)))
 
-    unmatched_detections = detection_indices
+    time_since_update = np.array(
+        [tracks[k].time_since_update for k in track_indices], dtype=np.int64)
+
+    # Compute the cost matrix of all tracks that take part in the cascade
+    # once, then solve each level on a slice of it. Rows and columns of the
+    # slices are positions in `cascade_tracks` and `detection_indices`.
+    cascade_rows = np.flatnonzero(np.logical_and(
+        time_since_update >= 1, time_since_update <= cascade_depth))
+    if len(cascade_rows) == 0 or len(detection_indices) == 0:
+        return [], list(set(track_indices)), detection_indices
+    cascade_tracks = np.asarray(track_indices, dtype=np.int64)[cascade_rows]
+    detection_indices_array = np.asarray(detection_indices, dtype=np.int64)
+    cost_matrix = distance_metric(
+        tracks, detections, cascade_tracks.tolist(), detection_indices)
+    levels = time_since_update[cascade_rows]
+
+    def sliced_metric(tracks, detections, rows, cols):
+        return cost_matrix[np.ix_(rows, cols)]
+    cascade_track_list = [tracks[k] for k in cascade_tracks]
+
+    unmatched_cols = list(range(len(detection_indices)))
     matches = []
     for level in range(cascade_depth):
-        if len(unmatched_detections) == 0:  # No detections left
+        if len(unmatched_cols) == 0:  # No detections left
             break
 
-        track_indices_l = [
-            k for k in track_indices
-            if tracks[k].time_since_update == 1 + level
-        ]
-        if len(track_indices_l) == 0:  # Nothing to match at this level
+        rows_l = np.flatnonzero(levels == 1 + level).tolist()
+        if len(rows_l) == 0:  # Nothing to match at this level
             continue
 
-        matches_l, _, unmatched_detections = \
+        matches_l, _, unmatched_cols = \
             min_cost_matching(
-                distance_metric, max_distance, tracks, detections,
-                track_indices_l, unmatched_detections)
-        matches += matches_l
+                sliced_metric, max_distance, cascade_track_list, detections,
+                rows_l, unmatched_cols, solver, decompose)
+        matches += [
+            (int(cascade_tracks[row]), int(detection_indices_array[col]))
+            for row, col in matches_l]
+    unmatched_detections = detection_indices_array[unmatched_cols].tolist()
     unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
     return matches, unmatched_tracks, unmatched_detections
 
 
 def gate_cost_matrix(
         kf, cost_matrix, tracks, detections, track_indices, detection_indices,
-        gated_cost=INFTY_COST, only_position=False):
+        gated_cost=INFTY_COST, only_position=False, candidates=None):
     """Invalidate infeasible entries in cost matrix based on the state
     distributions obtained by Kalman filtering.
 
@@ -157,8 +282,8 @@ def gate_cost_matrix(
         `detections[detection_indices[j]]`.
     tracks : List[track.Track]
         A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    detections : detection.DetectionBatch | List[detection.Detection]
+        The detections at the current time step.
     track_indices : List[int]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above).
@@ -171,6 +296,11 @@ def gate_cost_matrix(
     only_position : Optional[bool]
         If True, only the x, y position of the state distribution is considered
         during gating. Defaults to False.
+    candidates : Optional[ndarray]
+        A boolean matrix of the same shape as `cost_matrix`. If not None,
+        gating distances are only computed for entries that are True, all
+        other entries are considered infeasible (see
+        `Tracker.spatial_index`).
 
     Returns
     -------
@@ -180,11 +310,23 @@ def gate_cost_matrix(
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
-    measurements = np.asarray(
-        [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
-        track = tracks[track_idx]
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return cost_matrix
+    measurements = as_detection_batch(
+        detections).to_xyah()[detection_indices]
+    mean = np.asarray([tracks[i].mean for i in track_indices])
+    covariance = np.asarray([tracks[i].covariance for i in track_indices])
+    if candidates is None:
+        gating_distance = kf.gating_distance_many(
+            mean, covariance, measurements, only_position)
+        cost_matrix[gating_distance > gating_threshold] = gated_cost
+        return cost_matrix
+
+    rows, cols = np.nonzero(candidates)
+    is_feasible = np.zeros(cost_matrix.shape, dtype=np.bool_)
+    if len(rows) > 0:
+        gating_distance = kf.gating_distance_many(
+            mean, covariance, measurements, only_position, (rows, cols))
+        is_feasible[rows, cols] = gating_distance <= gating_threshold
+    cost_matrix[np.logical_not(is_feasible)] = gated_cost
     return cost_matrix
@@ -1,5 +1,7 @@
 # vim: expandtab:ts=4:sw=4
+from __future__ import absolute_import
 import numpy as np
+from . import quantization
 
 
 def _pdist(a, b):
@@ -101,6 +103,18 @@ class NearestNeighborDistanceMetric(object):
     A nearest neighbor distance metric that, for each target, returns
     the closest distance to any sample that has been observed so far.
 
+    Samples are kept in a single preallocated gallery array of shape
+    (targets, budget, feature dimensionality) that is used as a ring buffer
+    per target, together with a mask of valid entries. For the cosine metric,
+    samples are normalized once when they are added. Distances between all
+    queried targets and features are then computed with a single matrix
+    product followed by a masked min-reduction.
+
+    The gallery can be stored in a compact data type (see
+    `quantization.quantize`). Matrix products are then computed on the
+    stored values converted to float32, and the per-sample scale factors of
+    int8 samples are applied to the products instead of to the gallery.
+
     Parameters
     ----------
     metric : str
@@ -111,16 +125,40 @@ class NearestNeighborDistanceMetric(object):
     budget : Optional[int]
         If not None, fix samples per class to at most this number. Removes
         the oldest samples when the budget is reached.
+    archive : Optional[track_archive.TrackArchive]
+        If not None, the samples of targets that are removed from the scene
+        are passed to this archive, such that they can be re-identified
+        later.
+    index : Optional[ann_index.IVFIndex]
+        If not None, samples are also inserted into this approximate nearest
+        neighbor index once enough samples have been observed to train it.
+        `distance` then only compares features to the samples in the probed
+        lists of the index, unless the queried targets have fewer samples
+        than a probe visits. Distances larger than the matching threshold,
+        and distances of targets without a sample in the probed lists, are
+        reported as infinite.
+    feature_dtype : Optional[str | dtype]
+        Data type of the gallery, one of `quantization.FEATURE_DTYPES`.
+        float16 halves and int8 quarters the memory of the default float32.
 
     Attributes
     ----------
     samples : Dict[int -> List[ndarray]]
         A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+        that have been observed so far (oldest first). This is a read-only
+        copy of the gallery. For the cosine metric, samples are normalized to
+        unit length.
+    archive : Optional[track_archive.TrackArchive]
+        The archive of removed targets.
+    index : Optional[ann_index.IVFIndex]
+        The approximate nearest neighbor index.
+    feature_dtype : dtype
+        Data type of the gallery.
 
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
+    def __init__(self, metric, matching_threshold, budget=None, archive=None,
+                 index=None, feature_dtype=np.float32):
 
 
         if metric == "euclidean":
@@ -130,9 +168,105 @@ class NearestNeighborDistanceMetric(object):
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
+        self._normalize = metric == "cosine"
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+        self.archive = archive
+        self.index = index
+        self.feature_dtype = np.dtype(feature_dtype)
+        if self.feature_dtype.name not in quantization.FEATURE_DTYPES:
+            raise ValueError(
+                "Invalid feature data type; must be one of %s" % (
+                    ", ".join(quantization.FEATURE_DTYPES)))
+
+        self._gallery = None  # Allocated when the first sample is added.
+        self._scales = None  # Scale factors of int8 samples.
+        self._squared_norms = None
+        self._valid = None
+        self._num_samples = None
+        self._rows = {}
+        self._free_rows = []
+
+    @property
+    def samples(self):
+        return dict(
+            (target, self._samples(row)) for target, row in self._rows.items())
+
+    def _samples(self, row):
+        num_samples, capacity = self._num_samples[row], self._valid.shape[1]
+        columns = np.arange(max(0, num_samples - capacity), num_samples)
+        return list(self._vectors(row, columns % capacity))
+
+    def _vectors(self, rows, columns):
+        # Returns gallery entries as float32.
+        scales = None if self._scales is None else self._scales[rows, columns]
+        return quantization.dequantize(self._gallery[rows, columns], scales)
+
+    def _allocate(self, feature_dim, num_rows=32):
+        capacity = self.budget if self.budget is not None else 16
+        self._gallery = np.zeros(
+            (num_rows, capacity, feature_dim), dtype=self.feature_dtype)
+        if self.feature_dtype == np.int8:
+            self._scales = np.zeros((num_rows, capacity), dtype=np.float32)
+        self._squared_norms = np.zeros((num_rows, capacity), dtype=np.float32)
+        self._valid = np.zeros((num_rows, capacity), dtype=np.bool_)
+        self._num_samples = np.zeros(num_rows, dtype=np.int64)
+        self._free_rows = list(range(num_rows - 1, -1, -1))
+
+    def _resize(self, num_rows, capacity):
+        old_rows, old_capacity = self._valid.shape
+        gallery = np.zeros(
+            (num_rows, capacity, self._gallery.shape[2]),
+            dtype=self.feature_dtype)
+        squared_norms = np.zeros((num_rows, capacity), dtype=np.float32)
+        valid = np.zeros((num_rows, capacity), dtype=np.bool_)
+        gallery[:old_rows, :old_capacity] = self._gallery
+        if self._scales is not None:
+            scales = np.zeros((num_rows, capacity), dtype=np.float32)
+            scales[:old_rows, :old_capacity] = self._scales
+            self._scales = scales
+        squared_norms[:old_rows, :old_capacity] = self._squared_norms
+        valid[:old_rows, :old_capacity] = self._valid
+        self._gallery, self._squared_norms, self._valid = (
+            gallery, squared_norms, valid)
+        self._num_samples = np.r_[
+            self._num_samples, np.zeros(num_rows - old_rows, dtype=np.int64)]
+        self._free_rows.extend(range(num_rows - 1, old_rows - 1, -1))
+        if capacity != old_capacity and self._is_indexed():
+            self._build_index()  # Index keys depend on the capacity.
+
+    def _is_indexed(self):
+        return self.index is not None and self.index.is_trained
+
+    def _index_keys(self, rows, columns):
+        return rows * self._valid.shape[1] + columns
+
+    def _build_index(self):
+        rows, columns = np.nonzero(self._valid)
+        vectors = self._vectors(rows, columns)
+        if not self.index.is_trained:
+            self.index.train(vectors)
+        self.index.reset()
+        self.index.add(self._index_keys(rows, columns), vectors)
+
+    def _row(self, target):
+        row = self._rows.get(target)
+        if row is None:
+            if len(self._free_rows) == 0:
+                num_rows, capacity = self._valid.shape
+                self._resize(2 * num_rows, capacity)
+            row = self._free_rows.pop()
+            self._rows[target] = row
+        return row
+
+    def _release(self, target):
+        row = self._rows.pop(target)
+        if self._is_indexed():
+            columns = np.flatnonzero(self._valid[row])
+            self.index.remove(self._index_keys(row, columns))
+        self._valid[row] = False
+        self._num_samples[row] = 0
+        self._free_rows.append(row)
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -147,13 +281,61 @@ class NearestNeighborDistanceMetric(object):
             A list of targets that are currently present in the scene.
 
         """
-        for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
-
-    def distance(self, features, targets):
+        features = np.asarray(features, dtype=np.float32)
+        if len(features) > 0:
+            if self._gallery is None:
+                self._allocate(features.shape[1])
+            if self._normalize:
+                features = features / np.linalg.norm(
+                    features, axis=1, keepdims=True)
+
+            # Group features by gallery row, keeping the order of arrival.
+            rows = np.array([self._row(t) for t in np.asarray(targets).tolist()])
+            order = np.argsort(rows, kind="mergesort")
+            rows, features = rows[order], features[order]
+            unique_rows, first, counts = np.unique(
+                rows, return_index=True, return_counts=True)
+            rank = np.arange(len(rows)) - np.repeat(first, counts)
+
+            capacity = self._valid.shape[1]
+            if self.budget is None:
+                required = np.max(self._num_samples[unique_rows] + counts)
+                if required > capacity:
+                    capacity = max(required, 2 * capacity)
+                    self._resize(self._valid.shape[0], capacity)
+
+            # Only the newest `capacity` features of each target are kept.
+            keep = rank >= np.repeat(counts, counts) - capacity
+            rows, rank, features = rows[keep], rank[keep], features[keep]
+            columns = (self._num_samples[rows] + rank) % capacity
+            values, scales = quantization.quantize(
+                features, self.feature_dtype)
+            features = quantization.dequantize(values, scales)
+            if self._is_indexed():
+                overwritten = self._valid[rows, columns]
+                self.index.remove(self._index_keys(
+                    rows[overwritten], columns[overwritten]))
+                self.index.add(self._index_keys(rows, columns), features)
+            self._gallery[rows, columns] = values
+            if scales is not None:
+                self._scales[rows, columns] = scales
+            self._squared_norms[rows, columns] = np.square(features).sum(axis=1)
+            self._valid[rows, columns] = True
+            self._num_samples[unique_rows] += counts
+            if self.index is not None and not self.index.is_trained and \
+                    np.count_nonzero(self._valid) >= self.index.train_size:
+                self._build_index()
+
+        released, active = {}, set(active_targets)
+        for target in [t for t in self._rows if t not in active]:
+            if self.archive is not None:
+                released[target] = np.asarray(
+                    self._samples(self._rows[target]))
+            self._release(target)
+        if self.archive is not None:
+            self.archive.update(released, active_targets)
+
+    def distance(self, features, targets, candidates=None):
         """Compute distance between features and targets.
 
         Parameters
@@ -162,16 +344,113 @@ class NearestNeighborDistanceMetric(object):
             An NxM matrix of N features of dimensionality M.
         targets : List[int]
             A list of targets to match the given `features` against.
+        candidates : Optional[ndarray]
+            A boolean matrix of shape len(targets), len(features). If not
+            None, distances are only computed for entries that are True
+            (e.g., pairs that overlap in a `spatial_index.GridIndex`), all
+            other entries are infinite.
 
         Returns
         -------
         ndarray
             Returns a cost matrix of shape len(targets), len(features), where
             element (i, j) contains the closest squared distance between
-            `targets[i]` and `features[j]`.
+            `targets[i]` and `features[j]`. Targets without samples have
+            infinite distance.
 
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
+        cost_matrix = np.full((len(targets), len(features)), np.inf)
+        rows = np.array(
+            [self._rows.get(t, -1) for t in np.asarray(targets).tolist()],
+            dtype=np.int64)
+        known = rows >= 0
+        if candidates is not None:
+            candidates = np.asarray(candidates, dtype=np.bool_)
+            known = np.logical_and(known, candidates.any(axis=1))
+        if len(features) == 0 or not np.any(known):
+            return cost_matrix
+        rows = rows[known]
+
+        features = np.asarray(features, dtype=np.float32)
+        if self._normalize:
+            features = features / np.linalg.norm(
+                features, axis=1, keepdims=True)
+        if self._is_indexed():
+            # Use the index if a probe visits fewer samples than a scan.
+            num_probed = len(self.index) * min(
+                1., self.index.num_probes / float(self.index.num_lists))
+            if np.sum(self._valid[rows]) > num_probed:
+                cost_matrix[known] = self._approximate_distance(
+                    features, rows)
+                if candidates is not None:
+                    cost_matrix[np.logical_not(candidates)] = np.inf
+                return cost_matrix
+
+        if candidates is None:
+            cost_matrix[known] = self._exact_distance(features, rows)
+            return cost_matrix
+
+        # Gather the candidate features of each row into a padded NxC
+        # matrix of feature indices, where C is the largest number of
+        # candidates of a row.
+        candidate_rows, candidate_cols = np.nonzero(candidates[known])
+        counts = np.bincount(candidate_rows, minlength=len(rows))
+        positions = np.arange(len(candidate_rows)) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        columns = np.zeros((len(rows), counts.max()), dtype=np.int64)
+        columns[candidate_rows, positions] = candidate_cols
+        distances = self._exact_distance(features, rows, columns)
+        cost_matrix[np.flatnonzero(known)[candidate_rows], candidate_cols] = \
+            distances[candidate_rows, positions]
         return cost_matrix
+
+    def _exact_distance(self, features, rows, columns=None):
+        # Returns the distance between the samples of gallery `rows` and all
+        # `features` (a matrix of shape len(rows), len(features)), or only
+        # `features[columns[i]]` for the i-th row (a matrix of the same shape
+        # as `columns`).
+
+        # Rings are filled from the first column, so columns beyond the
+        # largest number of samples of the queried targets are empty.
+        num_columns = min(self._valid.shape[1], self._num_samples[rows].max())
+        gallery = self._gallery[rows, :num_columns].astype(
+            np.float32, copy=False)
+        feature_dim = gallery.shape[2]
+        squared_norms = np.square(features).sum(axis=1)
+        if columns is None:
+            products = np.dot(gallery.reshape(-1, feature_dim), features.T)
+            products = products.reshape(len(rows), num_columns, -1)
+            squared_norms = squared_norms[np.newaxis, np.newaxis, :]
+        else:
+            products = np.matmul(
+                gallery, features[columns].transpose(0, 2, 1))
+            squared_norms = squared_norms[columns][:, np.newaxis, :]
+        if self._scales is not None:
+            products *= self._scales[rows, :num_columns, np.newaxis]
+        if self._normalize:
+            distances = 1. - products
+        else:
+            distances = -2. * products
+            distances += self._squared_norms[rows, :num_columns, np.newaxis]
+            distances += squared_norms
+            distances = np.maximum(0., distances)
+        distances[np.logical_not(self._valid[rows, :num_columns])] = np.inf
+        return distances.min(axis=1)
+
+    def _approximate_distance(self, features, rows):
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        row_positions = np.full(len(self._valid), -1, dtype=np.int64)
+        row_positions[unique_rows] = np.arange(len(unique_rows))
+
+        # For unit vectors, the cosine distance is half the squared distance.
+        scale = 0.5 if self._normalize else 1.
+        keys, query_ids, distances = self.index.search(
+            features, self.matching_threshold / scale)
+        distances = scale * distances
+        positions = row_positions[keys // self._valid.shape[1]]
+        selected = positions >= 0
+        cost_matrix = np.full((len(unique_rows), len(features)), np.inf)
+        np.minimum.at(
+            cost_matrix, (positions[selected], query_ids[selected]),
+            distances[selected])
+        return cost_matrix[inverse]
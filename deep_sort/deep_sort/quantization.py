@@ -0,0 +1,71 @@
+# vim: expandtab:ts=4:sw=4
+from __future__ import absolute_import
+import numpy as np
+
+
+"""
+Data types of compact feature representations. float16 halves and int8
+(with one float32 scale factor per vector) quarters the memory of float32
+features.
+"""
+FEATURE_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(features, dtype):
+    """Convert features to a compact representation.
+
+    int8 quantization is symmetric and per vector: each vector is divided by
+    a scale factor such that its largest absolute entry maps to 127, and
+    rounded.
+
+    Parameters
+    ----------
+    features : array_like
+        An NxM matrix of N features of dimensionality M.
+    dtype : str | dtype
+        One of `FEATURE_DTYPES`.
+
+    Returns
+    -------
+    (ndarray, ndarray | NoneType)
+        Returns the NxM matrix of converted features and, for int8, the
+        vector of N scale factors (None otherwise).
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype.name not in FEATURE_DTYPES:
+        raise ValueError(
+            "Invalid feature data type; must be one of %s" % (
+                ", ".join(FEATURE_DTYPES)))
+    features = np.asarray(features, dtype=np.float32)
+    if dtype != np.int8:
+        return features.astype(dtype), None
+
+    scales = np.abs(features).max(axis=1) / 127. if features.size > 0 \
+        else np.zeros(len(features), dtype=np.float32)
+    scales = np.where(scales > 0, scales, 1.).astype(np.float32)
+    codes = np.rint(features / scales[:, np.newaxis]).astype(np.int8)
+    return codes, scales
+
+
+def dequantize(features, scales=None):
+    """Convert features back to float32.
+
+    Parameters
+    ----------
+    features : ndarray
+        An NxM matrix of features as returned by `quantize` (any leading
+        dimensions are allowed).
+    scales : Optional[ndarray]
+        The scale factors of int8 features (one per vector).
+
+    Returns
+    -------
+    ndarray
+        The float32 features.
+
+    """
+    features = np.asarray(features, dtype=np.float32)
+    if scales is not None:
+        features = features * np.asarray(scales)[..., np.newaxis]
+    return features
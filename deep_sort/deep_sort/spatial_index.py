@@ -0,0 +1,127 @@
+# vim: expandtab:ts=4:sw=4
+from __future__ import absolute_import
+import numpy as np
+
+
+def _cell_key(cell_x, cell_y):
+    # Unique for cell coordinates in [-2^31, 2^31).
+    return cell_x * (1 << 32) + cell_y
+
+
+class GridIndex(object):
+    """
+    A uniform grid over axis-aligned boxes that returns all indexed boxes
+    overlapping a set of query boxes without comparing every pair.
+
+    Each box is registered in all grid cells it touches. The cell entries are
+    kept sorted by cell, such that building the index and querying it are
+    a few vectorized sorts and searches. With a cell size in the order of the
+    box size, the work scales with the number of overlapping pairs rather
+    than with the number of all pairs.
+
+    Parameters
+    ----------
+    boxes : array_like
+        An Nx4 matrix of boxes in format `(top left x, top left y, width,
+        height)`.
+    cell_size : Optional[float]
+        The side length of a grid cell. Defaults to the median of the larger
+        box side.
+
+    Attributes
+    ----------
+    boxes : ndarray
+        The indexed boxes.
+    cell_size : float
+        The side length of a grid cell.
+
+    """
+
+    def __init__(self, boxes, cell_size=None):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if cell_size is None:
+            cell_size = 1.
+            if len(self.boxes) > 0:
+                cell_size = max(cell_size, float(np.median(
+                    np.maximum(self.boxes[:, 2], self.boxes[:, 3]))))
+        self.cell_size = float(cell_size)
+
+        keys, ids = self._cells(self.boxes)
+        order = np.argsort(keys, kind="mergesort")
+        self._keys, self._ids = keys[order], ids[order]
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cells(self, boxes):
+        # Returns the key of every cell touched by a box, and the box index.
+        lo = np.floor(boxes[:, :2] / self.cell_size).astype(np.int64)
+        hi = np.floor(
+            (boxes[:, :2] + boxes[:, 2:]) / self.cell_size).astype(np.int64)
+        num_x = hi[:, 0] - lo[:, 0] + 1
+        counts = num_x * (hi[:, 1] - lo[:, 1] + 1)
+
+        ids = np.repeat(np.arange(len(boxes)), counts)
+        offsets = np.arange(len(ids)) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        cell_x = lo[ids, 0] + offsets % num_x[ids]
+        cell_y = lo[ids, 1] + offsets // num_x[ids]
+        return _cell_key(cell_x, cell_y), ids
+
+    def query(self, boxes):
+        """Find all pairs of indexed boxes and query boxes that overlap.
+
+        Parameters
+        ----------
+        boxes : array_like
+            An Mx4 matrix of query boxes in format `(top left x, top left y,
+            width, height)`.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the indices of indexed boxes and the indices of query
+            boxes of all overlapping pairs (touching boundaries count as
+            overlap), sorted by indexed box.
+
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) == 0 or len(self._keys) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        keys, query_ids = self._cells(boxes)
+        start = np.searchsorted(self._keys, keys, side="left")
+        counts = np.searchsorted(self._keys, keys, side="right") - start
+        entries = np.arange(counts.sum()) + np.repeat(
+            start - np.cumsum(counts) + counts, counts)
+        ids, query_ids = self._ids[entries], np.repeat(query_ids, counts)
+
+        # Pairs may share several cells, and cells are coarser than boxes.
+        pairs = np.unique(ids * len(boxes) + query_ids)
+        ids, query_ids = pairs // len(boxes), pairs % len(boxes)
+        a, b = self.boxes[ids], boxes[query_ids]
+        overlaps = np.all(np.logical_and(
+            a[:, :2] <= b[:, :2] + b[:, 2:], b[:, :2] <= a[:, :2] + a[:, 2:]),
+            axis=1)
+        return ids[overlaps], query_ids[overlaps]
+
+    def candidates(self, boxes):
+        """Compute a mask of overlapping pairs.
+
+        Parameters
+        ----------
+        boxes : array_like
+            An Mx4 matrix of query boxes in format `(top left x, top left y,
+            width, height)`.
+
+        Returns
+        -------
+        ndarray
+            A boolean NxM matrix, where entry (i, j) is True if the i-th
+            indexed box overlaps `boxes[j]`.
+
+        """
+        ids, query_ids = self.query(boxes)
+        mask = np.zeros((len(self.boxes), len(boxes)), dtype=np.bool_)
+        mask[ids, query_ids] = True
+        return mask
@@ -1,4 +1,5 @@
 # vim: expandtab:ts=4:sw=4
+import numpy as np
 
 
 class TrackState:
@@ -22,6 +23,10 @@ class Track:
     velocities, where `(x, y)` is the center of the bounding box, `a` is the
     aspect ratio and `h` is the height.
 
+    The track is a view into a slot of a `TrackStore`, which holds the state
+    of all tracks in contiguous arrays. Attributes read from and write to the
+    store. A track that is created without a store gets a private store.
+
     Parameters
     ----------
     mean : ndarray
@@ -40,6 +45,9 @@ class Track:
     feature : Optional[ndarray]
         Feature vector of the detection this track originates from. If not None,
         this feature is added to the `features` cache.
+    store : Optional[TrackStore]
+        The store that holds the track state. If None, a private store is
+        created.
 
     Attributes
     ----------
@@ -64,7 +72,12 @@ class Track:
     """
 
     def __init__(self, mean, covariance, track_id, n_init, max_age,
-                 feature=None):
+                 feature=None, store=None):
+        if store is None:
+            store = TrackStore(capacity=1, ndim=len(mean))
+        self._store = store
+        self._slot = store._allocate(self)
+
         self.mean = mean
         self.covariance = covariance
         self.track_id = track_id
@@ -80,6 +93,41 @@ class Track:
         self._n_init = n_init
         self._max_age = max_age
 
+    def __copy__(self):
+        track = Track.__new__(Track)
+        track._store, track._slot = self._store, self._slot
+        track._detach()
+        track.features = list(self.features)
+        return track
+
+    def _detach(self):
+        """Move the track state into a private store."""
+        store = TrackStore(capacity=1, ndim=self._store.ndim)
+        slot = store._allocate(self)
+        store._copy_slot(self._store, self._slot, slot)
+        self._store, self._slot = store, slot
+
+    def _field(name, dtype=None):
+        def getter(self):
+            value = getattr(self._store, name)[self._slot]
+            return value if dtype is None else dtype(value)
+
+        def setter(self, value):
+            getattr(self._store, name)[self._slot] = value
+        return property(getter, setter)
+
+    mean = _field("mean")
+    covariance = _field("covariance")
+    track_id = _field("track_id", int)
+    hits = _field("hits", int)
+    age = _field("age", int)
+    time_since_update = _field("time_since_update", int)
+    state = _field("state", int)
+    features = _field("features")
+    _n_init = _field("n_init", int)
+    _max_age = _field("max_age", int)
+    del _field
+
     def to_tlwh(self):
         """Get current position in bounding box format `(top left x, top left y,
         width, height)`.
@@ -109,7 +157,7 @@ class Track:
         ret[2:] = ret[:2] + ret[2:]
         return ret
 
-    def predict(self, kf):
+    def predict(self, kf, dt=1.):
         """Propagate the state distribution to the current time step using a
         Kalman filter prediction step.
 
@@ -117,9 +165,26 @@ class Track:
         ----------
         kf : kalman_filter.KalmanFilter
             The Kalman filter.
+        dt : Optional[float]
+            The elapsed time in frames, see `KalmanFilter.predict`.
+
+        """
+        self.apply_prediction(*kf.predict(self.mean, self.covariance, dt))
+
+    def apply_prediction(self, mean, covariance):
+        """Set the state distribution obtained from a Kalman filter prediction
+        step, e.g., from `KalmanFilter.predict_many`, and advance the track
+        age by one time step.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The predicted mean vector.
+        covariance : ndarray
+            The predicted covariance matrix.
 
         """
-        self.mean, self.covariance = kf.predict(self.mean, self.covariance)
+        self.mean, self.covariance = mean, covariance
         self.age += 1
         self.time_since_update += 1
 
@@ -135,9 +200,29 @@ class Track:
             The associated detection.
 
         """
-        self.mean, self.covariance = kf.update(
+        mean, covariance = kf.update(
             self.mean, self.covariance, detection.to_xyah())
-        self.features.append(detection.feature)
+        self.apply_update(mean, covariance, detection.feature)
+
+    def apply_update(self, mean, covariance, feature):
+        """Set the state distribution obtained from a Kalman filter
+        measurement update step, e.g., from `KalmanFilter.update_many`, and
+        update the feature cache.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The measurement-corrected mean vector.
+        covariance : ndarray
+            The measurement-corrected covariance matrix.
+        feature : ndarray | NoneType
+            Feature vector of the associated detection. If None, the feature
+            cache is not updated.
+
+        """
+        self.mean, self.covariance = mean, covariance
+        if feature is not None:
+            self.features.append(feature)
 
         self.hits += 1
         self.time_since_update = 0
@@ -164,3 +249,189 @@ class Track:
     def is_deleted(self):
         """Returns True if this track is dead and should be deleted."""
         return self.state == TrackState.Deleted
+
+
+class TrackStore(object):
+    """
+    Holds the state of a set of tracks in preallocated arrays (one entry per
+    slot), such that queries and updates over all tracks can be vectorized.
+    Slots of removed tracks are reused by new tracks, and the arrays grow
+    automatically when all slots are in use.
+
+    `Track` objects are thin views into a slot of the store. The `slots`
+    array lists the slots of all tracks in the order of `tracks`, such that
+    `store.time_since_update[store.slots]` is aligned with `store.tracks`.
+
+    Parameters
+    ----------
+    capacity : int
+        Initial number of slots.
+    ndim : int
+        Dimensionality of the state space.
+
+    Attributes
+    ----------
+    mean : ndarray
+        The capacity x ndim dimensional mean vectors.
+    covariance : ndarray
+        The capacity x ndim x ndim dimensional covariance matrices.
+    track_id : ndarray
+        Unique track identifiers.
+    state : ndarray
+        The track states (see `TrackState`). Unused slots have state 0.
+    hits : ndarray
+        Total number of measurement updates.
+    age : ndarray
+        Total number of frames since first occurance.
+    time_since_update : ndarray
+        Total number of frames since last measurement update.
+    n_init : ndarray
+        Number of consecutive detections before the track is confirmed.
+    max_age : ndarray
+        The maximum number of consecutive misses before the track is deleted.
+    features : List[List[ndarray]]
+        The feature cache of each slot.
+    slots : ndarray
+        The slots of all tracks in the store, in order of creation.
+    tracks : List[Track]
+        Views of all tracks in the store, in the same order as `slots`.
+
+    """
+
+    _ARRAYS = ("mean", "covariance", "track_id", "state", "hits", "age",
+               "time_since_update", "n_init", "max_age")
+
+    def __init__(self, capacity=32, ndim=8):
+        self.ndim = ndim
+        self.mean = np.zeros((capacity, ndim))
+        self.covariance = np.zeros((capacity, ndim, ndim))
+        self.track_id = np.zeros(capacity, dtype=np.int64)
+        self.state = np.zeros(capacity, dtype=np.int64)
+        self.hits = np.zeros(capacity, dtype=np.int64)
+        self.age = np.zeros(capacity, dtype=np.int64)
+        self.time_since_update = np.zeros(capacity, dtype=np.int64)
+        self.n_init = np.zeros(capacity, dtype=np.int64)
+        self.max_age = np.zeros(capacity, dtype=np.int64)
+        self.features = [None] * capacity
+
+        self.slots = np.zeros(0, dtype=np.int64)
+        self.tracks = []
+        self._free_slots = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def capacity(self):
+        """The number of preallocated slots."""
+        return len(self.state)
+
+    def add(self, mean, covariance, track_id, n_init, max_age, feature=None):
+        """Create a new track in this store.
+
+        See `Track` for a description of the parameters.
+
+        Returns
+        -------
+        Track
+            A view of the new track.
+
+        """
+        return Track(
+            mean, covariance, track_id, n_init, max_age, feature, store=self)
+
+    def select(self, mask):
+        """Get the positions of tracks that satisfy a condition.
+
+        Examples
+        --------
+
+            >>> state = store.state[store.slots]
+            >>> confirmed = store.select(state == TrackState.Confirmed)
+
+        Parameters
+        ----------
+        mask : ndarray
+            A boolean array that is aligned with `slots`.
+
+        Returns
+        -------
+        List[int]
+            Indices into `tracks` where the mask is True.
+
+        """
+        return np.flatnonzero(mask).tolist()
+
+    def apply_prediction(self, slots, mean, covariance):
+        """Set the predicted state distribution of multiple tracks and advance
+        their age by one time step. See `Track.apply_prediction`.
+        """
+        self.mean[slots], self.covariance[slots] = mean, covariance
+        self.age[slots] += 1
+        self.time_since_update[slots] += 1
+
+    def apply_update(self, slots, mean, covariance, features):
+        """Set the measurement-corrected state distribution of multiple
+        tracks and update their feature caches. See `Track.apply_update`.
+        """
+        self.mean[slots], self.covariance[slots] = mean, covariance
+        for slot, feature in zip(slots, features):
+            if feature is not None:
+                self.features[slot].append(feature)
+
+        self.hits[slots] += 1
+        self.time_since_update[slots] = 0
+        confirm = np.logical_and(
+            self.state[slots] == TrackState.Tentative,
+            self.hits[slots] >= self.n_init[slots])
+        self.state[slots[confirm]] = TrackState.Confirmed
+
+    def mark_missed(self, slots):
+        """Mark multiple tracks as missed. See `Track.mark_missed`."""
+        delete = np.logical_or(
+            self.state[slots] == TrackState.Tentative,
+            self.time_since_update[slots] > self.max_age[slots])
+        self.state[slots[delete]] = TrackState.Deleted
+
+    def remove_deleted(self):
+        """Remove all tracks in state `Deleted` from the store and release
+        their slots. The views of removed tracks are moved to private stores,
+        such that they remain valid.
+        """
+        keep = self.state[self.slots] != TrackState.Deleted
+        if np.all(keep):
+            return
+        removed = [t for t, k in zip(self.tracks, keep) if not k]
+        self.tracks = [t for t, k in zip(self.tracks, keep) if k]
+        self.slots = self.slots[keep]
+        for track in removed:
+            slot = track._slot
+            track._detach()
+            self.state[slot] = 0
+            self.features[slot] = None
+            self._free_slots.append(slot)
+
+    def _allocate(self, track):
+        if len(self._free_slots) == 0:
+            self._grow()
+        slot = self._free_slots.pop()
+        self.slots = np.append(self.slots, slot)
+        self.tracks.append(track)
+        return slot
+
+    def _grow(self):
+        capacity = self.capacity
+        new_capacity = max(1, 2 * capacity)
+        for name in self._ARRAYS:
+            array = getattr(self, name)
+            new_array = np.zeros(
+                (new_capacity, ) + array.shape[1:], dtype=array.dtype)
+            new_array[:capacity] = array
+            setattr(self, name, new_array)
+        self.features += [None] * (new_capacity - capacity)
+        self._free_slots.extend(range(new_capacity - 1, capacity - 1, -1))
+
+    def _copy_slot(self, store, src_slot, dst_slot):
+        for name in self._ARRAYS:
+            getattr(self, name)[dst_slot] = getattr(store, name)[src_slot]
+        self.features[dst_slot] = store.features[src_slot]
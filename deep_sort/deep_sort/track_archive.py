@@ -0,0 +1,245 @@
+# vim: expandtab:ts=4:sw=4
+from __future__ import absolute_import
+import numpy as np
+from . import assignment_solvers
+
+
+def summarize(samples, num_centroids):
+    """Compact the appearance samples of a target into a few centroids.
+
+    Samples are split into `num_centroids` contiguous chunks in the order
+    of observation, and each chunk is replaced by its mean, such that
+    changes in appearance over the lifetime of the target are preserved.
+
+    Parameters
+    ----------
+    samples : ndarray
+        An NxM matrix of N samples of dimensionality M, oldest first.
+    num_centroids : int
+        Maximum number of centroids.
+
+    Returns
+    -------
+    ndarray
+        A KxM matrix of K = min(N, num_centroids) centroids.
+
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    chunks = np.array_split(samples, min(len(samples), num_centroids))
+    return np.asarray([chunk.mean(axis=0) for chunk in chunks])
+
+
+class TrackArchive(object):
+    """
+    A bounded archive of the appearance of deleted tracks, which allows to
+    re-identify targets that leave the scene (or are occluded for longer
+    than the maximum track age) when they return.
+
+    Each archived target is represented by at most `num_centroids` centroid
+    features (see `summarize`). Entries are stored in preallocated arrays
+    of fixed size: an entry is evicted when it has not been matched for more
+    than `max_age` time steps, or when the archive is full and it is the
+    least recently used one. Lookups compare a batch of features against all
+    centroids with a single matrix product and resolve conflicts with a
+    linear assignment.
+
+    Parameters
+    ----------
+    metric : str
+        Either "euclidean" or "cosine".
+    matching_threshold : float
+        Features with a larger distance to all centroids of an archived
+        target are not matched to this target.
+    max_size : int
+        Maximum number of archived targets.
+    max_age : Optional[int]
+        If not None, targets are evicted after this number of time steps
+        without a match.
+    num_centroids : int
+        Maximum number of centroid features per target.
+
+    Attributes
+    ----------
+    time : int
+        The number of calls to `update`.
+
+    """
+
+    def __init__(self, metric, matching_threshold, max_size=1000,
+                 max_age=None, num_centroids=4):
+        if metric not in ("euclidean", "cosine"):
+            raise ValueError(
+                "Invalid metric; must be either 'euclidean' or 'cosine'")
+        self._normalize = metric == "cosine"
+        self.matching_threshold = matching_threshold
+        self.max_size = max_size
+        self.max_age = max_age
+        self.num_centroids = num_centroids
+        self.time = 0
+
+        self._centroids = None  # Allocated when the first target is added.
+        self._squared_norms = None
+        self._valid = None
+        self._targets = np.full(max_size, -1, dtype=np.int64)
+        self._last_used = np.zeros(max_size, dtype=np.int64)
+        self._rows = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, target):
+        return target in self._rows
+
+    def _allocate(self, feature_dim):
+        shape = (self.max_size, self.num_centroids)
+        self._centroids = np.zeros(shape + (feature_dim, ), dtype=np.float32)
+        self._squared_norms = np.zeros(shape, dtype=np.float32)
+        self._valid = np.zeros(shape, dtype=np.bool_)
+
+    def _remove(self, target):
+        row = self._rows.pop(target)
+        self._targets[row] = -1
+        self._valid[row] = False
+
+    def _free_row(self):
+        free_rows = np.flatnonzero(self._targets < 0)
+        if len(free_rows) > 0:
+            return free_rows[0]
+        row = np.argmin(self._last_used)  # Least recently used.
+        self._remove(self._targets[row])
+        return row
+
+    def add(self, target, samples):
+        """Archive the appearance of a target.
+
+        Parameters
+        ----------
+        target : int
+            The target identity.
+        samples : ndarray
+            An NxM matrix of the N most recent appearance samples of the
+            target, oldest first.
+
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.max_size == 0 or len(samples) == 0:
+            return
+        if self._centroids is None:
+            self._allocate(samples.shape[1])
+        if self._normalize:
+            samples = samples / np.linalg.norm(samples, axis=1, keepdims=True)
+        centroids = summarize(samples, self.num_centroids)
+        if self._normalize:
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+        if target in self._rows:
+            self._remove(target)
+        row = self._free_row()
+        self._rows[target] = row
+        self._targets[row] = target
+        self._last_used[row] = self.time
+        self._centroids[row, :len(centroids)] = centroids
+        self._squared_norms[row, :len(centroids)] = np.square(
+            centroids).sum(axis=1)
+        self._valid[row] = False
+        self._valid[row, :len(centroids)] = True
+
+    def update(self, released, active_targets):
+        """Advance the archive by one time step.
+
+        Parameters
+        ----------
+        released : Dict[int -> ndarray]
+            Maps from the identity of each target that has been removed from
+            the scene to its most recent appearance samples (oldest first).
+        active_targets : List[int]
+            A list of targets that are currently present in the scene. These
+            are removed from the archive.
+
+        """
+        self.time += 1
+        for target in active_targets:
+            if target in self._rows:
+                self._remove(target)
+        if self.max_age is not None:
+            expired = np.logical_and(
+                self._targets >= 0, self.time - self._last_used > self.max_age)
+            for target in self._targets[expired].tolist():
+                self._remove(target)
+        for target, samples in released.items():
+            self.add(target, samples)
+
+    def distance(self, features):
+        """Compute the distance between features and all archived targets.
+
+        Parameters
+        ----------
+        features : ndarray
+            An NxM matrix of N features of dimensionality M.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the identities of the K archived targets and a KxN cost
+            matrix, where element (i, j) contains the closest distance
+            between a centroid of the i-th target and `features[j]`.
+
+        """
+        rows = np.flatnonzero(self._targets >= 0)
+        if len(rows) == 0 or len(features) == 0:
+            return self._targets[rows], np.zeros((len(rows), len(features)))
+
+        features = np.asarray(features, dtype=np.float32)
+        centroids = self._centroids[rows].reshape(-1, features.shape[1])
+        if self._normalize:
+            features = features / np.linalg.norm(
+                features, axis=1, keepdims=True)
+            distances = 1. - np.dot(centroids, features.T)
+        else:
+            distances = -2. * np.dot(centroids, features.T)
+            distances += self._squared_norms[rows].reshape(-1, 1)
+            distances += np.square(features).sum(axis=1)[np.newaxis, :]
+            distances = np.maximum(0., distances)
+        distances = distances.reshape(len(rows), -1, len(features))
+        distances[np.logical_not(self._valid[rows])] = np.inf
+        return self._targets[rows], distances.min(axis=1)
+
+    def match(self, features, exclude=None):
+        """Re-identify archived targets.
+
+        Each archived target is matched to at most one feature, such that
+        the total distance of all matches below the matching threshold is
+        minimal. Matched targets are marked as recently used, but remain in
+        the archive until they are passed as active target to `update`.
+
+        Parameters
+        ----------
+        features : ndarray
+            An NxM matrix of N features of dimensionality M.
+        exclude : Optional[List[int]]
+            Targets that must not be matched, e.g., because they have already
+            been re-identified by a track that is not yet confirmed.
+
+        Returns
+        -------
+        List[int | NoneType]
+            The identity of the matched target of each feature, or None if
+            the feature does not match any archived target.
+
+        """
+        result = [None] * len(features)
+        targets, cost_matrix = self.distance(features)
+        if exclude is not None and len(targets) > 0:
+            keep = np.logical_not(np.isin(targets, list(exclude)))
+            targets, cost_matrix = targets[keep], cost_matrix[keep]
+        if cost_matrix.size == 0:
+            return result
+
+        cost_matrix[cost_matrix > self.matching_threshold] = (
+            self.matching_threshold + 1e-5)
+        rows, cols = assignment_solvers.solve_scipy(cost_matrix)
+        matched = cost_matrix[rows, cols] <= self.matching_threshold
+        for target, col in zip(targets[rows[matched]], cols[matched]):
+            result[col] = int(target)
+            self._last_used[self._rows[target]] = self.time
+        return result
@@ -1,10 +1,15 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
 import numpy as np
+from . import assignment_solvers
 from . import kalman_filter
 from . import linear_assignment
 from . import iou_matching
-from .track import Track
+from .spatial_index import GridIndex
+from .detection import Detection
+from .detection import as_detection_batch
+from .track import TrackState
+from .track import TrackStore
 
 
 class Tracker:
@@ -14,13 +19,42 @@ class Tracker:
     Parameters
     ----------
     metric : nn_matching.NearestNeighborDistanceMetric
-        A distance metric for measurement-to-track association.
+        A distance metric for measurement-to-track association. If the
+        metric has a `track_archive.TrackArchive`, new tracks are matched
+        against the archived appearance of deleted tracks and take over the
+        identity of the matched track.
     max_age : int
         Maximum number of missed misses before a track is deleted.
     n_init : int
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    batch_kalman : bool
+        If True, the Kalman filter prediction and correction steps of all
+        tracks are computed at once with `KalmanFilter.predict_many` and
+        `KalmanFilter.update_many`. Recommended for scenes with many targets.
+    assignment_solver : str | Callable[ndarray] -> (ndarray, ndarray)
+        The linear assignment solver, see `assignment_solvers.get_solver`.
+        One of "scipy" (default), "greedy" (fast, but not optimal), "warm"
+        (warm-started from the previous frame, see
+        `assignment_solvers.WarmStartSolver`), or "jv" (a slow pure Python
+        reference for testing).
+    sparse_association : bool
+        If True, each association problem is split into connected components
+        of compatible (gated) track and detection pairs that are solved
+        independently. Recommended for crowded scenes.
+    spatial_index : bool
+        If True, a uniform grid over the predicted search region of each
+        track (its bounding box and Mahalanobis gate) is built in `predict`,
+        and appearance distances, gating distances, and IOUs are only
+        computed for detections that overlap this region. The result is the
+        same, but the work scales with the local density of objects instead
+        of with all track and detection pairs. Recommended for crowded
+        scenes.
+    decoupled_kalman : bool
+        If True, use `kalman_filter.DecoupledKalmanFilter`, which computes
+        the same filter in closed form on independent 2x2 blocks instead of
+        generic 8x8 matrix operations.
 
     Attributes
     ----------
@@ -32,107 +66,391 @@ class Tracker:
         Number of frames that a track remains in initialization phase.
     kf : kalman_filter.KalmanFilter
         A Kalman filter to filter target trajectories in image space.
+    track_store : track.TrackStore
+        Holds the state of all active tracks in contiguous arrays.
     tracks : List[Track]
-        The list of active tracks at the current time step.
+        The list of active tracks at the current time step (views into
+        `track_store`).
 
     """
 
-    def __init__(self, metric, max_iou_distance=0.7, max_age=30, n_init=3):
+    def __init__(self, metric, max_iou_distance=0.7, max_age=30, n_init=3,
+                 batch_kalman=False, assignment_solver="scipy",
+                 sparse_association=False, spatial_index=False,
+                 decoupled_kalman=False):
         self.metric = metric
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
+        self.batch_kalman = batch_kalman
+        self.assignment_solver = assignment_solvers.get_solver(
+            assignment_solver)
+        # Warm-started solvers keep state, which must not be shared between
+        # appearance and IOU association.
+        self._iou_solver = assignment_solvers.get_solver(assignment_solver)
+        self.sparse_association = sparse_association
+        self.spatial_index = spatial_index
 
-        self.kf = kalman_filter.KalmanFilter()
-        self.tracks = []
+        if decoupled_kalman:
+            self.kf = kalman_filter.DecoupledKalmanFilter()
+        else:
+            self.kf = kalman_filter.KalmanFilter()
+        self.track_store = TrackStore()
         self._next_id = 1
+        self._grid = None
+        self._num_predictions = 0  # Calls to `predict` since `update`.
 
-    def predict(self):
+    @property
+    def tracks(self):
+        return self.track_store.tracks
+
+    def predict(self, dt=1.):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
+        On time steps without detections (e.g., between keyframes), `update`
+        may be skipped; matching then treats tracks that were updated in the
+        last call to `update` (or `correct`) like tracks that were updated in
+        the previous time step.
+
+        Parameters
+        ----------
+        dt : Optional[float]
+            The elapsed time in frames since the previous call. Pass the frame
+            gap if frames have been dropped (e.g., by a real-time pipeline
+            that falls behind), such that motion is extrapolated over the real
+            elapsed time. Track age and time since update count calls to this
+            function, i.e., processed frames.
+
         """
-        for track in self.tracks:
-            track.predict(self.kf)
+        if not self.batch_kalman:
+            for track in self.tracks:
+                track.predict(self.kf, dt)
+        else:
+            store = self.track_store
+            slots = store.slots
+            means, covariances = self.kf.predict_many(
+                store.mean[slots], store.covariance[slots], dt)
+            store.apply_prediction(slots, means, covariances)
+
+        if self.spatial_index:
+            self._grid = GridIndex(self._search_regions())
+        self._num_predictions += 1
+
+    def _search_regions(self):
+        # The bounding box of each track, extended to contain all positions
+        # that can pass the gate in `linear_assignment.gate_cost_matrix`:
+        # the squared Mahalanobis distance of a measurement is at least
+        # |d|^2 / trace(S) for the position offset d and projected position
+        # covariance S.
+        store = self.track_store
+        mean = store.mean[store.slots]
+        projected_mean, projected_cov = self.kf.project_many(
+            mean, store.covariance[store.slots])
+        radius = np.sqrt(kalman_filter.chi2inv95[4] * (
+            projected_cov[:, 0, 0] + projected_cov[:, 1, 1]))
 
-    def update(self, detections):
+        size = np.c_[mean[:, 2] * mean[:, 3], mean[:, 3]]
+        tl = np.minimum(
+            mean[:, :2] - size / 2, mean[:, :2] - radius[:, np.newaxis])
+        br = np.maximum(
+            mean[:, :2] + size / 2, mean[:, :2] + radius[:, np.newaxis])
+        return np.c_[tl, br - tl]
+
+    def update(self, detections, feature_callback=None, region=None):
         """Perform measurement update and track management.
 
         Parameters
         ----------
-        detections : List[deep_sort.detection.Detection]
-            A list of detections at the current time step.
+        detections : deep_sort.detection.DetectionBatch | List[deep_sort.detection.Detection]
+            The detections at the current time step. A list of detections is
+            converted to a batch.
+        feature_callback : Optional[Callable[List[int]] -> ndarray]
+            If not None, the features of `detections` are ignored and
+            appearance features are requested from this callback instead,
+            which receives a list of detection indices and returns a matrix
+            with one feature vector per index (e.g., by calling the encoder
+            of `generate_detections.create_box_encoder` on the given
+            boxes). Features are only requested for detections that cannot
+            be associated by motion alone: detections that fall into the
+            gates of multiple tracks (or share a track's gate with other
+            detections), detections in the gate of a track that is
+            re-acquired after a miss, and detections that start new tracks.
+            A detection that is the only one in the gate of a single track
+            that was updated in the previous frame, and overlaps with that
+            track by more than `max_iou_distance`, is matched without
+            appearance information.
+        region : Optional[array_like]
+            If not None, the detector has only searched this region of the
+            image, in format `(x, y, w, h)`. Confirmed tracks that were
+            updated in the last call to `update` (or `correct`) and have a
+            predicted center position outside of the region are then not
+            marked as missed if they remain unmatched. All other unmatched
+            tracks are marked as missed, such that tentative and lost tracks
+            are deleted as usual. Pass an empty region on frames where the
+            detector has not run at all.
 
         """
+        detections = as_detection_batch(detections)
+        if self._grid is not None and len(self._grid) != len(self.tracks):
+            self._grid = None  # Tracks have changed since `predict`.
+
         # Run matching cascade.
+        features = detections.feature
+        if feature_callback is not None:
+            features = [None] * len(detections)  # Requested on demand.
         matches, unmatched_tracks, unmatched_detections = \
-            self._match(detections)
+            self._match(detections, features, feature_callback)
+
+        def detection_at(i):
+            return Detection(
+                detections.tlwh[i], detections.confidence[i], features[i])
 
         # Update track set.
-        for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(
-                self.kf, detections[detection_idx])
-        for track_idx in unmatched_tracks:
-            self.tracks[track_idx].mark_missed()
-        for detection_idx in unmatched_detections:
-            self._initiate_track(detections[detection_idx])
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        if self.batch_kalman:
+            self._update_matched(matches, detections, features)
+        else:
+            for track_idx, detection_idx in matches:
+                self.tracks[track_idx].update(
+                    self.kf, detection_at(detection_idx))
+        store = self.track_store
+        if region is not None and len(unmatched_tracks) > 0:
+            x, y, w, h = region
+            slots = store.slots[unmatched_tracks]
+            center = store.mean[slots, :2]
+            is_searched = np.all(np.logical_and(
+                center >= [x, y], center < [x + w, y + h]), axis=1)
+            is_recent = np.logical_and(
+                store.state[slots] == TrackState.Confirmed,
+                store.time_since_update[slots] <= max(
+                    1, self._num_predictions))
+            unmatched_tracks = np.asarray(unmatched_tracks)[
+                np.logical_or(is_searched, np.logical_not(is_recent))]
+        store.mark_missed(store.slots[unmatched_tracks])
+        track_ids = self._reidentify(
+            [features[i] for i in unmatched_detections])
+        for detection_idx, track_id in zip(unmatched_detections, track_ids):
+            self._initiate_track(detection_at(detection_idx), track_id)
+        store.remove_deleted()
+        self._grid = None
+        self._num_predictions = 0
+        for solver in (self.assignment_solver, self._iou_solver):
+            if hasattr(solver, "retain"):
+                solver.retain(store.track_id[store.slots].tolist())
 
         # Update distance metric.
-        active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
+        confirmed_slots = store.slots[
+            store.state[store.slots] == TrackState.Confirmed]
+        active_targets = store.track_id[confirmed_slots].tolist()
         features, targets = [], []
-        for track in self.tracks:
-            if not track.is_confirmed():
-                continue
-            features += track.features
-            targets += [track.track_id for _ in track.features]
-            track.features = []
+        for slot, track_id in zip(confirmed_slots, active_targets):
+            features += store.features[slot]
+            targets += [track_id for _ in store.features[slot]]
+            store.features[slot] = []
         self.metric.partial_fit(
             np.asarray(features), np.asarray(targets), active_targets)
 
-    def _match(self, detections):
+    def correct(self, track_indices, boxes, observed=False):
+        """Correct the state of tracks with measurements that do not require
+        association, e.g., from a local search around the predicted position
+        of each track. The feature cache and the distance metric are not
+        updated.
+
+        Parameters
+        ----------
+        track_indices : List[int]
+            Indices of the tracks in `tracks`.
+        boxes : array_like
+            A matrix of one bounding box per track in format `(x, y, w, h)`.
+        observed : Optional[bool]
+            If True, the measurements count as observations, like associated
+            detections: `hits` is incremented and `time_since_update` is
+            reset. Otherwise, only the Kalman filter state is corrected, such
+            that tracks that are no longer detected still age out after
+            `max_age` frames.
+
+        """
+        for track_idx, box in zip(track_indices, boxes):
+            track = self.tracks[track_idx]
+            detection = Detection(box, 1., None)
+            if observed:
+                track.update(self.kf, detection)
+            else:
+                track.mean, track.covariance = self.kf.update(
+                    track.mean, track.covariance, detection.to_xyah())
+
+    def _update_matched(self, matches, detections, features):
+        if len(matches) == 0:
+            return
+        track_indices, detection_indices = map(list, zip(*matches))
+        store = self.track_store
+        slots = store.slots[track_indices]
+        means, covariances = self.kf.update_many(
+            store.mean[slots], store.covariance[slots],
+            detections.to_xyah()[detection_indices])
+        store.apply_update(
+            slots, means, covariances,
+            [features[i] for i in detection_indices])
+
+    def _match(self, detections, features, feature_callback=None):
+        candidates = None
+        if self._grid is not None:
+            candidates = self._grid.candidates(detections.tlwh)
+
+        def candidate_mask(track_indices, detection_indices):
+            if candidates is None:
+                return None
+            return candidates[np.ix_(track_indices, detection_indices)]
+
+        def request_features(detection_indices):
+            missing = [i for i in detection_indices if features[i] is None]
+            if len(missing) > 0:
+                for i, feature in zip(missing, feature_callback(missing)):
+                    features[i] = feature
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
-            features = np.array([dets[i].feature for i in detection_indices])
-            targets = np.array([tracks[i].track_id for i in track_indices])
-            cost_matrix = self.metric.distance(features, targets)
+            features_l = np.asarray(
+                [features[i] for i in detection_indices], dtype=np.float32)
+            store = self.track_store
+            targets = store.track_id[store.slots[track_indices]]
+            candidates = candidate_mask(track_indices, detection_indices)
+            cost_matrix = self.metric.distance(features_l, targets, candidates)
             cost_matrix = linear_assignment.gate_cost_matrix(
                 self.kf, cost_matrix, tracks, dets, track_indices,
-                detection_indices)
+                detection_indices, candidates=candidates)
 
             return cost_matrix
 
+        # Tracks that were updated in the last call to `update` (usually in
+        # the previous time step).
+        max_time_since_update = max(1, self._num_predictions)
+
+        def iou_metric(tracks, dets, track_indices, detection_indices):
+            return iou_matching.iou_cost(
+                tracks, dets, track_indices, detection_indices,
+                candidate_mask(track_indices, detection_indices),
+                max_time_since_update)
+
         # Split track set into confirmed and unconfirmed tracks.
-        confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
-        unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+        store = self.track_store
+        is_confirmed = store.state[store.slots] == TrackState.Confirmed
+        confirmed_tracks = store.select(is_confirmed)
+        unconfirmed_tracks = store.select(np.logical_not(is_confirmed))
 
-        # Associate confirmed tracks using appearance features.
+        # Associate confirmed tracks using appearance features. If features
+        # are requested on demand, unambiguous pairs are matched by motion
+        # first.
+        matches_m, cascade_tracks, cascade_detections = \
+            [], confirmed_tracks, None
+        if feature_callback is not None:
+            matches_m, cascade_tracks, cascade_detections = \
+                self._match_by_motion(
+                    detections, confirmed_tracks, candidate_mask,
+                    max_time_since_update)
+            request_features(cascade_detections)
         matches_a, unmatched_tracks_a, unmatched_detections = \
             linear_assignment.matching_cascade(
                 gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+                self.tracks, detections, cascade_tracks, cascade_detections,
+                solver=self.assignment_solver,
+                decompose=self.sparse_association)
+        matches_a = matches_m + matches_a
+        if feature_callback is not None:
+            # Detections outside of the cascade go to IOU matching as well.
+            is_left = np.ones(len(detections), dtype=np.bool_)
+            is_left[cascade_detections] = False
+            is_left[[j for _, j in matches_m]] = False
+            unmatched_detections = list(unmatched_detections) + \
+                np.flatnonzero(is_left).tolist()
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
+        time_since_update = store.time_since_update[store.slots]
         iou_track_candidates = unconfirmed_tracks + [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update == 1]
+            k for k in unmatched_tracks_a
+            if time_since_update[k] <= max_time_since_update]
         unmatched_tracks_a = [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update != 1]
+            k for k in unmatched_tracks_a
+            if time_since_update[k] > max_time_since_update]
         matches_b, unmatched_tracks_b, unmatched_detections = \
             linear_assignment.min_cost_matching(
-                iou_matching.iou_cost, self.max_iou_distance, self.tracks,
-                detections, iou_track_candidates, unmatched_detections)
+                iou_metric, self.max_iou_distance, self.tracks,
+                detections, iou_track_candidates, unmatched_detections,
+                self._iou_solver, self.sparse_association)
+
+        if feature_callback is not None:
+            request_features(unmatched_detections)  # For new tracks.
 
         matches = matches_a + matches_b
         unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
         return matches, unmatched_tracks, unmatched_detections
 
-    def _initiate_track(self, detection):
+    def _match_by_motion(self, detections, track_indices, candidate_mask,
+                         max_time_since_update):
+        # Match pairs of a track and a detection that are the only entry in
+        # each other's gate, if the track has been updated in the last call
+        # to `update` and the boxes overlap. Returns these matches, the remaining
+        # tracks, and all detections in the gates of the remaining tracks.
+        detection_indices = list(range(len(detections)))
+        if len(track_indices) == 0 or len(detection_indices) == 0:
+            return [], track_indices, []
+
+        cost_matrix = linear_assignment.gate_cost_matrix(
+            self.kf, np.zeros((len(track_indices), len(detection_indices))),
+            self.tracks, detections, track_indices, detection_indices,
+            candidates=candidate_mask(track_indices, detection_indices))
+        in_gate = cost_matrix < linear_assignment.INFTY_COST
+        store = self.track_store
+        is_recent = store.time_since_update[
+            store.slots[track_indices]] <= max_time_since_update
+        is_unique = np.logical_and(
+            in_gate.sum(axis=1) == 1, is_recent)[:, np.newaxis]
+        is_unique = np.logical_and(
+            np.logical_and(in_gate, is_unique),
+            (in_gate.sum(axis=0) == 1)[np.newaxis, :])
+
+        iou_cost = iou_matching.iou_cost(
+            self.tracks, detections, track_indices, detection_indices,
+            is_unique)
+        rows, cols = np.nonzero(np.logical_and(
+            is_unique, iou_cost <= self.max_iou_distance))
+        track_indices = np.asarray(track_indices, dtype=np.int64)
+        matches = list(zip(track_indices[rows].tolist(), cols.tolist()))
+
+        is_remaining = np.ones(len(track_indices), dtype=np.bool_)
+        is_remaining[rows] = False
+        remaining_detections = np.flatnonzero(
+            in_gate[is_remaining].any(axis=0)).tolist()
+        return (matches, track_indices[is_remaining].tolist(),
+                remaining_detections)
+
+    def _reidentify(self, features):
+        # Match the features of new tracks against the archive of deleted
+        # tracks. Identities of current tracks are excluded, which includes
+        # re-identified tracks that are not confirmed yet (these are removed
+        # from the archive on confirmation).
+        # Detections without features (e.g., from a featureless detection
+        # store, or lazy features that have not been computed) are not
+        # re-identified.
+        track_ids = [None] * len(features)
+        archive = getattr(self.metric, "archive", None)
+        indices = [
+            i for i, feature in enumerate(features)
+            if feature is not None and np.size(feature) > 0]
+        if archive is None or len(archive) == 0 or len(indices) == 0:
+            return track_ids
+        store = self.track_store
+        matched_ids = archive.match(
+            np.asarray([features[i] for i in indices], dtype=np.float32),
+            exclude=store.track_id[store.slots].tolist())
+        for i, track_id in zip(indices, matched_ids):
+            track_ids[i] = track_id
+        return track_ids
+
+    def _initiate_track(self, detection, track_id=None):
         mean, covariance = self.kf.initiate(detection.to_xyah())
-        self.tracks.append(Track(
-            mean, covariance, self._next_id, self.n_init, self.max_age,
-            detection.feature))
-        self._next_id += 1
+        if track_id is None:
+            track_id = self._next_id
+            self._next_id += 1
+        self.track_store.add(
+            mean, covariance, track_id, self.n_init, self.max_age,
+            detection.feature)
@@ -7,10 +7,13 @@ import os
 import cv2
 import numpy as np
 
+from application_util import detection_store
+from application_util import frame_index
+from application_util import keyframe
 from application_util import preprocessing
 from application_util import visualization
 from deep_sort import nn_matching
-from deep_sort.detection import Detection
+from deep_sort.detection import DetectionBatch
 from deep_sort.tracker import Tracker
 
 
@@ -23,7 +26,9 @@ def gather_sequence_info(sequence_dir, detection_file):
     sequence_dir : str
         Path to the MOTChallenge sequence directory.
     detection_file : str
-        Path to the detection file.
+        Path to the detection file. Either a `.npy` detection matrix or a
+        detection store directory (see
+        `application_util.detection_store.DetectionStore`).
 
     Returns
     -------
@@ -33,8 +38,13 @@ def gather_sequence_info(sequence_dir, detection_file):
         * sequence_name: Name of the sequence
         * image_filenames: A dictionary that maps frame indices to image
           filenames.
-        * detections: A numpy array of detections in MOTChallenge format.
-        * groundtruth: A numpy array of ground truth in MOTChallenge format.
+        * detections: A numpy array of detections in MOTChallenge format,
+          sorted by frame index, or a memory-mapped DetectionStore.
+        * detection_index: A frame index into the detections
+          (see `application_util.frame_index.FrameIndex`).
+        * groundtruth: A numpy array of ground truth in MOTChallenge format,
+          sorted by frame index.
+        * groundtruth_index: A frame index into the ground truth.
         * image_size: Image size (height, width).
         * min_frame_idx: Index of the first frame.
         * max_frame_idx: Index of the last frame.
@@ -46,12 +56,18 @@ def gather_sequence_info(sequence_dir, detection_file):
         for f in os.listdir(image_dir)}
     groundtruth_file = os.path.join(sequence_dir, "gt/gt.txt")
 
-    detections = None
-    if detection_file is not None:
-        detections = np.load(detection_file)
-    groundtruth = None
+    detections, detection_index = None, None
+    if detection_file is not None and \
+            detection_store.is_detection_store(detection_file):
+        detections = detection_store.DetectionStore(detection_file)
+        detection_index = detections.index
+    elif detection_file is not None:
+        detections, detection_index = frame_index.index_by_frame(
+            np.load(detection_file))
+    groundtruth, groundtruth_index = None, None
     if os.path.exists(groundtruth_file):
-        groundtruth = np.loadtxt(groundtruth_file, delimiter=',')
+        groundtruth, groundtruth_index = frame_index.index_by_frame(
+            np.loadtxt(groundtruth_file, delimiter=','))
 
     if len(image_filenames) > 0:
         image = cv2.imread(next(iter(image_filenames.values())),
@@ -64,8 +80,8 @@ def gather_sequence_info(sequence_dir, detection_file):
         min_frame_idx = min(image_filenames.keys())
         max_frame_idx = max(image_filenames.keys())
     else:
-        min_frame_idx = int(detections[:, 0].min())
-        max_frame_idx = int(detections[:, 0].max())
+        min_frame_idx = detection_index.min_frame_idx
+        max_frame_idx = detection_index.max_frame_idx
 
     info_filename = os.path.join(sequence_dir, "seqinfo.ini")
     if os.path.exists(info_filename):
@@ -78,12 +94,17 @@ def gather_sequence_info(sequence_dir, detection_file):
     else:
         update_ms = None
 
-    feature_dim = detections.shape[1] - 10 if detections is not None else 0
+    if isinstance(detections, detection_store.DetectionStore):
+        feature_dim = detections.feature_dim
+    else:
+        feature_dim = detections.shape[1] - 10 if detections is not None else 0
     seq_info = {
         "sequence_name": os.path.basename(sequence_dir),
         "image_filenames": image_filenames,
         "detections": detections,
+        "detection_index": detection_index,
         "groundtruth": groundtruth,
+        "groundtruth_index": groundtruth_index,
         "image_size": image_size,
         "min_frame_idx": min_frame_idx,
         "max_frame_idx": max_frame_idx,
@@ -93,42 +114,51 @@ def gather_sequence_info(sequence_dir, detection_file):
     return seq_info
 
 
-def create_detections(detection_mat, frame_idx, min_height=0):
+def create_detections(detection_mat, frame_idx, min_height=0,
+                      detection_index=None):
     """Create detections for given frame index from the raw detection matrix.
 
     Parameters
     ----------
-    detection_mat : ndarray
+    detection_mat : ndarray | DetectionStore
         Matrix of detections. The first 10 columns of the detection matrix are
         in the standard MOTChallenge detection format. In the remaining columns
-        store the feature vector associated with each detection.
+        store the feature vector associated with each detection. Alternatively,
+        a memory-mapped detection store.
     frame_idx : int
         The frame index.
     min_height : Optional[int]
         A minimum detection bounding box height. Detections that are smaller
         than this value are disregarded.
+    detection_index : Optional[FrameIndex]
+        The frame index of `detection_mat`. If None, the rows of the given
+        frame are found by scanning the entire matrix. Not used for detection
+        stores, which carry their own index.
 
     Returns
     -------
-    List[tracker.Detection]
+    DetectionBatch
         Returns detection responses at given frame index.
 
     """
-    frame_indices = detection_mat[:, 0].astype(np.int)
-    mask = frame_indices == frame_idx
+    if isinstance(detection_mat, detection_store.DetectionStore):
+        bboxes, confidences, _, features = detection_mat.read_frame(frame_idx)
+    else:
+        if detection_index is not None:
+            rows = detection_mat[detection_index.slice(frame_idx)]
+        else:
+            rows = detection_mat[
+                detection_mat[:, 0].astype(np.int) == frame_idx]
+        bboxes, confidences, features = rows[:, 2:6], rows[:, 6], rows[:, 10:]
 
-    detection_list = []
-    for row in detection_mat[mask]:
-        bbox, confidence, feature = row[2:6], row[6], row[10:]
-        if bbox[3] < min_height:
-            continue
-        detection_list.append(Detection(bbox, confidence, feature))
-    return detection_list
+    mask = bboxes[:, 3] >= min_height
+    return DetectionBatch(bboxes[mask], confidences[mask], features[mask])
 
 
 def run(sequence_dir, detection_file, output_file, min_confidence,
         nms_max_overlap, min_detection_height, max_cosine_distance,
-        nn_budget, display):
+        nn_budget, display, keyframe_interval=1, keyframe_uncertainty=None,
+        refine_templates=False):
     """Run multi-target tracker on a particular sequence.
 
     Parameters
@@ -139,7 +169,9 @@ def run(sequence_dir, detection_file, output_file, min_confidence,
         Path to the detections file.
     output_file : str
         Path to the tracking output file. This file will contain the tracking
-        results on completion.
+        results on completion. In keyframe mode, the seventh column is 1 for
+        track positions that have been detected on the frame and 0 for
+        predicted (or template-refined) positions.
     min_confidence : float
         Detection confidence threshold. Disregard all detections that have
         a confidence lower than this value.
@@ -155,6 +187,16 @@ def run(sequence_dir, detection_file, output_file, min_confidence,
         is enforced.
     display : bool
         If True, show visualization of intermediate tracking results.
+    keyframe_interval : Optional[int]
+        If larger than 1, detections are only used on keyframes, at most this
+        many frames apart (see `keyframe.KeyframeScheduler`). On all other
+        frames, tracks are advanced by prediction.
+    keyframe_uncertainty : Optional[float]
+        If not None, a keyframe is scheduled earlier when the position
+        uncertainty of a track relative to its height exceeds this value.
+    refine_templates : Optional[bool]
+        If True, predicted positions between keyframes are refined by a
+        local template search (see `keyframe.TemplateRefiner`).
 
     """
     seq_info = gather_sequence_info(sequence_dir, detection_file)
@@ -163,40 +205,62 @@ def run(sequence_dir, detection_file, output_file, min_confidence,
     tracker = Tracker(metric)
     results = []
 
+    scheduler, refiner = None, None
+    if keyframe_interval > 1:
+        scheduler = keyframe.KeyframeScheduler(
+            keyframe_interval, keyframe_uncertainty)
+        if refine_templates:
+            refiner = keyframe.TemplateRefiner()
+
     def frame_callback(vis, frame_idx):
         print("Processing frame %05d" % frame_idx)
+        image = None
+        if display or refiner is not None:
+            image = cv2.imread(
+                seq_info["image_filenames"][frame_idx], cv2.IMREAD_COLOR)
 
-        # Load image and generate detections.
-        detections = create_detections(
-            seq_info["detections"], frame_idx, min_detection_height)
-        detections = [d for d in detections if d.confidence >= min_confidence]
-
-        # Run non-maxima suppression.
-        boxes = np.array([d.tlwh for d in detections])
-        scores = np.array([d.confidence for d in detections])
-        indices = preprocessing.non_max_suppression(
-            boxes, nms_max_overlap, scores)
-        detections = [detections[i] for i in indices]
-
-        # Update tracker.
+        # Update tracker. Between keyframes, tracks are only predicted.
         tracker.predict()
-        tracker.update(detections)
+        if scheduler is None or scheduler.is_keyframe(tracker):
+            # Load image and generate detections.
+            detections = create_detections(
+                seq_info["detections"], frame_idx, min_detection_height,
+                seq_info["detection_index"])
+            detections = detections[detections.confidence >= min_confidence]
+
+            # Run non-maxima suppression.
+            indices = preprocessing.non_max_suppression(
+                detections.tlwh, nms_max_overlap, detections.confidence)
+            detections = detections[indices]
+
+            tracker.update(detections)
+            if refiner is not None:
+                refiner.set_templates(image, tracker.tracks)
+        else:
+            detections = DetectionBatch(np.zeros((0, 4)), np.zeros(0))
+            if refiner is not None:
+                tracker.correct(*refiner.refine(image, tracker.tracks))
 
         # Update visualization.
         if display:
-            image = cv2.imread(
-                seq_info["image_filenames"][frame_idx], cv2.IMREAD_COLOR)
             vis.set_image(image.copy())
             vis.draw_detections(detections)
             vis.draw_trackers(tracker.tracks)
 
         # Store results.
+        frames_since_keyframe = 0
+        if scheduler is not None:
+            frames_since_keyframe = scheduler.frames_since_keyframe
         for track in tracker.tracks:
-            if not track.is_confirmed() or track.time_since_update > 1:
+            if not track.is_confirmed() or \
+                    track.time_since_update > 1 + frames_since_keyframe:
                 continue
+            is_observed = scheduler is None or (
+                frames_since_keyframe == 0 and track.time_since_update == 0)
             bbox = track.to_tlwh()
             results.append([
-                frame_idx, track.track_id, bbox[0], bbox[1], bbox[2], bbox[3]])
+                frame_idx, track.track_id, bbox[0], bbox[1], bbox[2], bbox[3],
+                is_observed])
 
     # Run tracker.
     if display:
@@ -204,12 +268,15 @@ def run(sequence_dir, detection_file, output_file, min_confidence,
     else:
         visualizer = visualization.NoVisualization(seq_info)
     visualizer.run(frame_callback)
+    if scheduler is not None:
+        print("Ran detector on %d of %d frames" % (
+            scheduler.num_keyframes, scheduler.num_frames))
 
     # Store results.
     f = open(output_file, 'w')
     for row in results:
-        print('%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1' % (
-            row[0], row[1], row[2], row[3], row[4], row[5]),file=f)
+        print('%d,%d,%.2f,%.2f,%.2f,%.2f,%d,-1,-1,-1' % (
+            row[0], row[1], row[2], row[3], row[4], row[5], row[6]),file=f)
 
 
 def bool_string(input_string):
@@ -224,18 +291,18 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Deep SORT")
     parser.add_argument(
         "--sequence_dir", help="Path to MOTChallenge sequence directory",
-        default=None, required=True)
+        default="./MOT16/test/MOT16-06")
     parser.add_argument(
-        "--detection_file", help="Path to custom detections.", default=None,
-        required=True)
+        "--detection_file", help="Path to custom detections.",
+        default="./resources/detections/MOT16_POI_test/MOT16-06.npy")
     parser.add_argument(
         "--output_file", help="Path to the tracking output file. This file will"
         " contain the tracking results on completion.",
-        default="/tmp/hypotheses.txt")
+        default="result.txt")
     parser.add_argument(
         "--min_confidence", help="Detection confidence threshold. Disregard "
         "all detections that have a confidence lower than this value.",
-        default=0.8, type=float)
+        default=0.3, type=float)
     parser.add_argument(
         "--min_detection_height", help="Threshold on the detection bounding "
         "box height. Detections with height smaller than this value are "
@@ -248,23 +315,29 @@ def parse_args():
         "metric (object appearance).", type=float, default=0.2)
     parser.add_argument(
         "--nn_budget", help="Maximum size of the appearance descriptors "
-        "gallery. If None, no budget is enforced.", type=int, default=None)
+        "gallery. If None, no budget is enforced.", type=int, default=100)
     parser.add_argument(
         "--display", help="Show intermediate tracking results",
         default=True, type=bool_string)
+    parser.add_argument(
+        "--keyframe_interval", help="Maximum number of frames between two "
+        "frames with detections. Tracks are predicted in between.",
+        default=1, type=int)
+    parser.add_argument(
+        "--keyframe_uncertainty", help="Schedule a keyframe earlier when the "
+        "position uncertainty of a track relative to its height exceeds this "
+        "value.", default=None, type=float)
+    parser.add_argument(
+        "--refine_templates", help="Refine predicted positions between "
+        "keyframes by template search.", default=False, type=bool_string)
     return parser.parse_args()
 
 
-# if __name__ == "__main__":
-#     args = parse_args()
-#     run(
-#         args.sequence_dir, args.detection_file, args.output_file,
-#         args.min_confidence, args.nms_max_overlap, args.min_detection_height,
-#         args.max_cosine_distance, args.nn_budget, args.display)
-
 if __name__ == "__main__":
-    # args = parse_args()
+    args = parse_args()
     run(
-        "./MOT16/test/MOT16-06", "./resources/detections/MOT16_POI_test/MOT16-06.npy", "result.txt",
-        0.3, 1.0, 0,
-        0.2, 100, True)
\ No newline at end of file
+        args.sequence_dir, args.detection_file, args.output_file,
+        args.min_confidence, args.nms_max_overlap, args.min_detection_height,
+        args.max_cosine_distance, args.nn_budget, args.display,
+        args.keyframe_interval, args.keyframe_uncertainty,
+        args.refine_templates)
@@ -5,7 +5,8 @@ import cv2
 import numpy as np
 
 import deep_sort_app
-from deep_sort.iou_matching import iou
+from deep_sort.iou_matching import iou_matrix
+from application_util import frame_index
 from application_util import visualization
 
 
@@ -35,7 +36,8 @@ def run(sequence_dir, result_file, show_false_alarms=False, detection_file=None,
 
     """
     seq_info = deep_sort_app.gather_sequence_info(sequence_dir, detection_file)
-    results = np.loadtxt(result_file, delimiter=',')
+    results, result_index = frame_index.index_by_frame(
+        np.loadtxt(result_file, delimiter=','))
 
     if show_false_alarms and seq_info["groundtruth"] is None:
         raise ValueError("No groundtruth available. Cannot show false alarms.")
@@ -49,26 +51,29 @@ def run(sequence_dir, result_file, show_false_alarms=False, detection_file=None,
 
         if seq_info["detections"] is not None:
             detections = deep_sort_app.create_detections(
-                seq_info["detections"], frame_idx)
+                seq_info["detections"], frame_idx,
+                detection_index=seq_info["detection_index"])
             vis.draw_detections(detections)
 
-        mask = results[:, 0].astype(np.int) == frame_idx
-        track_ids = results[mask, 1].astype(np.int)
-        boxes = results[mask, 2:6]
+        rows = results[result_index.slice(frame_idx)]
+        track_ids = rows[:, 1].astype(np.int)
+        boxes = rows[:, 2:6]
         vis.draw_groundtruth(track_ids, boxes)
 
         if show_false_alarms:
-            groundtruth = seq_info["groundtruth"]
-            mask = groundtruth[:, 0].astype(np.int) == frame_idx
-            gt_boxes = groundtruth[mask, 2:6]
-            for box in boxes:
-                # NOTE(nwojke): This is not strictly correct, because we don't
-                # solve the assignment problem here.
-                min_iou_overlap = 0.5
-                if iou(box, gt_boxes).max() < min_iou_overlap:
-                    vis.viewer.color = 0, 0, 255
-                    vis.viewer.thickness = 4
-                    vis.viewer.rectangle(*box.astype(np.int))
+            groundtruth_rows = seq_info["groundtruth"][
+                seq_info["groundtruth_index"].slice(frame_idx)]
+            gt_boxes = groundtruth_rows[:, 2:6]
+            # NOTE(nwojke): This is not strictly correct, because we don't
+            # solve the assignment problem here.
+            min_iou_overlap = 0.5
+            max_iou = np.zeros(len(boxes))
+            if len(gt_boxes) > 0:
+                max_iou = iou_matrix(boxes, gt_boxes).max(axis=1)
+            for box in boxes[max_iou < min_iou_overlap]:
+                vis.viewer.color = 0, 0, 255
+                vis.viewer.thickness = 4
+                vis.viewer.rectangle(*box.astype(np.int))
 
     if update_ms is None:
         update_ms = seq_info["update_ms"]
@@ -0,0 +1,131 @@
+# vim: expandtab:ts=4:sw=4
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Root directory of the deep_sort project
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)  # To find deep_sort
+from deep_sort import ann_index  # noqa: E402
+from deep_sort import nn_matching  # noqa: E402
+
+
+def create_gallery(num_targets, num_samples, num_queries, feature_dim=128,
+                   noise=0.3, seed=0):
+    """Create appearance samples of many identities and query features that
+    are new observations of a random subset of them.
+
+    Parameters
+    ----------
+    num_targets : int
+        Number of identities.
+    num_samples : int
+        Number of samples per identity.
+    num_queries : int
+        Number of query features.
+    feature_dim : int
+        Dimensionality of the feature vectors.
+    noise : float
+        Standard deviation of the per-sample noise, relative to the length
+        of an identity's mean feature.
+    seed : int
+        Seed of the random number generator.
+
+    Returns
+    -------
+    (ndarray, ndarray, ndarray, ndarray)
+        Returns the gallery features, their target identities, the query
+        features, and the identity that each query was drawn from.
+
+    """
+    rng = np.random.RandomState(seed)
+    means = rng.randn(num_targets, feature_dim)
+    means /= np.linalg.norm(means, axis=1, keepdims=True)
+    scale = noise / np.sqrt(feature_dim)
+
+    targets = np.repeat(np.arange(num_targets), num_samples)
+    features = means[targets] + scale * rng.randn(len(targets), feature_dim)
+    query_targets = rng.randint(num_targets, size=num_queries)
+    queries = means[query_targets] + scale * rng.randn(
+        num_queries, feature_dim)
+    return features, targets, queries, query_targets
+
+
+def benchmark(metric, queries, targets, repeat):
+    """Return the mean runtime of `metric.distance` in seconds and the cost
+    matrix of the final run."""
+    metric.distance(queries, targets)  # Warm-up.
+    t0 = time.time()
+    for _ in range(repeat):
+        cost_matrix = metric.distance(queries, targets)
+    return (time.time() - t0) / repeat, cost_matrix
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Approximate nearest neighbor index benchmark")
+    parser.add_argument(
+        "--num_targets", help="Number of identities in the gallery.",
+        type=int, default=10000)
+    parser.add_argument(
+        "--num_samples", help="Number of samples per identity.", type=int,
+        default=10)
+    parser.add_argument(
+        "--num_queries", help="Number of query features.", type=int,
+        default=100)
+    parser.add_argument(
+        "--num_lists", help="Number of inverted lists.", type=int,
+        default=256)
+    parser.add_argument(
+        "--num_probes", help="Comma-separated list of the number of probed "
+        "lists.", default="1,4,16,64")
+    parser.add_argument(
+        "--max_cosine_distance", help="Gating threshold for cosine distance "
+        "metric (object appearance).", type=float, default=0.2)
+    parser.add_argument(
+        "--repeat", help="Number of runs per configuration.", type=int,
+        default=5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    features, targets, queries, query_targets = create_gallery(
+        args.num_targets, args.num_samples, args.num_queries)
+    all_targets = list(range(args.num_targets))
+
+    exact = nn_matching.NearestNeighborDistanceMetric(
+        "cosine", args.max_cosine_distance, args.num_samples)
+    exact.partial_fit(features, targets, all_targets)
+    runtime, expected = benchmark(exact, queries, all_targets, args.repeat)
+    expected_nn = np.argmin(expected, axis=0)
+    expected_matches = expected <= args.max_cosine_distance
+
+    print("%-8s %12s %10s %14s" % (
+        "probes", "time [ms]", "recall@1", "gated recall"))
+    print("%-8s %12.3f %10.4f %14.4f" % (
+        "exact", 1e3 * runtime, np.mean(expected_nn == query_targets), 1.))
+
+    index = ann_index.IVFIndex(args.num_lists)
+    approximate = nn_matching.NearestNeighborDistanceMetric(
+        "cosine", args.max_cosine_distance, args.num_samples, index=index)
+    approximate.partial_fit(features, targets, all_targets)
+    for num_probes in map(int, args.num_probes.split(",")):
+        index.num_probes = num_probes
+        runtime, cost_matrix = benchmark(
+            approximate, queries, all_targets, args.repeat)
+        recall = np.mean(np.argmin(cost_matrix, axis=0) == expected_nn)
+        matches = cost_matrix <= args.max_cosine_distance
+        gated_recall = np.sum(np.logical_and(matches, expected_matches)) / (
+            max(1., float(np.sum(expected_matches))))
+        print("%-8d %12.3f %10.4f %14.4f" % (
+            num_probes, 1e3 * runtime, recall, gated_recall))
+
+
+if __name__ == "__main__":
+    main()
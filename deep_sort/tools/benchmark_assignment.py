@@ -0,0 +1,129 @@
+# vim: expandtab:ts=4:sw=4
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Root directory of the deep_sort project
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)  # To find deep_sort
+from deep_sort import assignment_solvers  # noqa: E402
+
+
+def create_cost_matrix(num_tracks, num_detections, max_distance=0.2,
+                       feature_dim=128, seed=0):
+    """Create a gated appearance cost matrix similar to the ones of the
+    matching cascade.
+
+    A random subset of detections are noisy observations of the tracks, the
+    remaining detections are clutter. Costs are cosine distances between
+    unit-length feature vectors, and entries above `max_distance` are
+    clipped as in `linear_assignment.min_cost_matching`.
+
+    Parameters
+    ----------
+    num_tracks : int
+        Number of rows.
+    num_detections : int
+        Number of columns.
+    max_distance : float
+        Gating threshold.
+    feature_dim : int
+        Dimensionality of the feature vectors.
+    seed : int
+        Seed of the random number generator.
+
+    Returns
+    -------
+    ndarray
+        The num_tracks x num_detections cost matrix.
+
+    """
+    rng = np.random.RandomState(seed)
+    tracks = rng.randn(num_tracks, feature_dim)
+    tracks /= np.linalg.norm(tracks, axis=1, keepdims=True)
+
+    detections = rng.randn(num_detections, feature_dim)
+    num_observed = min(num_tracks, num_detections)
+    observed = rng.permutation(num_tracks)[:num_observed]
+    detections[:num_observed] = (
+        tracks[observed] + 0.05 * rng.randn(num_observed, feature_dim))
+    detections /= np.linalg.norm(detections, axis=1, keepdims=True)
+    detections = detections[rng.permutation(num_detections)]
+
+    cost_matrix = 1. - np.dot(tracks, detections.T)
+    cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
+    return cost_matrix
+
+
+def benchmark(solver, cost_matrix, max_distance, repeat, jitter=0.):
+    """Run a solver `repeat` times and return the mean runtime in seconds,
+    the total cost, and the number of matches below `max_distance` of the
+    final run.
+
+    If `jitter` is larger than zero, costs are perturbed by uniform noise of
+    this magnitude in every run to emulate consecutive frames. Row indices
+    serve as row keys of solvers that accept them.
+    """
+    rng = np.random.RandomState(0)
+    cost_matrices = [cost_matrix] + [
+        cost_matrix + jitter * rng.uniform(size=cost_matrix.shape)
+        for _ in range(repeat if jitter > 0. else 0)]
+    kwargs = {}
+    if getattr(solver, "uses_row_keys", False):
+        kwargs["row_keys"] = list(range(cost_matrix.shape[0]))
+
+    solver(cost_matrices[0], **kwargs)  # Warm-up, e.g., to exclude imports.
+    t0 = time.time()
+    for i in range(repeat):
+        cost_matrix = cost_matrices[min(i + 1, len(cost_matrices) - 1)]
+        rows, cols = solver(cost_matrix, **kwargs)
+    runtime = (time.time() - t0) / repeat
+    costs = cost_matrix[rows, cols]
+    return runtime, costs.sum(), np.count_nonzero(costs <= max_distance)
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Linear assignment solver benchmark. Note that \"jv\" "
+        "is a pure Python reference solver, much slower than \"scipy\".")
+    parser.add_argument(
+        "--solvers", help="Comma-separated list of solvers.",
+        default=",".join(sorted(list(assignment_solvers.SOLVERS) + ["warm"])))
+    parser.add_argument(
+        "--sizes", help="Comma-separated list of problem sizes in format "
+        "TRACKSxDETECTIONS.", default="10x12,50x60,100x80,100x150,300x300")
+    parser.add_argument(
+        "--max_distance", help="Gating threshold.", type=float, default=0.2)
+    parser.add_argument(
+        "--repeat", help="Number of runs per solver and size.", type=int,
+        default=10)
+    parser.add_argument(
+        "--jitter", help="Magnitude of the cost perturbation between runs, "
+        "which emulates consecutive frames.", type=float, default=0.01)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    solvers = args.solvers.split(",")
+    print("%-10s %-8s %12s %12s %8s" % (
+        "size", "solver", "time [ms]", "total cost", "matches"))
+    for size in args.sizes.split(","):
+        num_tracks, num_detections = map(int, size.split("x"))
+        cost_matrix = create_cost_matrix(
+            num_tracks, num_detections, args.max_distance)
+        for name in solvers:
+            runtime, total_cost, num_matches = benchmark(
+                assignment_solvers.get_solver(name), cost_matrix,
+                args.max_distance, args.repeat, args.jitter)
+            print("%-10s %-8s %12.3f %12.4f %8d" % (
+                size, name, 1e3 * runtime, total_cost, num_matches))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# vim: expandtab:ts=4:sw=4
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Root directory of the deep_sort project
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)  # To find deep_sort
+from deep_sort import nn_matching  # noqa: E402
+
+
+def create_metric(num_targets, num_samples, budget, feature_dim=128,
+                  seed=0):
+    """Create a cosine distance metric with `num_samples` random samples for
+    each of `num_targets` targets and a gallery of capacity `budget`."""
+    rng = np.random.RandomState(seed)
+    metric = nn_matching.NearestNeighborDistanceMetric("cosine", 0.2, budget)
+    targets = np.repeat(np.arange(num_targets), num_samples)
+    metric.partial_fit(
+        rng.randn(len(targets), feature_dim), targets,
+        list(range(num_targets)))
+    return metric
+
+
+def loop_distance(metric, features, targets):
+    """The distance of the original implementation, which compares the
+    features to the samples of each target in turn."""
+    samples = metric.samples
+    cost_matrix = np.zeros((len(targets), len(features)))
+    for i, target in enumerate(targets):
+        cost_matrix[i, :] = nn_matching._nn_cosine_distance(
+            samples[target], features)
+    return cost_matrix
+
+
+def benchmark(function, repeat):
+    """Run a function `repeat` times and return the mean runtime in seconds
+    and the result of the final run."""
+    function()  # Warm-up.
+    t0 = time.time()
+    for _ in range(repeat):
+        result = function()
+    return (time.time() - t0) / repeat, result
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Appearance distance benchmark")
+    parser.add_argument(
+        "--sizes", help="Comma-separated list of problem sizes in format "
+        "TARGETSxSAMPLES.", default="100x20,300x60,100x100,300x100")
+    parser.add_argument(
+        "--budget", help="Gallery capacity per target.", type=int,
+        default=100)
+    parser.add_argument(
+        "--num_features", help="Number of queried features.", type=int,
+        default=None)
+    parser.add_argument(
+        "--repeat", help="Number of runs per size.", type=int, default=10)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print("%-10s %14s %14s %12s" % (
+        "size", "loop [ms]", "gallery [ms]", "max. error"))
+    rng = np.random.RandomState(1)
+    for size in args.sizes.split(","):
+        num_targets, num_samples = map(int, size.split("x"))
+        metric = create_metric(num_targets, num_samples, args.budget)
+        num_features = args.num_features or num_targets
+        features = rng.randn(num_features, 128).astype(np.float32)
+        targets = list(range(num_targets))
+
+        loop_runtime, expected = benchmark(
+            lambda: loop_distance(metric, features, targets), args.repeat)
+        gallery_runtime, actual = benchmark(
+            lambda: metric.distance(features, targets), args.repeat)
+        print("%-10s %14.3f %14.3f %12.3g" % (
+            size, 1e3 * loop_runtime, 1e3 * gallery_runtime,
+            np.abs(expected - actual).max()))
+
+
+if __name__ == "__main__":
+    main()
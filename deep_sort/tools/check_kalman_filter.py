@@ -0,0 +1,135 @@
+# vim: expandtab:ts=4:sw=4
+import argparse
+import os
+import sys
+
+import numpy as np
+
+# Root directory of the deep_sort project
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)  # To find deep_sort
+from deep_sort import kalman_filter  # noqa: E402
+
+
+def simulate(kf, measurements, observed):
+    """Filter a batch of trajectories with both the single-object and the
+    batched interface of a Kalman filter.
+
+    Parameters
+    ----------
+    kf : kalman_filter.KalmanFilter
+        The Kalman filter.
+    measurements : ndarray
+        A TxNx4 array of measurements of N objects over T time steps.
+    observed : ndarray
+        A TxN boolean array, which is True if an object is observed at a
+        time step (otherwise, only the prediction step is run).
+
+    Returns
+    -------
+    Dict[str -> List[ndarray]]
+        Returns the state distributions, projections, and gating distances of
+        each time step, computed with the single-object functions (keys
+        without suffix) and the batched functions (keys with suffix `_many`).
+
+    """
+    states = [kf.initiate(z) for z in measurements[0]]
+    mean = np.asarray([m for m, _ in states])
+    covariance = np.asarray([c for _, c in states])
+    mean_many, covariance_many = mean.copy(), covariance.copy()
+
+    outputs = {}
+
+    def record(key, value):
+        outputs.setdefault(key, []).append(np.asarray(value))
+
+    for z, is_observed in zip(measurements[1:], observed[1:]):
+        states = [kf.predict(m, c) for m, c in zip(mean, covariance)]
+        mean = np.asarray([m for m, _ in states])
+        covariance = np.asarray([c for _, c in states])
+        mean_many, covariance_many = kf.predict_many(
+            mean_many, covariance_many)
+
+        projections = [kf.project(m, c) for m, c in zip(mean, covariance)]
+        record("projected_mean", [m for m, _ in projections])
+        record("projected_cov", [c for _, c in projections])
+        projected_mean, projected_cov = kf.project_many(
+            mean_many, covariance_many)
+        record("projected_mean_many", projected_mean)
+        record("projected_cov_many", projected_cov)
+
+        for only_position in (False, True):
+            key = "gating_%s" % ("position" if only_position else "full")
+            record(key, [kf.gating_distance(m, c, z, only_position)
+                         for m, c in zip(mean, covariance)])
+            record(key + "_many", kf.gating_distance_many(
+                mean_many, covariance_many, z, only_position))
+
+        indices = np.flatnonzero(is_observed)
+        for i in indices:
+            mean[i], covariance[i] = kf.update(mean[i], covariance[i], z[i])
+        mean_many[indices], covariance_many[indices] = kf.update_many(
+            mean_many[indices], covariance_many[indices], z[indices])
+
+        record("mean", mean.copy())
+        record("covariance", covariance.copy())
+        record("mean_many", mean_many.copy())
+        record("covariance_many", covariance_many.copy())
+    return outputs
+
+
+def create_trajectories(num_objects, num_frames, seed=0):
+    """Create random constant velocity trajectories with measurement noise
+    and missed detections."""
+    rng = np.random.RandomState(seed)
+    position = np.c_[
+        rng.uniform(0, 1920, (num_objects, 2)),
+        rng.uniform(0.3, 0.6, num_objects), rng.uniform(40, 300, num_objects)]
+    velocity = np.c_[
+        rng.normal(0, 5, (num_objects, 2)), np.zeros(num_objects),
+        rng.normal(0, 0.5, num_objects)]
+    measurements = np.empty((num_frames, num_objects, 4))
+    for t in range(num_frames):
+        noise = rng.normal(0, 1, (num_objects, 4)) * [2., 2., 0.01, 2.]
+        measurements[t] = position + t * velocity + noise
+    observed = rng.uniform(size=(num_frames, num_objects)) > 0.2
+    return measurements, observed
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Check DecoupledKalmanFilter against KalmanFilter")
+    parser.add_argument(
+        "--num_objects", help="Number of trajectories.", type=int, default=50)
+    parser.add_argument(
+        "--num_frames", help="Number of time steps.", type=int, default=100)
+    parser.add_argument(
+        "--rtol", help="Relative tolerance.", type=float, default=1e-7)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    measurements, observed = create_trajectories(
+        args.num_objects, args.num_frames)
+    reference = simulate(kalman_filter.KalmanFilter(), measurements, observed)
+    decoupled = simulate(
+        kalman_filter.DecoupledKalmanFilter(), measurements, observed)
+
+    failed = False
+    for key in sorted(reference):
+        expected, actual = np.asarray(reference[key]), np.asarray(decoupled[key])
+        scale = max(np.abs(expected).max(), 1e-12)
+        error = np.abs(expected - actual).max() / scale
+        ok = np.allclose(actual, expected, rtol=args.rtol, atol=args.rtol * scale)
+        failed = failed or not ok
+        print("%-22s max. relative error %.3g %s" % (
+            key, error, "ok" if ok else "FAILED"))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 # vim: expandtab:ts=4:sw=4
 import os
+import sys
 import errno
 import argparse
 import numpy as np
@@ -7,6 +8,17 @@ import cv2
 import tensorflow as tf
 import time
 
+# Root directory of the deep_sort project
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT_DIR)  # To find application_util
+from application_util import detection_store  # noqa: E402
+from application_util import frame_index  # noqa: E402
+
+# Default input directory, with frames in `images` and detections in
+# `det/det.txt`.
+SOURCE_DIR = os.path.join(os.path.dirname(ROOT_DIR), "source")
+
+
 def _run_in_batches(f, data_dict, out, batch_size):
     data_len = len(out)
     num_batches = int(data_len / batch_size)
@@ -95,27 +107,50 @@ class ImageEncoder(object):
         return out
 
 
+def extract_image_patches(image, boxes, image_shape):
+    """Extract the input patches of an `ImageEncoder` from bounding boxes.
+
+    Parameters
+    ----------
+    image : ndarray
+        The full image.
+    boxes : array_like
+        A matrix of bounding boxes in format (x, y, width, height).
+    image_shape : array_like
+        The encoder input shape (height, width, channels). Boxes that are
+        empty or fully outside of the image are replaced by random patches.
+
+    Returns
+    -------
+    ndarray
+        A stack of one image patch per bounding box.
+
+    """
+    image_patches = []
+    for box in boxes:
+        patch = extract_image_patch(image, box, image_shape[:2])
+        if patch is None:
+            print("WARNING: Failed to extract image patch: %s." % str(box))
+            patch = np.random.uniform(
+                0., 255., image_shape).astype(np.uint8)
+        image_patches.append(patch)
+    return np.asarray(image_patches)
+
+
 def create_box_encoder(model_filename, input_name="images",
                        output_name="features", batch_size=32):
     image_encoder = ImageEncoder(model_filename, input_name, output_name)
     image_shape = image_encoder.image_shape
 
     def encoder(image, boxes):
-        image_patches = []
-        for box in boxes:
-            patch = extract_image_patch(image, box, image_shape[:2])
-            if patch is None:
-                print("WARNING: Failed to extract image patch: %s." % str(box))
-                patch = np.random.uniform(
-                    0., 255., image_shape).astype(np.uint8)
-            image_patches.append(patch)
-        image_patches = np.asarray(image_patches)
+        image_patches = extract_image_patches(image, boxes, image_shape)
         return image_encoder(image_patches, batch_size)
 
     return encoder
 
 
-def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
+def generate_detections(encoder, mot_dir, output_dir, detection_dir=None,
+                        output_format="npy", feature_dtype=np.float32):
     """Generate detections with features.
 
     Parameters
@@ -131,9 +166,21 @@ def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
     detection_dir
         Path to custom detections. The directory structure should be the default
         MOTChallenge structure: `[sequence]/det/det.txt`. If None, uses the
-        standard MOTChallenge detections.
+        standard MOTChallenge detections. If `det` is a detection store
+        directory instead (see `application_util.detection_store`), detections
+        are read from the store.
+    output_format : Optional[str]
+        Either "npy" to write a float32 detection matrix with features
+        appended to each row (the default), or "store" to write a detection
+        store directory per sequence.
+    feature_dtype : Optional[str | dtype]
+        Data type of features in the detection store, one of
+        `detection_store.FEATURE_DTYPES`.
 
     """
+    if output_format not in ("store", "npy"):
+        raise ValueError(
+            "Invalid output format; must be either 'store' or 'npy'")
     if detection_dir is None:
         detection_dir = mot_dir
     try:
@@ -155,32 +202,59 @@ def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
             int(os.path.splitext(f)[0]): os.path.join(image_dir, f)
             for f in os.listdir(image_dir)}
 
-        detection_file = os.path.join(
-            detection_dir, "det/det.txt")
-        detections_in = np.loadtxt(detection_file, delimiter=',')
+        store_in = os.path.join(detection_dir, "det")
+        if detection_store.is_detection_store(store_in):
+            detections_in = detection_store.DetectionStore(store_in)
+            detection_index = detections_in.index
+        else:
+            detection_file = os.path.join(
+                detection_dir, "det/det.txt")
+            detections_in, detection_index = frame_index.index_by_frame(
+                np.loadtxt(detection_file, delimiter=','))
         detections_out = []
+        writer = None
 
-        frame_indices = detections_in[:, 0].astype(np.int)
-        min_frame_idx = frame_indices.astype(np.int).min()
-        max_frame_idx = frame_indices.astype(np.int).max()
+        min_frame_idx = detection_index.min_frame_idx
+        max_frame_idx = detection_index.max_frame_idx
         start = time.time()
         for frame_idx in range(min_frame_idx, max_frame_idx + 1):
             print("============= Frame %05d/%05d ============= (Working time: %.2f sec)" % (frame_idx, max_frame_idx, time.time() - start))
-            mask = frame_indices == frame_idx
-            rows = detections_in[mask]
+            if isinstance(detections_in, detection_store.DetectionStore):
+                boxes, scores, class_ids, _ = detections_in.read_frame(
+                    frame_idx)
+                rows = detections_in.to_matrix(frame_idx)
+            else:
+                rows = detections_in[detection_index.slice(frame_idx)]
+                boxes, scores, class_ids = rows[:, 2:6], rows[:, 6], None
 
             if frame_idx not in image_filenames:
                 print("WARNING could not find image for frame %d" % frame_idx)
                 continue
             bgr_image = cv2.imread(
                 image_filenames[frame_idx], cv2.IMREAD_COLOR)
-            features = encoder(bgr_image, rows[:, 2:6].copy())
-            detections_out += [np.r_[(row, feature)] for row, feature
-                               in zip(rows, features)]
+            features = encoder(bgr_image, np.array(boxes, dtype=np.float))
+            if output_format == "npy":
+                # Concatenate in float32; features would be upcast to the
+                # float64 of the detection rows otherwise.
+                detections_out.append(np.c_[
+                    rows.astype(np.float32), features.astype(np.float32)])
+                continue
+
+            if writer is None:
+                writer = detection_store.DetectionStoreWriter(
+                    os.path.join(output_dir, sequence), features.shape[1],
+                    feature_dtype)
+            writer.write(frame_idx, boxes, scores, class_ids, features)
 
-        output_filename = os.path.join(output_dir, "%s.npy" % sequence)
-        np.save(
-            output_filename, np.asarray(detections_out), allow_pickle=False)
+        if writer is not None:
+            writer.close()
+        if output_format == "npy":
+            output_filename = os.path.join(output_dir, "%s.npy" % sequence)
+            if len(detections_out) > 0:
+                detections_out = np.concatenate(detections_out)
+            else:
+                detections_out = np.zeros((0, 10), dtype=np.float32)
+            np.save(output_filename, detections_out, allow_pickle=False)
 
 
 def parse_args():
@@ -189,31 +263,35 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Re-ID feature extractor")
     parser.add_argument(
         "--model",
-        default="resources/networks/mars-small128.pb",
+        default=os.path.join(ROOT_DIR, "resources/networks/mars-small128.pb"),
         help="Path to freezed inference graph protobuf.")
     parser.add_argument(
         "--mot_dir", help="Path to MOTChallenge directory (train or test)",
-        required=True)
+        default=SOURCE_DIR)
     parser.add_argument(
         "--detection_dir", help="Path to custom detections. Defaults to "
         "standard MOT detections Directory structure should be the default "
         "MOTChallenge structure: [sequence]/det/det.txt", default=None)
     parser.add_argument(
         "--output_dir", help="Output directory. Will be created if it does not"
-        " exist.", default="detections")
+        " exist.", default=os.path.join(SOURCE_DIR, "feat"))
+    parser.add_argument(
+        "--output_format", help="Either 'npy' to write a detection matrix per "
+        "sequence, or 'store' to write a memory-mappable detection store "
+        "directory per sequence.", default="npy", choices=["npy", "store"])
+    parser.add_argument(
+        "--feature_dtype", help="Data type of features in the detection "
+        "store.", default="float32",
+        choices=list(detection_store.FEATURE_DTYPES))
     return parser.parse_args()
 
 
-# def main():
-#     args = parse_args()
-#     encoder = create_box_encoder(args.model, batch_size=32)
-#     generate_detections(encoder, args.mot_dir, args.output_dir,
-#                         args.detection_dir)
-
 def main():
-    # args = parse_args()
-    encoder = create_box_encoder("D:/dev/python/Mask_RCNN_deep_sort/deep_sort/resources/networks/mars-small128.pb", batch_size=32)
-    generate_detections(encoder, "D:/dev/python/Mask_RCNN_deep_sort/source", "D:/dev/python/Mask_RCNN_deep_sort/source/feat")
+    args = parse_args()
+    encoder = create_box_encoder(args.model, batch_size=32)
+    generate_detections(encoder, args.mot_dir, args.output_dir,
+                        args.detection_dir, args.output_format,
+                        args.feature_dtype)
 
 
 if __name__ == "__main__":
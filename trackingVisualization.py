@@ -7,10 +7,12 @@ import os
 import cv2
 import numpy as np
 
+from deep_sort.application_util import detection_store
+from deep_sort.application_util import frame_index
 from deep_sort.application_util import preprocessing
 from deep_sort.application_util import visualization
 from deep_sort.deep_sort import nn_matching
-from deep_sort.deep_sort.detection import Detection
+from deep_sort.deep_sort.detection import DetectionBatch
 from deep_sort.deep_sort.tracker import Tracker
 
 
@@ -23,7 +25,9 @@ def gather_sequence_info(sequence_dir, detection_file):
     sequence_dir : str
         Path to the MOTChallenge sequence directory.
     detection_file : str
-        Path to the detection file.
+        Path to the detection file. Either a `.npy` detection matrix or a
+        detection store directory (see
+        `application_util.detection_store.DetectionStore`).
 
     Returns
     -------
@@ -33,8 +37,13 @@ def gather_sequence_info(sequence_dir, detection_file):
         * sequence_name: Name of the sequence
         * image_filenames: A dictionary that maps frame indices to image
           filenames.
-        * detections: A numpy array of detections in MOTChallenge format.
-        * groundtruth: A numpy array of ground truth in MOTChallenge format.
+        * detections: A numpy array of detections in MOTChallenge format,
+          sorted by frame index, or a memory-mapped DetectionStore.
+        * detection_index: A frame index into the detections
+          (see `application_util.frame_index.FrameIndex`).
+        * groundtruth: A numpy array of ground truth in MOTChallenge format,
+          sorted by frame index.
+        * groundtruth_index: A frame index into the ground truth.
         * image_size: Image size (height, width).
         * min_frame_idx: Index of the first frame.
         * max_frame_idx: Index of the last frame.
@@ -47,12 +56,18 @@ def gather_sequence_info(sequence_dir, detection_file):
         for f in os.listdir(image_dir)}
     groundtruth_file = os.path.join(sequence_dir, "gt/gt.txt")
 
-    detections = None
-    if detection_file is not None:
-        detections = np.load(detection_file)
-    groundtruth = None
+    detections, detection_index = None, None
+    if detection_file is not None and \
+            detection_store.is_detection_store(detection_file):
+        detections = detection_store.DetectionStore(detection_file)
+        detection_index = detections.index
+    elif detection_file is not None:
+        detections, detection_index = frame_index.index_by_frame(
+            np.load(detection_file))
+    groundtruth, groundtruth_index = None, None
     if os.path.exists(groundtruth_file):
-        groundtruth = np.loadtxt(groundtruth_file, delimiter=',')
+        groundtruth, groundtruth_index = frame_index.index_by_frame(
+            np.loadtxt(groundtruth_file, delimiter=','))
 
     if len(image_filenames) > 0:
         image = cv2.imread(next(iter(image_filenames.values())),
@@ -65,8 +80,8 @@ def gather_sequence_info(sequence_dir, detection_file):
         min_frame_idx = min(image_filenames.keys())
         max_frame_idx = max(image_filenames.keys())
     else:
-        min_frame_idx = int(detections[:, 0].min())
-        max_frame_idx = int(detections[:, 0].max())
+        min_frame_idx = detection_index.min_frame_idx
+        max_frame_idx = detection_index.max_frame_idx
 
     info_filename = os.path.join(sequence_dir, "seqinfo.ini")
     if os.path.exists(info_filename):
@@ -79,12 +94,17 @@ def gather_sequence_info(sequence_dir, detection_file):
     else:
         update_ms = None
 
-    feature_dim = detections.shape[1] - 10 if detections is not None else 0
+    if isinstance(detections, detection_store.DetectionStore):
+        feature_dim = detections.feature_dim
+    else:
+        feature_dim = detections.shape[1] - 10 if detections is not None else 0
     seq_info = {
         "sequence_name": os.path.basename(sequence_dir),
         "image_filenames": image_filenames,
         "detections": detections,
+        "detection_index": detection_index,
         "groundtruth": groundtruth,
+        "groundtruth_index": groundtruth_index,
         "image_size": image_size,
         "min_frame_idx": min_frame_idx,
         "max_frame_idx": max_frame_idx,
@@ -94,37 +114,45 @@ def gather_sequence_info(sequence_dir, detection_file):
     return seq_info
 
 
-def create_detections(detection_mat, frame_idx, min_height=0):
+def create_detections(detection_mat, frame_idx, min_height=0,
+                      detection_index=None):
     """Create detections for given frame index from the raw detection matrix.
 
     Parameters
     ----------
-    detection_mat : ndarray
+    detection_mat : ndarray | DetectionStore
         Matrix of detections. The first 10 columns of the detection matrix are
         in the standard MOTChallenge detection format. In the remaining columns
-        store the feature vector associated with each detection.
+        store the feature vector associated with each detection. Alternatively,
+        a memory-mapped detection store.
     frame_idx : int
         The frame index.
     min_height : Optional[int]
         A minimum detection bounding box height. Detections that are smaller
         than this value are disregarded.
+    detection_index : Optional[FrameIndex]
+        The frame index of `detection_mat`. If None, the rows of the given
+        frame are found by scanning the entire matrix. Not used for detection
+        stores, which carry their own index.
 
     Returns
     -------
-    List[tracker.Detection]
+    DetectionBatch
         Returns detection responses at given frame index.
 
     """
-    frame_indices = detection_mat[:, 0].astype(np.int)
-    mask = frame_indices == frame_idx
+    if isinstance(detection_mat, detection_store.DetectionStore):
+        bboxes, confidences, _, features = detection_mat.read_frame(frame_idx)
+    else:
+        if detection_index is not None:
+            rows = detection_mat[detection_index.slice(frame_idx)]
+        else:
+            rows = detection_mat[
+                detection_mat[:, 0].astype(np.int) == frame_idx]
+        bboxes, confidences, features = rows[:, 2:6], rows[:, 6], rows[:, 10:]
 
-    detection_list = []
-    for row in detection_mat[mask]:
-        bbox, confidence, feature = row[2:6], row[6], row[10:]
-        if bbox[3] < min_height:
-            continue
-        detection_list.append(Detection(bbox, confidence, feature))
-    return detection_list
+    mask = bboxes[:, 3] >= min_height
+    return DetectionBatch(bboxes[mask], confidences[mask], features[mask])
 
 
 def run(sequence_dir, detection_file, output_file, min_confidence,
@@ -169,17 +197,16 @@ def run(sequence_dir, detection_file, output_file, min_confidence,
 
         # Load image and generate detections.
         detections = create_detections(
-            seq_info["detections"], frame_idx, min_detection_height)
-        detections = [d for d in detections if d.confidence >= min_confidence]
+            seq_info["detections"], frame_idx, min_detection_height,
+            seq_info["detection_index"])
+        detections = detections[detections.confidence >= min_confidence]
 
         # Run non-maxima suppression.
         # Load the result of bounding box generated from Mask R-CNN
         # boxes = np.load('./Mask_RCNN/samples/Mask_RCNN_bbox_result.npy')
-        boxes = np.array([d.tlwh for d in detections])
-        scores = np.array([d.confidence for d in detections])
         indices = preprocessing.non_max_suppression(
-            boxes, nms_max_overlap, scores)
-        detections = [detections[i] for i in indices]
+            detections.tlwh, nms_max_overlap, detections.confidence)
+        detections = detections[indices]
 
         # Update tracker.
         tracker.predict()
@@ -269,6 +296,6 @@ def parse_args():
 if __name__ == "__main__":
     # args = parse_args()
     run(
-        "./source/images", "./source/feat/feat.npy", "result.txt",
+        "./source/images", "./source/feat/images.npy", "result.txt",
         0.9, 1.0, 0,
         0.2, 100, True)
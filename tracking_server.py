@@ -0,0 +1,689 @@
+# vim: expandtab:ts=4:sw=4
+"""Multi-stream Mask R-CNN + Deep SORT tracking server.
+
+A long-running service that tracks objects in many camera streams at once.
+Each stream has its own `Tracker` and `NearestNeighborDistanceMetric`, while
+a single Mask R-CNN model and a single appearance encoder are shared by all
+streams. Frames of all streams are funneled into a dynamic batcher in front
+of each model (see `batching.DynamicBatcher`), such that the models run on
+batches of frames from different cameras.
+
+Streams are managed with a small HTTP/JSON interface, served on a TCP port
+or on a local Unix socket:
+
+    GET    /streams                  List all streams.
+    POST   /streams                  Add a stream. JSON body with entries
+                                     name, source (optional; a video file or
+                                     camera URL that is read by the server),
+                                     and output_file (optional; tracking
+                                     results in MOTChallenge format).
+    GET    /streams/<name>           Stream status and the latest tracks.
+    DELETE /streams/<name>           Stop and remove a stream.
+    POST   /streams/<name>/frames    Push an encoded image (e.g., JPEG) to a
+                                     stream without source. The stream is
+                                     created if it does not exist. Returns
+                                     the tracks of this frame.
+    GET    /statistics               Batcher statistics.
+
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import json
+import os
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    import socketserver
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    import SocketServer as socketserver
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+import video_pipeline
+from deep_sort.application_util import batching
+from deep_sort.deep_sort import nn_matching
+from deep_sort.deep_sort.tracker import Tracker
+from deep_sort.tools import generate_detections
+
+# Largest default Mask R-CNN batch, such that the model fits into the memory
+# of a single GPU
+MAX_DETECTOR_BATCH_SIZE = 4
+
+
+def create_detector_batcher(model, timeout):
+    """Create a dynamic batcher in front of Mask R-CNN.
+
+    Parameters
+    ----------
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode. The maximum batch size is the
+        configured `BATCH_SIZE`.
+    timeout : float
+        Maximum time in seconds that a frame waits for a batch to fill up.
+
+    Returns
+    -------
+    batching.DynamicBatcher
+        A batcher that maps an RGB color image to the result of
+        `MaskRCNN.detect`.
+
+    """
+    graph = tf.get_default_graph()
+    batch_size = model.config.BATCH_SIZE
+
+    def detect_batch(images):
+        # Mask R-CNN processes exactly BATCH_SIZE images per call. Incomplete
+        # batches are padded with copies of the last image.
+        padded_images = images + [images[-1]] * (batch_size - len(images))
+        with graph.as_default():
+            return model.detect(padded_images, verbose=0)[:len(images)]
+
+    return batching.DynamicBatcher(detect_batch, batch_size, timeout, "detect")
+
+
+def create_encoder_batcher(image_encoder, max_batch_size, timeout,
+                           encoder_batch_size=32):
+    """Create a dynamic batcher in front of the appearance encoder.
+
+    Parameters
+    ----------
+    image_encoder : generate_detections.ImageEncoder
+        The appearance descriptor network.
+    max_batch_size : int
+        Maximum number of frames per batch.
+    timeout : float
+        Maximum time in seconds that a frame waits for a batch to fill up.
+    encoder_batch_size : int
+        Number of image patches per network evaluation.
+
+    Returns
+    -------
+    batching.DynamicBatcher
+        A batcher that maps a stack of image patches (see
+        `generate_detections.extract_image_patches`) to their features.
+
+    """
+    def encode_batch(patches):
+        counts = [len(p) for p in patches]
+        features = image_encoder(np.concatenate(patches), encoder_batch_size)
+        return np.split(features, np.cumsum(counts)[:-1])
+
+    return batching.DynamicBatcher(
+        encode_batch, max_batch_size, timeout, "encode")
+
+
+class StreamTracker(object):
+    """
+    Tracks the objects in a single camera stream.
+
+    Frames are either pushed with `process` (from any thread; frames are
+    processed one at a time in order of arrival) or, if a source is given,
+    read in a background thread started with `start`.
+
+    Parameters
+    ----------
+    name : str
+        The stream name.
+    detector : Callable[ndarray] -> Dict
+        Maps an RGB color image to the result of `MaskRCNN.detect`, e.g., a
+        batcher returned by `create_detector_batcher`.
+    encoder : Callable[image, ndarray] -> ndarray
+        Maps a BGR color image and a matrix of bounding boxes to their
+        appearance features.
+    min_confidence : float
+        Detection confidence threshold.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold.
+    max_cosine_distance : float
+        Gating threshold for cosine distance metric (object appearance).
+    nn_budget : Optional[int]
+        Maximum size of the appearance descriptor gallery.
+    class_ids : Optional[List[int]]
+        If not None, only track objects of these COCO class IDs.
+    lazy_features : Optional[bool]
+        If True, appearance descriptors are computed only for detections
+        that cannot be associated by motion alone.
+    source : Optional[str]
+        Path to a video file, or any other source accepted by
+        `cv2.VideoCapture`.
+    output_file : Optional[str]
+        If not None, tracking results are appended to this file in
+        MOTChallenge format.
+
+    Attributes
+    ----------
+    num_frames : int
+        Number of processed frames.
+    latest : Dict
+        The frame index and tracks of the latest frame, see `process`.
+    finished : bool
+        True if the source has been read to its end (or failed).
+    error : Optional[str]
+        The error message if reading the source failed.
+
+    """
+
+    def __init__(self, name, detector, encoder, min_confidence,
+                 nms_max_overlap, min_detection_height, max_cosine_distance,
+                 nn_budget, class_ids=None, lazy_features=False, source=None,
+                 output_file=None):
+        self.name = name
+        self.source = source
+        self.output_file = output_file
+        self.num_frames = 0
+        self.latest = {"frame_idx": None, "tracks": []}
+        self.finished = False
+        self.error = None
+
+        self._detector = detector
+        self._encoder = encoder
+        self._min_confidence = min_confidence
+        self._nms_max_overlap = nms_max_overlap
+        self._min_detection_height = min_detection_height
+        self._class_ids = class_ids
+        self._lazy_features = lazy_features
+        metric = nn_matching.NearestNeighborDistanceMetric(
+            "cosine", max_cosine_distance, nn_budget)
+        self.tracker = Tracker(metric)
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        if output_file is not None:
+            open(output_file, "w").close()
+
+    def process(self, image, frame_idx=None):
+        """Run detection and tracking on a frame.
+
+        Parameters
+        ----------
+        image : ndarray
+            The BGR color image.
+        frame_idx : Optional[int]
+            The frame index. Defaults to the number of processed frames.
+
+        Returns
+        -------
+        Dict
+            A dictionary with entries frame_idx and tracks, where tracks is
+            a list of the confirmed tracks that have been updated in the
+            last two frames, each with entries track_id and bbox (in format
+            `(x, y, w, h)`).
+
+        """
+        with self._lock:
+            self.num_frames += 1
+            if frame_idx is None:
+                frame_idx = self.num_frames
+
+            # Mask R-CNN is trained on RGB images.
+            result = self._detector(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            rows = video_pipeline.to_detection_rows(
+                frame_idx, result, self._class_ids)
+            if not self._lazy_features:
+                (_, _, rows), = video_pipeline.encode_frames(
+                    self._encoder, [(frame_idx, image, rows)])
+            self.tracker.predict()
+            video_pipeline.update_tracker(
+                self.tracker, image, rows, self._min_confidence,
+                self._nms_max_overlap, self._min_detection_height,
+                self._encoder if self._lazy_features else None)
+
+            tracks = [
+                {"track_id": track.track_id,
+                 "bbox": [float(x) for x in track.to_tlwh()]}
+                for track in self.tracker.tracks
+                if track.is_confirmed() and track.time_since_update <= 1]
+            if self.output_file is not None:
+                with open(self.output_file, "a") as f:
+                    for track in tracks:
+                        print("%d,%d,%.2f,%.2f,%.2f,%.2f,1,-1,-1,-1" % (
+                            (frame_idx, track["track_id"]) +
+                            tuple(track["bbox"])), file=f)
+            self.latest = {"frame_idx": frame_idx, "tracks": tracks}
+            return self.latest
+
+    def start(self):
+        """Start reading frames from the source in a background thread."""
+        if self.source is None:
+            raise ValueError("Stream '%s' has no source" % self.name)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop reading frames from the source."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        try:
+            for frame_idx, image in video_pipeline.read_frames(self.source):
+                if self._stop_event.is_set():
+                    break
+                self.process(image, frame_idx)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.finished = True
+
+    def info(self):
+        """Returns the stream status as a dictionary."""
+        return {
+            "name": self.name,
+            "source": self.source,
+            "num_frames": self.num_frames,
+            "num_tracks": len(self.latest["tracks"]),
+            "finished": self.finished,
+            "error": self.error}
+
+
+class TrackingServer(object):
+    """
+    Manages the streams of the tracking server. All streams share the same
+    detector and encoder.
+
+    Parameters
+    ----------
+    detector : Callable[ndarray] -> Dict
+        See `StreamTracker`.
+    encoder : Callable[image, ndarray] -> ndarray
+        See `StreamTracker`.
+    batchers : Optional[List[batching.DynamicBatcher]]
+        Batchers to report in `statistics`.
+    **stream_options
+        Tracking parameters passed to each `StreamTracker`
+        (min_confidence, nms_max_overlap, min_detection_height,
+        max_cosine_distance, nn_budget, class_ids, lazy_features).
+
+    """
+
+    def __init__(self, detector, encoder, batchers=None, **stream_options):
+        self._detector = detector
+        self._encoder = encoder
+        self._batchers = batchers if batchers is not None else []
+        self._stream_options = stream_options
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def add_stream(self, name, source=None, output_file=None):
+        """Add a stream. If a source is given, reading starts immediately.
+
+        Returns
+        -------
+        StreamTracker
+            The new stream.
+
+        """
+        with self._lock:
+            if name in self._streams:
+                raise ValueError("Stream '%s' already exists" % name)
+            stream = StreamTracker(
+                name, self._detector, self._encoder, source=source,
+                output_file=output_file, **self._stream_options)
+            self._streams[name] = stream
+        if source is not None:
+            stream.start()
+        return stream
+
+    def remove_stream(self, name):
+        """Stop and remove a stream."""
+        with self._lock:
+            stream = self._streams.pop(name)
+        stream.stop()
+
+    def stream(self, name):
+        """Returns the stream with the given name (KeyError if unknown)."""
+        with self._lock:
+            return self._streams[name]
+
+    def process_frame(self, name, image):
+        """Process a pushed frame, see `StreamTracker.process`. The stream
+        is created if it does not exist."""
+        with self._lock:
+            stream = self._streams.get(name)
+        if stream is None:
+            try:
+                stream = self.add_stream(name)
+            except ValueError:  # Created concurrently.
+                stream = self.stream(name)
+        if stream.source is not None:
+            raise ValueError("Stream '%s' reads from a source" % name)
+        return stream.process(image)
+
+    def streams(self):
+        """Returns the status of all streams."""
+        with self._lock:
+            streams = list(self._streams.values())
+        return [stream.info() for stream in streams]
+
+    def statistics(self):
+        """Returns the statistics of all batchers."""
+        return [batcher.statistics() for batcher in self._batchers]
+
+    def close(self):
+        """Stop all streams."""
+        with self._lock:
+            streams = list(self._streams.values())
+            self._streams = {}
+        for stream in streams:
+            stream.stop()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Maps HTTP requests to `TrackingServer` calls (see module docstring).
+    The handled server must have a `tracking_server` attribute."""
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length > 0 else b""
+
+    def _path(self):
+        return [p for p in self.path.split("?")[0].split("/") if p]
+
+    def _handle(self, method):
+        server = self.server.tracking_server
+        path = self._path()
+        try:
+            if method == "GET" and path == ["streams"]:
+                self._send_json(200, server.streams())
+            elif method == "GET" and path == ["statistics"]:
+                self._send_json(200, server.statistics())
+            elif method == "GET" and len(path) == 2 and path[0] == "streams":
+                stream = server.stream(path[1])
+                info = stream.info()
+                info.update(stream.latest)
+                self._send_json(200, info)
+            elif method == "POST" and path == ["streams"]:
+                request = json.loads(self._read_body().decode("utf-8"))
+                stream = server.add_stream(
+                    request["name"], request.get("source"),
+                    request.get("output_file"))
+                self._send_json(201, stream.info())
+            elif method == "POST" and len(path) == 3 and \
+                    path[0] == "streams" and path[2] == "frames":
+                data = np.frombuffer(self._read_body(), dtype=np.uint8)
+                image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+                if image is None:
+                    raise ValueError("Failed to decode image")
+                self._send_json(200, server.process_frame(path[1], image))
+            elif method == "DELETE" and len(path) == 2 and \
+                    path[0] == "streams":
+                server.remove_stream(path[1])
+                self._send_json(200, {"name": path[1]})
+            else:
+                self._send_json(404, {"error": "Not found"})
+        except KeyError as e:
+            self._send_json(404, {"error": "Unknown stream or entry %s" % e})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn,
+                                  socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def create_http_server(tracking_server, host="127.0.0.1", port=8080,
+                       unix_socket=None):
+    """Create the HTTP front end. Each request is handled in its own
+    thread, such that frames pushed by different clients are batched.
+
+    Parameters
+    ----------
+    tracking_server : TrackingServer
+        The tracking server.
+    host : Optional[str]
+        The address to listen on.
+    port : Optional[int]
+        The TCP port to listen on.
+    unix_socket : Optional[str]
+        If not None, listen on a Unix socket at this path instead of a TCP
+        port. An existing file at this path is replaced.
+
+    Returns
+    -------
+    socketserver.BaseServer
+        The HTTP server; call `serve_forever` to handle requests.
+
+    """
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        http_server = ThreadingUnixHTTPServer(unix_socket, RequestHandler)
+    else:
+        http_server = ThreadingHTTPServer((host, port), RequestHandler)
+    http_server.tracking_server = tracking_server
+    return http_server
+
+
+def default_detector_batch_size(num_streams):
+    """Choose the Mask R-CNN batch size for a number of streams.
+
+    Parameters
+    ----------
+    num_streams : int
+        Number of streams that are configured on startup.
+
+    Returns
+    -------
+    int
+        One batch slot per stream, at most `MAX_DETECTOR_BATCH_SIZE`. If no
+        streams are configured on startup, all streams are added through the
+        HTTP interface and their number is unknown; then the maximum batch
+        size is returned.
+
+    """
+    if num_streams < 1:
+        return MAX_DETECTOR_BATCH_SIZE
+    return min(num_streams, MAX_DETECTOR_BATCH_SIZE)
+
+
+def run(host, port, unix_socket, streams, min_confidence, nms_max_overlap,
+        min_detection_height, max_cosine_distance, nn_budget,
+        detector_model=video_pipeline.COCO_MODEL_PATH,
+        encoder_model=video_pipeline.ENCODER_MODEL_PATH, class_ids=None,
+        lazy_features=False, detector_batch_size=None, encoder_batch_size=16,
+        batch_timeout_ms=20.):
+    """Run the tracking server until interrupted.
+
+    Parameters
+    ----------
+    host : str
+        The address to listen on.
+    port : int
+        The TCP port to listen on.
+    unix_socket : Optional[str]
+        If not None, listen on a Unix socket at this path instead.
+    streams : List[(str, str)]
+        Name and source of streams to add on startup.
+    min_confidence : float
+        Detection confidence threshold.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold.
+    max_cosine_distance : float
+        Gating threshold for cosine distance metric (object appearance).
+    nn_budget : Optional[int]
+        Maximum size of the appearance descriptor gallery of each stream.
+    detector_model : Optional[str]
+        Path to the Mask R-CNN weights.
+    encoder_model : Optional[str]
+        Path to the frozen appearance descriptor network.
+    class_ids : Optional[List[int]]
+        If not None, only track objects of these COCO class IDs.
+    lazy_features : Optional[bool]
+        If True, appearance descriptors are computed only for detections
+        that cannot be associated by motion alone.
+    detector_batch_size : Optional[int]
+        Number of frames per Mask R-CNN batch. Incomplete batches are padded,
+        so every detector call costs as much as a full batch: a batch size
+        larger than the number of streams that submit frames concurrently
+        makes each frame slower without raising throughput. If None, the
+        batch size is the number of `streams`, at most
+        `MAX_DETECTOR_BATCH_SIZE` (see `default_detector_batch_size`).
+    encoder_batch_size : Optional[int]
+        Maximum number of frames per encoder batch.
+    batch_timeout_ms : Optional[float]
+        Maximum time in milliseconds that a frame waits for a batch to fill
+        up.
+
+    """
+    if detector_batch_size is None:
+        detector_batch_size = default_detector_batch_size(len(streams))
+    model = video_pipeline.create_detector(
+        detector_model, batch_size=detector_batch_size)
+    image_encoder = generate_detections.ImageEncoder(encoder_model)
+    detector = create_detector_batcher(model, batch_timeout_ms / 1000.)
+    encoder_batcher = create_encoder_batcher(
+        image_encoder, encoder_batch_size, batch_timeout_ms / 1000.)
+
+    def encoder(image, boxes):
+        if len(boxes) == 0:
+            return np.zeros((0, image_encoder.feature_dim), np.float32)
+        return encoder_batcher(generate_detections.extract_image_patches(
+            image, boxes, image_encoder.image_shape))
+
+    tracking_server = TrackingServer(
+        detector, encoder, [detector, encoder_batcher],
+        min_confidence=min_confidence, nms_max_overlap=nms_max_overlap,
+        min_detection_height=min_detection_height,
+        max_cosine_distance=max_cosine_distance, nn_budget=nn_budget,
+        class_ids=class_ids, lazy_features=lazy_features)
+    http_server = create_http_server(tracking_server, host, port, unix_socket)
+    detector.start()
+    encoder_batcher.start()
+    for name, source in streams:
+        tracking_server.add_stream(name, source)
+
+    print("Serving on %s" % (
+        unix_socket if unix_socket is not None else "%s:%d" % (host, port)))
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        tracking_server.close()
+        detector.stop()
+        encoder_batcher.stop()
+        print(detector.format_statistics())
+        print(encoder_batcher.format_statistics())
+
+
+def stream_string(input_string):
+    if "=" not in input_string:
+        raise ValueError("Please enter streams as NAME=SOURCE")
+    name, source = input_string.split("=", 1)
+    return name, source
+
+
+def parse_args():
+    """ Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Multi-stream Mask R-CNN + Deep SORT tracking server")
+    parser.add_argument(
+        "--host", help="Address to listen on.", default="127.0.0.1")
+    parser.add_argument(
+        "--port", help="TCP port to listen on.", default=8080, type=int)
+    parser.add_argument(
+        "--unix_socket", help="Listen on a Unix socket at this path instead "
+        "of a TCP port.", default=None)
+    parser.add_argument(
+        "--stream", help="A stream to track on startup, as NAME=SOURCE, "
+        "where SOURCE is a video file or camera URL. Can be repeated.",
+        action="append", default=[], type=stream_string)
+    parser.add_argument(
+        "--detector_model", help="Path to the Mask R-CNN weights.",
+        default=video_pipeline.COCO_MODEL_PATH)
+    parser.add_argument(
+        "--encoder_model", help="Path to the freezed appearance descriptor "
+        "inference graph protobuf.",
+        default=video_pipeline.ENCODER_MODEL_PATH)
+    parser.add_argument(
+        "--class_ids", help="COCO class IDs to track. Defaults to all "
+        "classes.", type=int, nargs="*", default=None)
+    parser.add_argument(
+        "--min_confidence", help="Detection confidence threshold. Disregard "
+        "all detections that have a confidence lower than this value.",
+        default=0.9, type=float)
+    parser.add_argument(
+        "--min_detection_height", help="Threshold on the detection bounding "
+        "box height. Detections with height smaller than this value are "
+        "disregarded", default=0, type=int)
+    parser.add_argument(
+        "--nms_max_overlap", help="Non-maxima suppression threshold: Maximum "
+        "detection overlap.", default=1.0, type=float)
+    parser.add_argument(
+        "--max_cosine_distance", help="Gating threshold for cosine distance "
+        "metric (object appearance).", type=float, default=0.2)
+    parser.add_argument(
+        "--nn_budget", help="Maximum size of the appearance descriptors "
+        "gallery. If None, no budget is enforced.", type=int, default=100)
+    parser.add_argument(
+        "--lazy_features", help="Compute appearance descriptors only for "
+        "detections that cannot be associated by motion alone.",
+        default=False, type=video_pipeline.bool_string)
+    parser.add_argument(
+        "--detector_batch_size", help="Number of frames per Mask R-CNN "
+        "batch. Incomplete batches are padded, so every detector call costs "
+        "a full batch; set this to at most the number of concurrent "
+        "streams. Defaults to the number of --stream options, at most %d "
+        "(%d if there are none)." % ((MAX_DETECTOR_BATCH_SIZE, ) * 2),
+        default=None, type=int)
+    parser.add_argument(
+        "--encoder_batch_size", help="Maximum number of frames per encoder "
+        "batch.", default=16, type=int)
+    parser.add_argument(
+        "--batch_timeout_ms", help="Maximum time in milliseconds that a frame "
+        "waits for a batch to fill up.", default=20., type=float)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(
+        args.host, args.port, args.unix_socket, args.stream,
+        args.min_confidence, args.nms_max_overlap, args.min_detection_height,
+        args.max_cosine_distance, args.nn_budget, args.detector_model,
+        args.encoder_model, args.class_ids, args.lazy_features,
+        args.detector_batch_size, args.encoder_batch_size,
+        args.batch_timeout_ms)
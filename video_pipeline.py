@@ -0,0 +1,1212 @@
+# vim: expandtab:ts=4:sw=4
+"""Streaming Mask R-CNN + Deep SORT pipeline.
+
+Frames are decoded exactly once from a `cv2.VideoCapture` and passed through
+Mask R-CNN detection, appearance encoding, and Deep SORT tracking as a chain of
+generators. Unlike the `video2images.py` -> `demo.py` ->
+`generate_detections.py` -> `deep_sort_app.py` tool chain, no intermediate
+JPEG frames or detection files are written to disk.
+
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from deep_sort.application_util import keyframe
+from deep_sort.application_util import mosaic
+from deep_sort.application_util import motion
+from deep_sort.application_util import pipeline
+from deep_sort.application_util import preprocessing
+from deep_sort.application_util import realtime
+from deep_sort.application_util import visualization
+from deep_sort.deep_sort import nn_matching
+from deep_sort.deep_sort.detection import DetectionBatch
+from deep_sort.deep_sort.tracker import Tracker
+from deep_sort.tools import generate_detections
+
+# Root directory of the project
+ROOT_DIR = os.path.abspath(os.path.dirname(__file__))
+
+# Import Mask RCNN
+sys.path.append(os.path.join(ROOT_DIR, "Mask_RCNN"))
+sys.path.append(os.path.join(ROOT_DIR, "Mask_RCNN", "samples", "coco"))
+import mrcnn.model as modellib  # noqa: E402
+import coco  # noqa: E402
+
+# Directory to save logs and trained model
+MODEL_DIR = os.path.join(ROOT_DIR, "Mask_RCNN", "logs")
+
+# Local path to trained weights file
+COCO_MODEL_PATH = os.path.join(ROOT_DIR, "Mask_RCNN", "mask_rcnn_coco.h5")
+
+# Local path to the frozen appearance descriptor network
+ENCODER_MODEL_PATH = os.path.join(
+    ROOT_DIR, "deep_sort", "resources", "networks", "mars-small128.pb")
+
+
+class InferenceConfig(coco.CocoConfig):
+    # Set batch size to 1 since we'll be running inference on
+    # one image at a time. Batch size = GPU_COUNT * IMAGES_PER_GPU
+    GPU_COUNT = 1
+    IMAGES_PER_GPU = 1
+
+
+def create_detector(model_filename=COCO_MODEL_PATH, model_dir=MODEL_DIR,
+                    batch_size=1):
+    """Create a Mask R-CNN model in inference mode.
+
+    Parameters
+    ----------
+    model_filename : Optional[str]
+        Path to the trained MS-COCO weights.
+    model_dir : Optional[str]
+        Directory to save logs and trained model.
+    batch_size : Optional[int]
+        Number of images per call to `MaskRCNN.detect`.
+
+    Returns
+    -------
+    mrcnn.model.MaskRCNN
+        The detector with weights loaded.
+
+    """
+    config = InferenceConfig()
+    config.IMAGES_PER_GPU = batch_size
+    config.BATCH_SIZE = config.GPU_COUNT * batch_size
+    model = modellib.MaskRCNN(
+        mode="inference", model_dir=model_dir, config=config)
+    model.load_weights(model_filename, by_name=True)
+    return model
+
+
+def video_info(video_filename):
+    """Gather video information in the format of
+    `deep_sort_app.gather_sequence_info`, without decoding any frame.
+
+    Parameters
+    ----------
+    video_filename : str
+        Path to the video file.
+
+    Returns
+    -------
+    Dict
+        A dictionary with entries sequence_name, image_size, min_frame_idx,
+        max_frame_idx, and update_ms. If the video does not report its
+        frame count, max_frame_idx is set to `sys.maxsize`.
+
+    """
+    capture = cv2.VideoCapture(video_filename)
+    if not capture.isOpened():
+        raise ValueError("Failed to open video '%s'" % video_filename)
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_rate = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+
+    seq_info = {
+        "sequence_name": os.path.splitext(os.path.basename(video_filename))[0],
+        "image_size": (height, width),
+        "min_frame_idx": 1,
+        "max_frame_idx": frame_count if frame_count > 0 else sys.maxsize,
+        "update_ms": 1000. / frame_rate if frame_rate > 0 else None
+    }
+    return seq_info
+
+
+def read_frames(video_filename, first_frame_idx=1):
+    """Decode frames from a video file.
+
+    Parameters
+    ----------
+    video_filename : str
+        Path to the video file, or any other source accepted by
+        `cv2.VideoCapture`.
+    first_frame_idx : Optional[int]
+        Index of the first frame. Defaults to 1, as in MOTChallenge.
+
+    Returns
+    -------
+    Iterator[(int, ndarray)]
+        Yields the frame index and the BGR color image of each frame.
+
+    """
+    capture = cv2.VideoCapture(video_filename)
+    if not capture.isOpened():
+        raise ValueError("Failed to open video '%s'" % video_filename)
+    frame_idx = first_frame_idx
+    try:
+        while True:
+            ok, image = capture.read()
+            if not ok:
+                break
+            yield frame_idx, image
+            frame_idx += 1
+    finally:
+        capture.release()
+
+
+def to_detection_rows(frame_idx, result, class_ids=None):
+    """Convert a Mask R-CNN detection result to MOTChallenge detection rows.
+
+    Parameters
+    ----------
+    frame_idx : int
+        The frame index.
+    result : Dict
+        A single result of `MaskRCNN.detect`.
+    class_ids : Optional[array_like]
+        If not None, only detections of these class IDs are kept.
+
+    Returns
+    -------
+    ndarray
+        An Nx10 matrix of detections in MOTChallenge format (the same format
+        that `samples/demo.py` writes to det.txt).
+
+    """
+    rois, scores = result["rois"], result["scores"]
+    if class_ids is not None:
+        mask = np.isin(result["class_ids"], class_ids)
+        rois, scores = rois[mask], scores[mask]
+
+    # Convert {(y1, x1), (y2, x2)} to {(x, y), w, h}.
+    rows = np.full((len(rois), 10), -1.)
+    rows[:, 0] = frame_idx
+    rows[:, 2] = rois[:, 1]
+    rows[:, 3] = rois[:, 0]
+    rows[:, 4] = rois[:, 3] - rois[:, 1]
+    rows[:, 5] = rois[:, 2] - rois[:, 0]
+    rows[:, 6] = scores
+    return rows
+
+
+def detect_image(model, image, max_dim=None):
+    """Run Mask R-CNN on a single image.
+
+    Parameters
+    ----------
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode.
+    image : ndarray
+        The RGB color image.
+    max_dim : Optional[int]
+        If not None, the image is resized to this input size (a multiple of
+        64) instead of the configured `IMAGE_MAX_DIM`, which is faster, but
+        misses small objects. Boxes are still returned in image coordinates.
+
+    Returns
+    -------
+    Dict
+        The result of `MaskRCNN.detect`.
+
+    """
+    config = model.config
+    image_dims = config.IMAGE_MIN_DIM, config.IMAGE_MAX_DIM
+    if max_dim is not None:
+        config.IMAGE_MIN_DIM = min(config.IMAGE_MIN_DIM, max_dim)
+        config.IMAGE_MAX_DIM = max_dim
+    try:
+        return model.detect([image], verbose=0)[0]
+    finally:
+        config.IMAGE_MIN_DIM, config.IMAGE_MAX_DIM = image_dims
+
+
+def detect_frames(model, frames, class_ids=None, max_dim=None):
+    """Run Mask R-CNN on a stream of frames.
+
+    Parameters
+    ----------
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode.
+    frames : Iterator[(int, ndarray)]
+        Frame indices and BGR color images, e.g., from `read_frames`.
+    class_ids : Optional[array_like]
+        If not None, only detections of these class IDs are kept.
+    max_dim : Optional[int]
+        If not None, overrides the detector input size (see `detect_image`).
+
+    Returns
+    -------
+    Iterator[(int, ndarray, ndarray)]
+        Yields the frame index, the BGR color image, and the Nx10 matrix of
+        detections in MOTChallenge format.
+
+    """
+    for frame_idx, image in frames:
+        # Mask R-CNN is trained on RGB images.
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        result = detect_image(model, rgb_image, max_dim)
+        yield frame_idx, image, to_detection_rows(frame_idx, result, class_ids)
+
+
+def input_scale(model, image):
+    """Returns the factor by which the detector resizes a full frame.
+
+    The scale is computed like `mrcnn.utils.resize_image` does in "square"
+    mode: frames are upscaled such that their short side is at least
+    `IMAGE_MIN_DIM` (and by at least `IMAGE_MIN_SCALE`), unless this makes
+    their long side exceed `IMAGE_MAX_DIM`.
+
+    """
+    config = model.config
+    height, width = image.shape[:2]
+    scale = 1.
+    if config.IMAGE_MIN_DIM:
+        scale = max(1., float(config.IMAGE_MIN_DIM) / min(height, width))
+    if config.IMAGE_MIN_SCALE and scale < config.IMAGE_MIN_SCALE:
+        scale = float(config.IMAGE_MIN_SCALE)
+    if config.IMAGE_MAX_DIM and \
+            round(max(height, width) * scale) > config.IMAGE_MAX_DIM:
+        scale = float(config.IMAGE_MAX_DIM) / max(height, width)
+    return scale
+
+
+def detect_region(model, frame_idx, image, region, class_ids=None):
+    """Run Mask R-CNN on a region of a frame.
+
+    The detector input size is reduced such that the region is processed at
+    (about) the same scale as the full frame would be, which makes detection
+    on small regions cheaper.
+
+    Parameters
+    ----------
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode.
+    frame_idx : int
+        The frame index.
+    image : ndarray
+        The BGR color image.
+    region : (int, int, int, int)
+        The region in format `(x, y, w, h)`.
+    class_ids : Optional[array_like]
+        If not None, only detections of these class IDs are kept.
+
+    Returns
+    -------
+    ndarray
+        The Nx10 matrix of detections in MOTChallenge format, in frame
+        coordinates.
+
+    """
+    x, y, w, h = region
+    max_dim = model.config.IMAGE_MAX_DIM
+    scale = input_scale(model, image)
+    max_dim = min(
+        max_dim, max(256, 64 * int(np.ceil(scale * max(w, h) / 64.))))
+    (_, _, rows), = detect_frames(
+        model, [(frame_idx, image[y:y + h, x:x + w])], class_ids, max_dim)
+    rows[:, 2] += x
+    rows[:, 3] += y
+    return rows
+
+
+def detect_mosaic(model, frame_idx, image, roi_mosaic, regions, placements,
+                  class_ids=None):
+    """Run Mask R-CNN on a mosaic of regions of a frame.
+
+    Parameters
+    ----------
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode.
+    frame_idx : int
+        The frame index.
+    image : ndarray
+        The BGR color image.
+    roi_mosaic : mosaic.RoiMosaic
+        Creates the canvas.
+    regions : List[(int, int, int, int)]
+        The regions of interest, see `RoiMosaic.plan`.
+    placements : List[...]
+        The placements of the regions on the canvas, see `RoiMosaic.plan`.
+    class_ids : Optional[array_like]
+        If not None, only detections of these class IDs are kept.
+
+    Returns
+    -------
+    ndarray
+        The Nx10 matrix of detections in MOTChallenge format, in frame
+        coordinates.
+
+    """
+    canvas = roi_mosaic.render(image, placements)
+    (_, _, rows), = detect_frames(
+        model, [(frame_idx, canvas)], class_ids, roi_mosaic.canvas_size)
+    indices, boxes = roi_mosaic.to_frame(rows[:, 2:6], regions, placements)
+    rows = rows[indices]
+    rows[:, 2:6] = boxes
+    return rows
+
+
+def in_graph(graph, transform):
+    """Wrap a pipeline stage such that it runs with `graph` as the default
+    graph.
+
+    TensorFlow keeps the default graph per thread, so a Keras model that is
+    called from a `pipeline.PipelineRunner` worker thread must enter the
+    graph it was created in (see also
+    `tracking_server.create_detector_batcher`).
+
+    Parameters
+    ----------
+    graph : tf.Graph
+        The graph of the detector, e.g., `tf.get_default_graph()` of the
+        thread that has created it.
+    transform : Callable[Iterator] -> Iterator
+        The pipeline stage.
+
+    Returns
+    -------
+    Callable[Iterator] -> Iterator
+        The wrapped pipeline stage.
+
+    """
+    def graph_transform(items):
+        # The generator is consumed by a single worker thread, such that the
+        # graph stays the default graph of that thread while it runs.
+        with graph.as_default():
+            for item in transform(items):
+                yield item
+    return graph_transform
+
+
+def encode_frames(encoder, detected_frames):
+    """Compute appearance descriptors for a stream of detections.
+
+    Parameters
+    ----------
+    encoder : Callable[image, ndarray] -> ndarray
+        The encoder function returned by
+        `generate_detections.create_box_encoder`.
+    detected_frames : Iterator[(int, ndarray, ndarray)]
+        Output of `detect_frames`.
+
+    Returns
+    -------
+    Iterator[(int, ndarray, ndarray)]
+        Yields the frame index, the BGR color image, and the detection matrix
+        of this frame with feature vectors appended to each row (the same
+        format that `generate_detections` stores).
+
+    """
+    for frame_idx, image, rows in detected_frames:
+        features = encoder(image, rows[:, 2:6].copy())
+        yield frame_idx, image, np.c_[rows, features]
+
+
+def update_tracker(tracker, image, rows, min_confidence, nms_max_overlap,
+                   min_detection_height, encoder=None, statistics=None,
+                   region=None):
+    """Filter the detections of a frame and run the measurement update of the
+    multi-target tracker (`Tracker.predict` must have been called).
+
+    Parameters
+    ----------
+    tracker : deep_sort.tracker.Tracker
+        The multi-target tracker.
+    image : ndarray
+        The BGR color image.
+    rows : ndarray
+        The detection matrix of this frame, with feature vectors appended to
+        each row unless `encoder` is not None.
+    min_confidence : float
+        Detection confidence threshold. Disregard all detections that have
+        a confidence lower than this value.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold. Disregard all detections that have
+        a height lower than this value.
+    encoder : Optional[Callable[image, ndarray] -> ndarray]
+        If not None, appearance descriptors are computed on demand with this
+        encoder, only for the detections that the tracker cannot associate
+        by motion alone (see the `feature_callback` of `Tracker.update`).
+    statistics : Optional[Dict[str, int]]
+        If not None, the number of detections passed to the tracker and the
+        number of encoded detections are accumulated in entries `detections`
+        and `encoded`.
+    region : Optional[(int, int, int, int)]
+        If not None, the region `(x, y, w, h)` of the image that the detector
+        has searched (see `Tracker.update`).
+
+    Returns
+    -------
+    DetectionBatch
+        The detections that were passed to the tracker.
+
+    """
+    mask = np.logical_and(
+        rows[:, 5] >= min_detection_height, rows[:, 6] >= min_confidence)
+    detections = DetectionBatch(
+        rows[mask, 2:6], rows[mask, 6], rows[mask, 10:])
+
+    # Run non-maxima suppression.
+    indices = preprocessing.non_max_suppression(
+        detections.tlwh, nms_max_overlap, detections.confidence)
+    detections = detections[indices]
+
+    def encode(indices):
+        if statistics is not None:
+            statistics["encoded"] += len(indices)
+        return encoder(image, detections.tlwh[indices].copy())
+
+    feature_callback = encode if encoder is not None else None
+    if statistics is not None:
+        statistics["detections"] += len(detections)
+
+    tracker.update(detections, feature_callback, region)
+    return detections
+
+
+def track_frames(tracker, encoded_frames, min_confidence, nms_max_overlap,
+                 min_detection_height, encoder=None, statistics=None):
+    """Run the multi-target tracker on a stream of detections.
+
+    Parameters
+    ----------
+    tracker : deep_sort.tracker.Tracker
+        The multi-target tracker.
+    encoded_frames : Iterator[(int, ndarray, ndarray)]
+        Output of `encode_frames`, or output of `detect_frames` if `encoder`
+        is not None.
+    min_confidence : float
+        Detection confidence threshold. Disregard all detections that have
+        a confidence lower than this value.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold. Disregard all detections that have
+        a height lower than this value.
+    encoder : Optional[Callable[image, ndarray] -> ndarray]
+        See `update_tracker`.
+    statistics : Optional[Dict[str, int]]
+        See `update_tracker`.
+
+    Returns
+    -------
+    Iterator[(int, ndarray, DetectionBatch, List[Track])]
+        Yields the frame index, the BGR color image, the detections that
+        were passed to the tracker, and a snapshot of the tracker's tracks
+        after the update. The snapshot is not modified when the tracker
+        processes the next frame, such that it can be consumed concurrently.
+
+    """
+    for frame_idx, image, rows in encoded_frames:
+        tracker.predict()
+        detections = update_tracker(
+            tracker, image, rows, min_confidence, nms_max_overlap,
+            min_detection_height, encoder, statistics)
+        yield frame_idx, image, detections, [
+            copy.copy(t) for t in tracker.tracks]
+
+
+def track_keyframes(tracker, scheduler, model, encoder, frames,
+                    min_confidence, nms_max_overlap, min_detection_height,
+                    class_ids=None, lazy_features=False, refiner=None,
+                    statistics=None):
+    """Run detection only on keyframes and the multi-target tracker on all
+    frames of a stream. Between keyframes, tracks are advanced by Kalman
+    filter prediction.
+
+    Parameters
+    ----------
+    tracker : deep_sort.tracker.Tracker
+        The multi-target tracker.
+    scheduler : keyframe.KeyframeScheduler
+        Decides on which frames the detector runs.
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode.
+    encoder : Callable[image, ndarray] -> ndarray
+        The encoder function returned by
+        `generate_detections.create_box_encoder`.
+    frames : Iterator[(int, ndarray)]
+        Frame indices and BGR color images, e.g., from `read_frames`.
+    min_confidence : float
+        Detection confidence threshold. Disregard all detections that have
+        a confidence lower than this value.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold. Disregard all detections that have
+        a height lower than this value.
+    class_ids : Optional[array_like]
+        If not None, only detections of these class IDs are kept.
+    lazy_features : Optional[bool]
+        If True, appearance descriptors are computed on demand (see
+        `update_tracker`).
+    refiner : Optional[keyframe.TemplateRefiner]
+        If not None, predicted positions between keyframes are refined by
+        template search.
+    statistics : Optional[Dict[str, int]]
+        See `update_tracker`.
+
+    Returns
+    -------
+    Iterator[(int, ndarray, DetectionBatch, List[Track], int)]
+        Yields the same as `track_frames` and, in addition, the number of
+        frames since the last keyframe (0 on keyframes). Detections are empty
+        on all other frames.
+
+    """
+    for frame_idx, image in frames:
+        tracker.predict()
+        if scheduler.is_keyframe(tracker):
+            (_, _, rows), = detect_frames(model, [(frame_idx, image)], class_ids)
+            if not lazy_features:
+                (_, _, rows), = encode_frames(
+                    encoder, [(frame_idx, image, rows)])
+            detections = update_tracker(
+                tracker, image, rows, min_confidence, nms_max_overlap,
+                min_detection_height, encoder if lazy_features else None,
+                statistics)
+            if refiner is not None:
+                refiner.set_templates(image, tracker.tracks)
+        else:
+            detections = DetectionBatch(np.zeros((0, 4)), np.zeros(0))
+            if refiner is not None:
+                tracker.correct(*refiner.refine(image, tracker.tracks))
+        yield frame_idx, image, detections, [
+            copy.copy(t) for t in tracker.tracks], \
+            scheduler.frames_since_keyframe
+
+
+def track_motion(tracker, gate, model, encoder, frames, min_confidence,
+                 nms_max_overlap, min_detection_height, class_ids=None,
+                 lazy_features=False, statistics=None):
+    """Run detection only on the changed region of frames from a static
+    camera, and the multi-target tracker on all frames of a stream.
+
+    Outside of the changed region (and on frames without any change), the
+    scene is assumed to be unchanged: confirmed tracks that were observed on
+    the previous frame keep their last position, such that they stay alive
+    without running the detector. Unmatched tentative and lost tracks are
+    marked as missed on every frame, such that they are deleted as usual.
+
+    Parameters
+    ----------
+    tracker : deep_sort.tracker.Tracker
+        The multi-target tracker.
+    gate : motion.MotionGate
+        Finds the changed region of each frame.
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode.
+    encoder : Callable[image, ndarray] -> ndarray
+        The encoder function returned by
+        `generate_detections.create_box_encoder`.
+    frames : Iterator[(int, ndarray)]
+        Frame indices and BGR color images, e.g., from `read_frames`.
+    min_confidence : float
+        Detection confidence threshold. Disregard all detections that have
+        a confidence lower than this value.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold. Disregard all detections that have
+        a height lower than this value.
+    class_ids : Optional[array_like]
+        If not None, only detections of these class IDs are kept.
+    lazy_features : Optional[bool]
+        If True, appearance descriptors are computed on demand (see
+        `update_tracker`).
+    statistics : Optional[Dict[str, int]]
+        See `update_tracker`.
+
+    Returns
+    -------
+    Iterator[(int, ndarray, DetectionBatch, List[Track])]
+        Yields the same as `track_frames`. Detections are empty on frames
+        without change.
+
+    """
+    for frame_idx, image in frames:
+        last_positions = dict(
+            (t.track_id, t.to_tlwh()) for t in tracker.tracks
+            if t.is_confirmed() and t.time_since_update == 0)
+        tracker.predict()
+        region = gate.apply(image)
+        if region is None:
+            # Nothing has been searched: missed and tentative tracks are
+            # marked as missed, the others are kept alive below.
+            detections = DetectionBatch(np.zeros((0, 4)), np.zeros(0))
+            tracker.update(detections, region=(0, 0, 0, 0))
+        else:
+            if region == (0, 0, image.shape[1], image.shape[0]):
+                (_, _, rows), = detect_frames(
+                    model, [(frame_idx, image)], class_ids)
+                region = None
+                last_positions = {}
+            else:
+                rows = detect_region(
+                    model, frame_idx, image, region, class_ids)
+            if not lazy_features:
+                (_, _, rows), = encode_frames(
+                    encoder, [(frame_idx, image, rows)])
+            detections = update_tracker(
+                tracker, image, rows, min_confidence, nms_max_overlap,
+                min_detection_height, encoder if lazy_features else None,
+                statistics, region)
+
+        track_indices, boxes = [], []
+        for i, track in enumerate(tracker.tracks):
+            if track.track_id not in last_positions or \
+                    track.time_since_update == 0:
+                continue
+            if region is not None:
+                x, y, w, h = region
+                if x <= track.mean[0] < x + w and y <= track.mean[1] < y + h:
+                    continue  # Searched, but not detected.
+            track_indices.append(i)
+            boxes.append(last_positions[track.track_id])
+        # An unchanged image region is evidence that the object is still in
+        # place, hence the correction counts as an observation.
+        tracker.correct(track_indices, boxes, observed=True)
+        yield frame_idx, image, detections, [
+            copy.copy(t) for t in tracker.tracks]
+
+
+def track_mosaic(tracker, roi_mosaic, model, encoder, frames, min_confidence,
+                 nms_max_overlap, min_detection_height, class_ids=None,
+                 lazy_features=False, statistics=None):
+    """Run the detector on a mosaic of the regions around tracks and the
+    entry zones of each frame (and periodically on the full frame), and the
+    multi-target tracker on all frames of a stream.
+
+    Parameters
+    ----------
+    tracker : deep_sort.tracker.Tracker
+        The multi-target tracker.
+    roi_mosaic : mosaic.RoiMosaic
+        Decides between mosaic and full-frame detection, and creates the
+        mosaic.
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode.
+    encoder : Callable[image, ndarray] -> ndarray
+        The encoder function returned by
+        `generate_detections.create_box_encoder`.
+    frames : Iterator[(int, ndarray)]
+        Frame indices and BGR color images, e.g., from `read_frames`.
+    min_confidence : float
+        Detection confidence threshold. Disregard all detections that have
+        a confidence lower than this value.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold. Disregard all detections that have
+        a height lower than this value.
+    class_ids : Optional[array_like]
+        If not None, only detections of these class IDs are kept.
+    lazy_features : Optional[bool]
+        If True, appearance descriptors are computed on demand (see
+        `update_tracker`).
+    statistics : Optional[Dict[str, int]]
+        See `update_tracker`.
+
+    Returns
+    -------
+    Iterator[(int, ndarray, DetectionBatch, List[Track])]
+        Yields the same as `track_frames`.
+
+    """
+    for frame_idx, image in frames:
+        tracker.predict()
+        plan = roi_mosaic.plan(
+            tracker.tracks, image.shape, input_scale(model, image))
+        if plan is None:
+            (_, _, rows), = detect_frames(
+                model, [(frame_idx, image)], class_ids)
+        else:
+            rows = detect_mosaic(
+                model, frame_idx, image, roi_mosaic, plan[0], plan[1],
+                class_ids)
+        if not lazy_features:
+            (_, _, rows), = encode_frames(encoder, [(frame_idx, image, rows)])
+        detections = update_tracker(
+            tracker, image, rows, min_confidence, nms_max_overlap,
+            min_detection_height, encoder if lazy_features else None,
+            statistics)
+        yield frame_idx, image, detections, [
+            copy.copy(t) for t in tracker.tracks]
+
+
+def track_realtime(tracker, shedder, model, encoder, frames, min_confidence,
+                   nms_max_overlap, min_detection_height, class_ids=None,
+                   lazy_features=False, reduced_max_dim=512, statistics=None):
+    """Run the detector and the multi-target tracker on a live stream, with a
+    per-frame amount of work that keeps latency within the deadline of a
+    `realtime.LoadShedder`.
+
+    Depending on the action chosen by the shedder, a frame is processed with
+    the detector at full or reduced resolution, advanced by Kalman filter
+    prediction only, or dropped. The tracker is predicted over the frame gap
+    since the previous processed frame, such that motion is extrapolated over
+    the real elapsed time.
+
+    Parameters
+    ----------
+    tracker : deep_sort.tracker.Tracker
+        The multi-target tracker.
+    shedder : realtime.LoadShedder
+        Decides how much work to spend on each frame.
+    model : mrcnn.model.MaskRCNN
+        The detector in inference mode.
+    encoder : Callable[image, ndarray] -> ndarray
+        The encoder function returned by
+        `generate_detections.create_box_encoder`.
+    frames : Iterator[(int, ndarray, float)]
+        Frame indices, BGR color images, and capture times, e.g., from a
+        `realtime.LiveFrameSource`.
+    min_confidence : float
+        Detection confidence threshold. Disregard all detections that have
+        a confidence lower than this value.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold. Disregard all detections that have
+        a height lower than this value.
+    class_ids : Optional[array_like]
+        If not None, only detections of these class IDs are kept.
+    lazy_features : Optional[bool]
+        If True, appearance descriptors are computed on demand (see
+        `update_tracker`).
+    reduced_max_dim : Optional[int]
+        The detector input size of frames that are processed at reduced
+        resolution (see `detect_image`).
+    statistics : Optional[Dict[str, int]]
+        See `update_tracker`.
+
+    Returns
+    -------
+    Iterator[(int, ndarray, DetectionBatch, List[Track], int)]
+        Yields the same as `track_keyframes` for each frame that has not been
+        dropped, where the last entry is the number of processed frames since
+        the detector last ran.
+
+    """
+    last_frame_idx = None
+    frames_since_detection = 0
+    for frame_idx, image, capture_time in frames:
+        action = shedder.decide(capture_time)
+        if action == realtime.DROP:
+            continue
+        start_time = time.time()
+        tracker.predict(
+            1 if last_frame_idx is None else frame_idx - last_frame_idx)
+        last_frame_idx = frame_idx
+
+        if action == realtime.PREDICT:
+            detections = DetectionBatch(np.zeros((0, 4)), np.zeros(0))
+            frames_since_detection += 1
+        else:
+            max_dim = (
+                reduced_max_dim if action == realtime.DETECT_REDUCED else None)
+            (_, _, rows), = detect_frames(
+                model, [(frame_idx, image)], class_ids, max_dim)
+            if not lazy_features:
+                (_, _, rows), = encode_frames(
+                    encoder, [(frame_idx, image, rows)])
+            detections = update_tracker(
+                tracker, image, rows, min_confidence, nms_max_overlap,
+                min_detection_height, encoder if lazy_features else None,
+                statistics)
+            frames_since_detection = 0
+        tracks = [copy.copy(t) for t in tracker.tracks]
+        shedder.record(action, capture_time, start_time)
+        yield frame_idx, image, detections, tracks, frames_since_detection
+
+
+def run(video_filename, output_file, min_confidence, nms_max_overlap,
+        min_detection_height, max_cosine_distance, nn_budget, display,
+        detector_model=COCO_MODEL_PATH, encoder_model=ENCODER_MODEL_PATH,
+        class_ids=None, parallel=False, queue_size=2, lazy_features=False,
+        keyframe_interval=1, keyframe_uncertainty=None,
+        refine_templates=False, deadline_ms=None, reduced_max_dim=512,
+        max_detection_gap=None, motion_gating=False,
+        motion_refresh_interval=None, mosaic_interval=1, mosaic_size=512):
+    """Run Mask R-CNN detection and multi-target tracking on a video.
+
+    Parameters
+    ----------
+    video_filename : str
+        Path to the input video.
+    output_file : str
+        Path to the tracking output file. This file will contain the tracking
+        results on completion. In keyframe and real-time mode, the seventh
+        column is 1 for track positions that have been detected on the frame
+        and 0 for predicted (or template-refined) positions.
+    min_confidence : float
+        Detection confidence threshold. Disregard all detections that have
+        a confidence lower than this value.
+    nms_max_overlap: float
+        Maximum detection overlap (non-maxima suppression threshold).
+    min_detection_height : int
+        Detection height threshold. Disregard all detections that have
+        a height lower than this value.
+    max_cosine_distance : float
+        Gating threshold for cosine distance metric (object appearance).
+    nn_budget : Optional[int]
+        Maximum size of the appearance descriptor gallery. If None, no budget
+        is enforced.
+    display : bool
+        If True, show visualization of intermediate tracking results.
+    detector_model : Optional[str]
+        Path to the Mask R-CNN weights.
+    encoder_model : Optional[str]
+        Path to the frozen appearance descriptor network.
+    class_ids : Optional[List[int]]
+        If not None, only track objects of these COCO class IDs.
+    parallel : Optional[bool]
+        If True, frame decoding, detection, encoding, and tracking run
+        concurrently in separate threads, such that detection of frame t+1
+        overlaps with encoding and tracking of frame t. Per-stage statistics
+        are printed on completion.
+    queue_size : Optional[int]
+        Maximum number of frames buffered between two stages when `parallel`
+        is True.
+    lazy_features : Optional[bool]
+        If True, appearance descriptors are computed in the tracking stage,
+        only for detections that cannot be associated by motion alone,
+        instead of for all detections in a separate encoding stage. The
+        fraction of encoded detections is printed on completion.
+    keyframe_interval : Optional[int]
+        If larger than 1, detection runs only on keyframes, at most this many
+        frames apart (see `keyframe.KeyframeScheduler`), and tracks are
+        advanced by prediction in between. Detection then runs in the
+        tracking stage.
+    keyframe_uncertainty : Optional[float]
+        If not None, a keyframe is scheduled earlier when the position
+        uncertainty of a track relative to its height exceeds this value.
+    refine_templates : Optional[bool]
+        If True, predicted positions between keyframes are refined by a
+        local template search (see `keyframe.TemplateRefiner`).
+    deadline_ms : Optional[float]
+        If not None, run in real-time mode: frames are captured in a
+        background thread that keeps only the most recent frame, and each
+        frame must be processed within this latency budget in milliseconds
+        after capture. When processing falls behind, frames are detected at
+        reduced resolution, advanced by prediction only, or dropped (see
+        `realtime.LoadShedder`). Video files are replayed at their frame
+        rate. Drop and latency statistics are printed on completion. Cannot
+        be combined with `parallel` or keyframe mode.
+    reduced_max_dim : Optional[int]
+        The detector input size in real-time mode when the full resolution
+        does not fit the deadline (a multiple of 64). If None, the detector
+        always runs at full resolution.
+    max_detection_gap : Optional[int]
+        If not None, the detector runs in real-time mode at least once every
+        this many frames, even if it misses the deadline.
+    motion_gating : Optional[bool]
+        If True, the detector is skipped on frames without motion and
+        restricted to the changed region otherwise (see `motion.MotionGate`,
+        for static cameras). Detection then runs in the tracking stage.
+        Cannot be combined with keyframe mode.
+    motion_refresh_interval : Optional[int]
+        If not None, the detector runs on the full frame at least once every
+        this many frames when `motion_gating` is True.
+    mosaic_interval : Optional[int]
+        If larger than 1, the detector runs on the full frame only every this
+        many frames, and on a `mosaic_size` x `mosaic_size` mosaic of the
+        regions around tracks and the entry zones at the frame borders in
+        between (see `mosaic.RoiMosaic`). Detection then runs in the tracking
+        stage. Frames whose regions do not fit the mosaic fall back to the
+        full frame, e.g., in crowded scenes or for frames that the detector
+        upscales. Cannot be combined with keyframe or motion gating mode.
+    mosaic_size : Optional[int]
+        The side length of the mosaic (a multiple of 64).
+
+    """
+    num_detection_modes = sum((
+        keyframe_interval > 1, motion_gating, mosaic_interval > 1))
+    if deadline_ms is not None and (parallel or num_detection_modes > 0):
+        raise ValueError(
+            "Real-time mode cannot be combined with parallel, keyframe, "
+            "motion gating, or mosaic mode")
+    if num_detection_modes > 1:
+        raise ValueError(
+            "Only one of keyframe, motion gating, and mosaic mode can be "
+            "enabled")
+    seq_info = video_info(video_filename)
+    model = create_detector(detector_model)
+    graph = tf.get_default_graph()  # Entered by detector worker stages.
+    encoder = generate_detections.create_box_encoder(
+        encoder_model, batch_size=32)
+    metric = nn_matching.NearestNeighborDistanceMetric(
+        "cosine", max_cosine_distance, nn_budget)
+    tracker = Tracker(metric)
+    results = []
+    statistics = {"detections": 0, "encoded": 0}
+
+    def encode_stage(x):
+        return x if lazy_features else encode_frames(encoder, x)
+
+    def track_stage(x):
+        return track_frames(
+            tracker, x, min_confidence, nms_max_overlap, min_detection_height,
+            encoder if lazy_features else None, statistics)
+
+    # In keyframe, motion gating, and mosaic mode, detection depends on the
+    # tracker state and runs in the tracking stage.
+    scheduler, gate, roi_mosaic = None, None, None
+    if keyframe_interval > 1:
+        scheduler = keyframe.KeyframeScheduler(
+            keyframe_interval, keyframe_uncertainty)
+        refiner = keyframe.TemplateRefiner() if refine_templates else None
+
+        def detect_track_stage(x):
+            return track_keyframes(
+                tracker, scheduler, model, encoder, x, min_confidence,
+                nms_max_overlap, min_detection_height, class_ids,
+                lazy_features, refiner, statistics)
+    elif motion_gating:
+        gate = motion.MotionGate(refresh_interval=motion_refresh_interval)
+
+        def detect_track_stage(x):
+            return track_motion(
+                tracker, gate, model, encoder, x, min_confidence,
+                nms_max_overlap, min_detection_height, class_ids,
+                lazy_features, statistics)
+    elif mosaic_interval > 1:
+        roi_mosaic = mosaic.RoiMosaic(
+            mosaic_size, full_frame_interval=mosaic_interval)
+
+        def detect_track_stage(x):
+            return track_mosaic(
+                tracker, roi_mosaic, model, encoder, x, min_confidence,
+                nms_max_overlap, min_detection_height, class_ids,
+                lazy_features, statistics)
+    else:
+        detect_track_stage = None
+
+    frames = read_frames(video_filename, seq_info["min_frame_idx"])
+    runner = None
+    source, shedder = None, None
+    if deadline_ms is not None:
+        # Warm up the detector at both input sizes, such that graph
+        # initialization does not distort the cost estimates of the shedder.
+        blank_image = np.zeros(
+            tuple(seq_info["image_size"]) + (3, ), dtype=np.uint8)
+        for max_dim in {None, reduced_max_dim}:
+            detect_image(model, blank_image, max_dim)
+
+        shedder = realtime.LoadShedder(
+            deadline_ms / 1000., reduced_max_dim is not None,
+            max_detection_gap)
+        frame_rate = None
+        if seq_info["max_frame_idx"] != sys.maxsize and seq_info["update_ms"]:
+            frame_rate = 1000. / seq_info["update_ms"]
+        source = realtime.LiveFrameSource(frames, frame_rate=frame_rate)
+        frames = track_realtime(
+            tracker, shedder, model, encoder, iter(source), min_confidence,
+            nms_max_overlap, min_detection_height, class_ids, lazy_features,
+            reduced_max_dim, statistics)
+    elif detect_track_stage is not None and parallel:
+        # The detector depends on the tracker state; only decoding runs
+        # concurrently.
+        runner = pipeline.PipelineRunner(queue_size)
+        runner.add_source("decode", frames)
+        runner.add_stage("track", in_graph(graph, detect_track_stage))
+        frames = runner.run(sink_name="sink")
+    elif detect_track_stage is not None:
+        frames = detect_track_stage(frames)
+    elif parallel:
+        runner = pipeline.PipelineRunner(queue_size)
+        runner.add_source("decode", frames)
+        runner.add_stage("detect", in_graph(
+            graph, lambda x: detect_frames(model, x, class_ids)))
+        if not lazy_features:
+            runner.add_stage("encode", encode_stage)
+        runner.add_stage("track", track_stage)
+        frames = runner.run(sink_name="sink")
+    else:
+        frames = track_stage(encode_stage(
+            detect_frames(model, frames, class_ids)))
+    start = time.time()
+
+    def frame_callback(vis, frame_idx):
+        try:
+            item = next(frames)
+        except StopIteration:
+            return False
+        frame_idx, image, detections, tracks = item[:4]
+        frames_since_keyframe = item[4] if len(item) > 4 else None
+        print("Processing frame %05d (Working time: %.2f sec)" % (
+            frame_idx, time.time() - start))
+
+        # Update visualization.
+        if display:
+            vis.set_image(image.copy())
+            vis.draw_detections(detections)
+            vis.draw_trackers(tracks)
+
+        # Store results. In keyframe mode, tracks that were observed on the
+        # last keyframe are reported with their predicted position.
+        max_time_since_update = 1 + (frames_since_keyframe or 0)
+        for track in tracks:
+            if not track.is_confirmed() or \
+                    track.time_since_update > max_time_since_update:
+                continue
+            is_observed = frames_since_keyframe is None or (
+                frames_since_keyframe == 0 and track.time_since_update == 0)
+            bbox = track.to_tlwh()
+            results.append([
+                frame_idx, track.track_id, bbox[0], bbox[1], bbox[2], bbox[3],
+                is_observed])
+
+    # Run tracker.
+    if display:
+        visualizer = visualization.Visualization(seq_info, update_ms=5)
+    else:
+        visualizer = visualization.NoVisualization(seq_info)
+    visualizer.run(frame_callback)
+    frames.close()
+    if source is not None:
+        source.close()
+        print("Dropped %d of %d captured frames before processing" % (
+            source.num_dropped, source.num_captured))
+        print(shedder.format_statistics())
+    if runner is not None:
+        print(runner.format_statistics())
+    if scheduler is not None:
+        print("Ran detector on %d of %d frames" % (
+            scheduler.num_keyframes, scheduler.num_frames))
+    if gate is not None:
+        print("Ran detector on %d of %d frames (%d on a changed region)" % (
+            gate.num_frames - gate.num_static, gate.num_frames,
+            gate.num_partial))
+    if roi_mosaic is not None:
+        print("Ran detector on the full frame on %d of %d frames "
+              "(%d because the regions did not fit the mosaic)" % (
+                  roi_mosaic.num_full_frames, roi_mosaic.num_frames,
+                  roi_mosaic.num_fallbacks))
+    if lazy_features:
+        print("Encoded %d of %d detections (%.1f%%)" % (
+            statistics["encoded"], statistics["detections"],
+            100. * statistics["encoded"] / max(statistics["detections"], 1)))
+
+    # Store results.
+    with open(output_file, 'w') as f:
+        for row in results:
+            print('%d,%d,%.2f,%.2f,%.2f,%.2f,%d,-1,-1,-1' % (
+                row[0], row[1], row[2], row[3], row[4], row[5], row[6]),
+                file=f)
+
+
+def bool_string(input_string):
+    if input_string not in {"True", "False"}:
+        raise ValueError("Please Enter a valid Ture/False choice")
+    else:
+        return input_string == "True"
+
+
+def parse_args():
+    """ Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Mask R-CNN + Deep SORT")
+    parser.add_argument(
+        "--video", help="Path to the input video.", required=True)
+    parser.add_argument(
+        "--output_file", help="Path to the tracking output file. This file "
+        "will contain the tracking results on completion.",
+        default="result.txt")
+    parser.add_argument(
+        "--detector_model", help="Path to the Mask R-CNN weights.",
+        default=COCO_MODEL_PATH)
+    parser.add_argument(
+        "--encoder_model", help="Path to the freezed appearance descriptor "
+        "inference graph protobuf.", default=ENCODER_MODEL_PATH)
+    parser.add_argument(
+        "--class_ids", help="COCO class IDs to track. Defaults to all "
+        "classes.", type=int, nargs="*", default=None)
+    parser.add_argument(
+        "--min_confidence", help="Detection confidence threshold. Disregard "
+        "all detections that have a confidence lower than this value.",
+        default=0.9, type=float)
+    parser.add_argument(
+        "--min_detection_height", help="Threshold on the detection bounding "
+        "box height. Detections with height smaller than this value are "
+        "disregarded", default=0, type=int)
+    parser.add_argument(
+        "--nms_max_overlap", help="Non-maxima suppression threshold: Maximum "
+        "detection overlap.", default=1.0, type=float)
+    parser.add_argument(
+        "--max_cosine_distance", help="Gating threshold for cosine distance "
+        "metric (object appearance).", type=float, default=0.2)
+    parser.add_argument(
+        "--nn_budget", help="Maximum size of the appearance descriptors "
+        "gallery. If None, no budget is enforced.", type=int, default=100)
+    parser.add_argument(
+        "--display", help="Show intermediate tracking results",
+        default=True, type=bool_string)
+    parser.add_argument(
+        "--parallel", help="Run decoding, detection, encoding, and tracking "
+        "concurrently in separate threads.", default=False, type=bool_string)
+    parser.add_argument(
+        "--queue_size", help="Maximum number of frames buffered between two "
+        "pipeline stages (at least 1).", default=2, type=int)
+    parser.add_argument(
+        "--lazy_features", help="Compute appearance descriptors only for "
+        "detections that cannot be associated by motion alone.",
+        default=False, type=bool_string)
+    parser.add_argument(
+        "--keyframe_interval", help="Maximum number of frames between two "
+        "detector runs. Tracks are predicted in between.", default=1,
+        type=int)
+    parser.add_argument(
+        "--keyframe_uncertainty", help="Run the detector earlier when the "
+        "position uncertainty of a track relative to its height exceeds this "
+        "value.", default=None, type=float)
+    parser.add_argument(
+        "--refine_templates", help="Refine predicted positions between "
+        "keyframes by template search.", default=False, type=bool_string)
+    parser.add_argument(
+        "--deadline_ms", help="Real-time mode: latency budget per frame in "
+        "milliseconds. Frames are detected at reduced resolution, predicted, "
+        "or dropped when processing falls behind.", default=None,
+        type=float)
+    parser.add_argument(
+        "--reduced_max_dim", help="Detector input size in real-time mode when "
+        "the full resolution does not fit the deadline.", default=512,
+        type=int)
+    parser.add_argument(
+        "--max_detection_gap", help="Real-time mode: run the detector at "
+        "least once every this many frames.", default=None, type=int)
+    parser.add_argument(
+        "--motion_gating", help="Skip detection on frames without motion and "
+        "restrict it to the changed region otherwise (static cameras).",
+        default=False, type=bool_string)
+    parser.add_argument(
+        "--motion_refresh_interval", help="With motion gating, run the "
+        "detector on the full frame at least once every this many frames.",
+        default=None, type=int)
+    parser.add_argument(
+        "--mosaic_interval", help="Run the detector on the full frame only "
+        "every this many frames, and on a mosaic of the regions around "
+        "tracks and the frame borders in between. Frames whose regions do "
+        "not fit the mosaic fall back to the full frame.", default=1,
+        type=int)
+    parser.add_argument(
+        "--mosaic_size", help="Side length of the mosaic in pixels (a "
+        "multiple of 64).", default=512, type=int)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(
+        args.video, args.output_file, args.min_confidence,
+        args.nms_max_overlap, args.min_detection_height,
+        args.max_cosine_distance, args.nn_budget, args.display,
+        args.detector_model, args.encoder_model, args.class_ids,
+        args.parallel, args.queue_size, args.lazy_features,
+        args.keyframe_interval, args.keyframe_uncertainty,
+        args.refine_templates, args.deadline_ms, args.reduced_max_dim,
+        args.max_detection_gap, args.motion_gating,
+        args.motion_refresh_interval, args.mosaic_interval, args.mosaic_size)